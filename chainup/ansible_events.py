@@ -0,0 +1,177 @@
+import json
+
+# Callback plugin installed into PLAYBOOKS_DIR/callback_plugins, runs on the ops master under python 2 or 3.
+CALLBACK_PLUGIN = r'''# Generated by chainup.
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+import json
+import sys
+
+from ansible.plugins.callback import CallbackBase
+
+PREFIX = '@@chainup-event:'
+
+
+def play_hosts(play):
+    try:
+        return [h.get_name() for h in play.get_variable_manager()._inventory.get_hosts(play.hosts)]
+    except Exception:
+        return None
+
+
+def play_tasks(play):
+    try:
+        return count_tasks(play.compile()) + (0 if play.gather_facts is False else 1)
+    except Exception:
+        return None
+
+
+def count_tasks(blocks):
+    n = 0
+    for block in blocks:
+        for part in (block.block, block.rescue, block.always):
+            for task in part:
+                if hasattr(task, 'block'):
+                    n += count_tasks([task])
+                elif getattr(task, 'action', None) != 'meta':
+                    n += 1
+    return n
+
+
+class CallbackModule(CallbackBase):
+    """One JSON line per play, task and host result, read by chainup while the playbook runs."""
+    CALLBACK_VERSION = 2.0
+    CALLBACK_TYPE = 'stdout'
+    CALLBACK_NAME = 'chainup_events'
+
+    def _emit(self, event, **fields):
+        fields['event'] = event
+        sys.stdout.write(PREFIX + json.dumps(fields) + '\n')
+        sys.stdout.flush()
+
+    def v2_playbook_on_start(self, playbook):
+        # Host results planned for the whole playbook, None if any play can not tell.
+        units = 0
+        try:
+            for play in playbook.get_plays():
+                hosts = play_hosts(play)
+                tasks = play_tasks(play)
+                if hosts is None or tasks is None:
+                    units = None
+                    break
+                units += hosts.__len__() * tasks
+        except Exception:
+            units = None
+        self._emit('playbook', units=units)
+
+    def v2_playbook_on_play_start(self, play):
+        self._emit('play', name=play.get_name(), hosts=play_hosts(play), tasks=play_tasks(play))
+
+    def v2_playbook_on_task_start(self, task, is_conditional):
+        self._emit('task', name=task.get_name())
+
+    def v2_playbook_on_handler_task_start(self, task):
+        self._emit('task', name=task.get_name())
+
+    def _result(self, status, result, ignored=False):
+        fields = {
+            'host': result._host.get_name(),
+            'task': result._task.get_name(),
+            'changed': bool(result._result.get('changed')),
+            'ignored': ignored,
+        }
+        if status in ('failed', 'unreachable'):
+            fields['msg'] = str(result._result.get('msg') or result._result.get('stderr') or '')
+        self._emit(status, **fields)
+
+    def v2_runner_on_ok(self, result):
+        self._result('ok', result)
+
+    def v2_runner_on_failed(self, result, ignore_errors=False):
+        self._result('failed', result, ignore_errors)
+
+    def v2_runner_on_skipped(self, result):
+        self._result('skipped', result)
+
+    def v2_runner_on_unreachable(self, result):
+        self._result('unreachable', result)
+
+    def v2_playbook_on_stats(self, stats):
+        self._emit('stats', hosts=dict((h, stats.summarize(h)) for h in stats.processed.keys()))
+'''
+
+
+class AnsibleEvents(object):
+    """State of one ansible-playbook run, from the lines written by the chainup_events callback plugin.
+
+    Events are dicts with 'event' being 'playbook'(units, the host results planned), 'play'(name, hosts, tasks),
+    'task'(name), a host result 'ok', 'failed', 'skipped' or 'unreachable'(host, task, changed, ignored, msg),
+    or 'stats'(hosts with the recap of each). Other output, like warnings, is left to the caller.
+    """
+    PLUGIN_NAME = 'chainup_events'
+    PLUGIN_DIR = 'callback_plugins'
+    PREFIX = '@@chainup-event:'
+    # Prepended to ansible-playbook to have the plugin write stdout
+    ENV = 'ANSIBLE_STDOUT_CALLBACK=' + PLUGIN_NAME
+    RESULTS = ('ok', 'failed', 'skipped', 'unreachable')
+
+    def __init__(self):
+        self.play = None
+        self.task = None
+        # Hosts with a result for the current task
+        self.task_done = 0
+        # {host: {result: count}}
+        self.results = {}
+        # Result events of failed hosts, not counting ignored errors
+        self.failures = []
+        self.recap = None
+        # Host results planned and received, planned is summed up play by play if the playbook can not tell
+        self.planned = 0
+        self.done = 0
+        self._planned_by_playbook = False
+
+    @staticmethod
+    def parse(line):
+        if not line.startswith(AnsibleEvents.PREFIX):
+            return None
+        try:
+            return json.loads(line[len(AnsibleEvents.PREFIX):])
+        except ValueError:
+            return None
+
+    def feed(self, line):
+        """Returns the event of line, or None if it is no event."""
+        event = AnsibleEvents.parse(line)
+        if event is None:
+            return None
+        kind = event.get('event')
+        if kind == 'playbook':
+            self._planned_by_playbook = bool(event.get('units'))
+            self.planned = event.get('units') or 0
+        elif kind == 'play':
+            self.play = event.get('name')
+            if not self._planned_by_playbook and event.get('hosts') is not None and event.get('tasks'):
+                self.planned += event.get('hosts').__len__() * event.get('tasks')
+        elif kind == 'task':
+            self.task = event.get('name')
+            self.task_done = 0
+        elif kind in AnsibleEvents.RESULTS:
+            counts = self.results.setdefault(event.get('host'), {})
+            counts[kind] = counts.get(kind, 0) + 1
+            self.task_done += 1
+            self.done += 1
+            if kind in ('failed', 'unreachable') and not event.get('ignored'):
+                self.failures.append(event)
+        elif kind == 'stats':
+            self.recap = event.get('hosts')
+        return event
+
+    def fraction(self):
+        """Part of the planned host results received, handlers and dynamic includes are not planned."""
+        if not self.planned:
+            return 0
+        return min(1.0, self.done / float(self.planned))
+
+    def failed_hosts(self):
+        return sorted(set(e.get('host') for e in self.failures))
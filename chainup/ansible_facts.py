@@ -0,0 +1,76 @@
+import json
+
+from chainup.deploy_schema import DeploySchema
+from chainup.log import logger
+from chainup.settings import Settings
+
+
+class AnsibleFactCache(object):
+    """The jsonfile fact cache of ansible on the ops master, kept across runs(see the generated ansible config).
+
+    Ansible keeps one file per inventory name and gathers again once it is older than ttl seconds. Inventory
+    names are not tied to hosts(chain nodes are numbered), so the host each name stood for is recorded in an
+    index file next to the facts, and the facts of a name are dropped as soon as it stands for another host.
+    """
+    INDEX = '.chainup-index.json'
+
+    def __init__(self, host, ttl=None):
+        self.host = host
+        self.ttl = ttl or Settings.ansible_fact_cache_timeout
+        self.dir = host.absolute_path(DeploySchema.ANSIBLE_FACTS_DIR)
+
+    @staticmethod
+    def identity_of(host):
+        return '%s@%s:%s' % (host.username, host.address, host.sshport)
+
+    @staticmethod
+    def stale_names(index, inventory):
+        """Names in the index whose host has changed or which are no longer in the inventory."""
+        return sorted(name for (name, identity) in index.items()
+                      if name not in inventory or inventory[name] != identity)
+
+    @staticmethod
+    def count(mtimes, now, names, ttl):
+        """(hits, misses) of names, given {name: mtime} of the cached files."""
+        v_hits = [name for name in names if name in mtimes and now - mtimes[name] < ttl]
+        return v_hits.__len__(), names.__len__() - v_hits.__len__()
+
+    def update(self, schema):
+        """Drop facts of inventory names whose host changed since the last run, returns the names dropped."""
+        v_inventory = dict((name, AnsibleFactCache.identity_of(host)) for (group, name, host)
+                           in schema.inventory_hosts())
+        exit_code, output = self.host.shell_command('cat %s/%s 2>/dev/null' % (self.dir, AnsibleFactCache.INDEX))
+        try:
+            v_index = json.loads(output) if exit_code == 0 else None
+        except ValueError:
+            v_index = None
+        if v_index is None:
+            # Unknown history, no cached fact can be trusted.
+            logger.debug('No index of ansible fact cache on %s.' % self.host.address)
+            v_index = dict((name, None) for name in self._list())
+        v_stale = AnsibleFactCache.stale_names(v_index, v_inventory)
+        v_commands = ['mkdir -p %s' % self.dir]
+        if v_stale:
+            v_commands.append('cd %s && rm -f -- %s' % (self.dir, ' '.join("'%s'" % n for n in v_stale)))
+        for (exit_code, output) in self.host.shell_commands(v_commands):
+            if exit_code != 0:
+                raise Exception(output.strip())
+        self.host.put_content(json.dumps(v_inventory, indent=1).encode('utf-8'),
+                              '%s/%s' % (self.dir, AnsibleFactCache.INDEX))
+        return v_stale
+
+    def stats(self, names):
+        """(hits, misses) of names for the next ansible-playbook run."""
+        exit_code, output = self.host.shell_command(
+            'date +%%s; cd %s 2>/dev/null && stat -c "%%Y %%n" -- * 2>/dev/null' % self.dir)
+        v_lines = output.split('\n')
+        v_mtimes = {}
+        for line in v_lines[1:]:
+            v_fields = line.strip().split(' ', 1)
+            if v_fields.__len__() == 2 and v_fields[0].isdigit():
+                v_mtimes[v_fields[1]] = int(v_fields[0])
+        return AnsibleFactCache.count(v_mtimes, int(v_lines[0].strip()), names, self.ttl)
+
+    def _list(self):
+        exit_code, output = self.host.shell_command('ls -1 %s 2>/dev/null' % self.dir)
+        return [name for name in output.split('\n') if name.strip()]
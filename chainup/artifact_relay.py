@@ -0,0 +1,85 @@
+import re
+
+# Serves one file at /TOKEN on one address while distributing, runs on the nodes under python 2 or 3.
+RELAY_SERVER = r'''
+import os, shutil, sys
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+
+address, port, token, path = sys.argv[1], int(sys.argv[2]), sys.argv[3], sys.argv[4]
+
+
+class Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != '/' + token:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Length', str(os.path.getsize(path)))
+        self.end_headers()
+        with open(path, 'rb') as f:
+            shutil.copyfileobj(f, self.wfile, 1048576)
+
+    def log_message(self, *args):
+        pass
+
+HTTPServer((address, port), Handler).serve_forever()
+'''
+
+
+class ArtifactRelay(object):
+    """Image archives which the playbooks copy to nodes, found in their task files, see DistributeArtifacts."""
+    SERVER_PATH = '~/.chainup_relay.py'
+    # Task files are listed one after another on the ops master, each headed by this marker and its path
+    FILE_MARKER = '@@chainup-file:'
+    # Images are saved by 'docker save' into plain tar archives
+    IMAGE_SUFFIX = '.tar'
+
+    @staticmethod
+    def image_copies(text):
+        """(src, dest) of the copy tasks in the yaml text of a task file which copy an image archive to the nodes.
+
+        Both 'copy:' with src and dest on lines of their own and 'copy: src=... dest=...' are recognized, a task
+        ends where the next item of the list begins.
+        """
+        v_copies = []
+        v_task = {}
+        for line in text.split('\n') + ['- ']:
+            v_line = line.strip()
+            if v_line.startswith('- ') or v_line == '-':
+                if v_task.get('copy') and v_task.get('dest') \
+                        and v_task.get('src', '').endswith(ArtifactRelay.IMAGE_SUFFIX):
+                    v_copies.append((v_task['src'], v_task['dest']))
+                v_task = {}
+                v_line = v_line[1:].strip()
+            if re.match(r'(ansible\.builtin\.)?copy\s*:', v_line):
+                v_task['copy'] = True
+                v_line = v_line[v_line.index(':') + 1:]
+            for (key, value) in re.findall(r'\b(src|dest)\s*[:=]\s*("[^"]*"|\'[^\']*\'|\S+)', v_line):
+                v_task[key] = value.strip('\'"')
+        return v_copies
+
+    @staticmethod
+    def source_candidates(task_file, src):
+        """Paths relative to the playbooks directory where ansible looks for src of a copy task in task_file."""
+        if src.startswith('/'):
+            return [src]
+        v_parts = task_file.split('/')
+        if v_parts.__len__() >= 4 and v_parts[0] == 'roles' and v_parts[2] == 'tasks':
+            return ['roles/%s/files/%s' % (v_parts[1], src), 'roles/%s/%s' % (v_parts[1], src)]
+        return ['files/' + src, src]
+
+    @staticmethod
+    def resolve(path, variables):
+        """path with '{{ name }}' replaced by variables, None if any is unknown."""
+        v_unknown = []
+
+        def v_value(match):
+            if match.group(1) not in variables:
+                v_unknown.append(match.group(1))
+                return match.group(0)
+            return str(variables[match.group(1)])
+        v_path = re.sub(r'\{\{\s*(\w+)\s*\}\}', v_value, path)
+        return None if v_unknown or '{{' in v_path else v_path
@@ -0,0 +1,89 @@
+import asyncio
+import os
+
+from chainup.multiplexer import multiplexer
+
+
+class ChannelStream(object):
+    """Lines of a remote command as they arrive, for 'async for'. exit_status is set once iteration ends."""
+
+    def __init__(self, host, command, pty=False):
+        self._host = host
+        self._command = command
+        self._pty = pty
+        self._queue = None
+        self.exit_status = None
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self._queue is None:
+            self._queue = asyncio.Queue()
+            await _follow(self._host, self._command, self._pty, self._put_event)
+        (event, data) = await self._queue.get()
+        if event == 'exit':
+            self.exit_status = data
+            raise StopAsyncIteration
+        return data
+
+    def _put_event(self, event, data):
+        self._queue.put_nowait((event, data))
+
+
+class AsyncHost(object):
+    """asyncio interface of a Host, for coroutines running on the loop of chainup.ui.async_loop.
+
+    Commands do not take a thread each: channels are opened in the executor and then followed by the channel
+    multiplexer, which hands their output back to the loop. SSH handshakes and uploads are blocking in
+    paramiko, so connect() and put() run in the executor.
+    """
+
+    def __init__(self, host):
+        self.host = host
+
+    async def connect(self, refresh=False):
+        """Connect and probe facts(Host.try_connect), returns whether the host is valid."""
+        await asyncio.get_running_loop().run_in_executor(None, self.host.try_connect, refresh)
+        return self.host.is_valid
+
+    async def run(self, command, pty=False):
+        """Returns exit code, stdout and stderr of command."""
+        v_output = {'stdout': [], 'stderr': []}
+        v_done = asyncio.get_running_loop().create_future()
+
+        def v_on_event(event, data):
+            if event == 'exit':
+                v_done.set_result(data)
+            else:
+                v_output[event].append(data)
+
+        await _follow(self.host, command, pty, v_on_event)
+        v_exit_code = await v_done
+        return v_exit_code, '\n'.join(v_output['stdout']), '\n'.join(v_output['stderr'])
+
+    def stream(self, command, pty=False):
+        """async for line in host.stream(command): lines of stdout and stderr while command runs."""
+        return ChannelStream(self.host, command, pty)
+
+    async def put(self, local_path, remote_path=None, callback=None):
+        """Upload local_path, to /tmp of the remote host by default. Returns the remote path."""
+        if remote_path is None:
+            remote_path = '/tmp/' + os.path.basename(local_path.replace('\\', '/'))
+        await asyncio.get_running_loop().run_in_executor(
+            None, self.host.upload, local_path, self.host.absolute_path(remote_path), callback)
+        return remote_path
+
+    def close(self):
+        self.host.close()
+
+
+async def _follow(host, command, pty, on_event):
+    """Start command on host and pass (event, data) of its channel to on_event on the running loop."""
+    loop = asyncio.get_running_loop()
+    channel = await loop.run_in_executor(None, host.open_channel, command, pty)
+
+    def v_callback(tag, event, data):
+        # Called on the multiplexer thread.
+        loop.call_soon_threadsafe(on_event, event, data)
+    multiplexer.add(host.address, channel, v_callback)
@@ -0,0 +1,227 @@
+import binascii
+import threading
+import time
+
+import paramiko
+
+from chainup.log import logger
+from chainup.settings import Settings
+from chainup.shell_session import ShellSession
+
+
+class PooledConnection(object):
+    """One authenticated SSH transport shared by every Host with the same (address, port, user)."""
+
+    def __init__(self, key, client, password):
+        self.key = key
+        self.client = client
+        self.password = password
+        self.leases = 0
+        self.last_used = time.time()
+        self._sftp = None
+        self._sftp_lock = threading.Lock()
+        self._shell = None
+        self._shell_lock = threading.Lock()
+
+    def is_active(self):
+        """Whether the transport is still open, without any traffic."""
+        transport = self.client.get_transport()
+        return transport is not None and transport.is_active()
+
+    def is_alive(self):
+        """is_active, and the transport can still be written to. May block on a stalled host."""
+        transport = self.client.get_transport()
+        if transport is None or not transport.is_active():
+            return False
+        try:
+            transport.send_ignore()
+        except (paramiko.SSHException, EOFError, OSError):
+            return False
+        return True
+
+    def fingerprint(self):
+        """Fingerprint of the remote host key."""
+        key = self.client.get_transport().get_remote_server_key()
+        return binascii.hexlify(key.get_fingerprint()).decode('ascii')
+
+    def open_sftp(self):
+        with self._sftp_lock:
+            if self._sftp is None:
+                self._sftp = self.client.open_sftp()
+            return self._sftp
+
+    def shell_session(self):
+        with self._shell_lock:
+            if self._shell is None or not self._shell.is_alive():
+                self._shell = ShellSession(self.client)
+            return self._shell
+
+    def close_shell(self):
+        """Close the shell session, a command waiting on it fails at once and the next one opens a new session."""
+        v_shell = self._shell
+        if v_shell is not None:
+            v_shell.close()
+
+    def close(self):
+        try:
+            if self._shell:
+                self._shell.close()
+            if self._sftp:
+                self._sftp.close()
+            self.client.close()
+        except Exception as e:
+            logger.debug('Close connection %s failed: %s' % (str(self.key), e))
+        self._sftp = None
+        self._shell = None
+
+
+class ConnectionPool(object):
+    """Process wide, thread safe pool of SSH transports keyed by (address, port, user).
+
+    Connections are leased by Host objects and returned with release(). A connection without leases is kept
+    for reuse until it is idle for longer than idle_timeout, and no more than max_connections sockets are open
+    at the same time.
+    """
+
+    def __init__(self, max_connections=None, idle_timeout=None):
+        self.max_connections = max_connections or Settings.ssh_pool_max_connections
+        self.idle_timeout = idle_timeout or Settings.ssh_pool_idle_timeout
+        self._lock = threading.Condition()
+        self._connections = {}
+        self._retired = []
+        self._connecting = set()
+
+    @staticmethod
+    def key_of(address, port, username):
+        return address, int(port), username
+
+    def acquire(self, address, port, username, password, timeout=1):
+        """Lease a live connection, connecting only when no healthy one with the same credentials exists."""
+        key = ConnectionPool.key_of(address, port, username)
+        deadline = time.time() + Settings.ssh_pool_wait_timeout
+        while True:
+            connection = self._lease_existing(key, password, deadline)
+            if connection is None:
+                break
+            # Probed without holding the lock, a stalled host must not hold up the leases of the others.
+            if connection.is_alive():
+                return connection
+            with self._lock:
+                connection.leases = max(0, connection.leases - 1)
+                if self._connections.get(key) is connection:
+                    self._retire(connection)
+                elif connection.leases == 0 and connection in self._retired:
+                    self._retired.remove(connection)
+                    connection.close()
+                self._lock.notify_all()
+
+        # Handshake without holding the lock, other hosts may connect at the same time.
+        try:
+            client = paramiko.SSHClient()
+            client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+            client.connect(hostname=address, username=username, password=password, port=int(port), timeout=timeout)
+        except Exception:
+            with self._lock:
+                self._connecting.discard(key)
+                self._lock.notify_all()
+            raise
+
+        connection = PooledConnection(key, client, password)
+        connection.leases = 1
+        with self._lock:
+            self._connecting.discard(key)
+            self._connections[key] = connection
+            self._lock.notify_all()
+            logger.debug('New SSH connection: %s, %d open.' % (str(key), self._open_count()))
+        return connection
+
+    def _lease_existing(self, key, password, deadline):
+        """Lease the pooled connection of key, or return None once this caller may open a new one."""
+        with self._lock:
+            while True:
+                self._evict_idle()
+                connection = self._connections.get(key)
+                if connection is not None:
+                    if connection.password == password and connection.is_active():
+                        connection.leases += 1
+                        connection.last_used = time.time()
+                        return connection
+                    self._retire(connection)
+                if key in self._connecting:
+                    pass
+                elif self._open_count() < self.max_connections:
+                    break
+                elif self._evict_oldest():
+                    continue
+                else:
+                    logger.debug('Connection pool full, waiting for a free slot: %s.' % str(key))
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise paramiko.SSHException('Connection pool exhausted.')
+                self._lock.wait(remaining)
+            self._connecting.add(key)
+        return None
+
+    def release(self, connection):
+        with self._lock:
+            connection.leases = max(0, connection.leases - 1)
+            connection.last_used = time.time()
+            if connection.leases == 0 and connection in self._retired:
+                self._retired.remove(connection)
+                connection.close()
+            self._lock.notify_all()
+
+    def discard(self, connection):
+        """Drop a connection that is known to be broken."""
+        with self._lock:
+            self._discard(connection)
+            self._lock.notify_all()
+
+    def close_shell_sessions(self):
+        with self._lock:
+            v_connections = list(self._connections.values()) + self._retired
+        for connection in v_connections:
+            connection.close_shell()
+
+    def close_all(self):
+        with self._lock:
+            for connection in list(self._connections.values()) + self._retired:
+                connection.close()
+            self._connections.clear()
+            self._retired = []
+            self._lock.notify_all()
+
+    def _open_count(self):
+        return len(self._connections) + len(self._retired) + len(self._connecting)
+
+    def _retire(self, connection):
+        """Replace a broken or outdated(other password) connection, closing it once its last lease is returned."""
+        self._connections.pop(connection.key, None)
+        if connection.leases == 0:
+            connection.close()
+        else:
+            self._retired.append(connection)
+
+    def _discard(self, connection):
+        if self._connections.get(connection.key) is connection:
+            self._connections.pop(connection.key)
+        if connection in self._retired:
+            self._retired.remove(connection)
+        connection.close()
+
+    def _evict_idle(self):
+        now = time.time()
+        for connection in list(self._connections.values()):
+            if connection.leases == 0 and now - connection.last_used > self.idle_timeout:
+                logger.debug('Evict idle SSH connection: %s.' % str(connection.key))
+                self._discard(connection)
+
+    def _evict_oldest(self):
+        v_idle = [c for c in self._connections.values() if c.leases == 0]
+        if not v_idle:
+            return False
+        self._discard(min(v_idle, key=lambda c: c.last_used))
+        return True
+
+
+pool = ConnectionPool()
@@ -0,0 +1,228 @@
+import base64
+import hashlib
+import io
+import json
+import os
+import zlib
+
+from chainup.log import logger
+from chainup.settings import Settings
+
+# Weak checksum is adler32, so that the remote side can use zlib and only the local side has to roll it.
+ADLER_MOD = 65521
+
+
+def weak_checksum(block):
+    return zlib.adler32(block) & 0xffffffff
+
+
+def strong_checksum(block):
+    return hashlib.md5(block).hexdigest()
+
+
+def block_signatures(data, block_size):
+    """[(weak, strong), ...] of every block of data."""
+    return [(weak_checksum(data[i:i + block_size]), strong_checksum(data[i:i + block_size]))
+            for i in range(0, len(data), block_size)]
+
+
+def compute_delta(data, signatures, block_size):
+    """Instructions to rebuild data from a basis file with the given block signatures.
+
+    Returns a list of ['c', block_index] (copy a block of the basis file) and ['d', bytes] (literal data).
+    """
+    v_blocks = {}
+    for (index, (weak, strong)) in enumerate(signatures):
+        v_blocks.setdefault(weak, []).append((strong, index))
+
+    delta = []
+    literal = bytearray()
+    n = len(data)
+    pos = 0
+    a = b = None
+    while pos < n:
+        # A window shorter than a block can only match the last block of the basis file, it is tried once.
+        v_size = min(block_size, n - pos)
+        if a is None:
+            a = (1 + sum(data[pos:pos + v_size])) % ADLER_MOD
+            b = (v_size + sum((v_size - i) * data[pos + i] for i in range(v_size))) % ADLER_MOD
+        index = None
+        candidates = v_blocks.get((b << 16) | a)
+        if candidates:
+            strong = strong_checksum(data[pos:pos + v_size])
+            for (v_strong, v_index) in candidates:
+                if v_strong == strong:
+                    index = v_index
+                    break
+        if index is not None:
+            if literal:
+                delta.append(['d', bytes(literal)])
+                literal = bytearray()
+            delta.append(['c', index])
+            pos += v_size
+            a = b = None
+        elif v_size < block_size:
+            literal.extend(data[pos:])
+            pos = n
+        else:
+            # Roll the window one byte forward.
+            v_out = data[pos]
+            literal.append(v_out)
+            pos += 1
+            if pos + block_size <= n:
+                a = (a - v_out + data[pos + block_size - 1]) % ADLER_MOD
+                b = (b - block_size * v_out + a - 1) % ADLER_MOD
+            else:
+                a = b = None
+    if literal:
+        delta.append(['d', bytes(literal)])
+    return delta
+
+
+def apply_delta(basis, delta, block_size):
+    result = io.BytesIO()
+    for (op, arg) in delta:
+        if op == 'c':
+            result.write(basis[arg * block_size:(arg + 1) * block_size])
+        else:
+            result.write(arg)
+    return result.getvalue()
+
+
+# Runs on remote hosts with whatever python is there(python2.7 on CentOS7).
+REMOTE_HELPER = r'''
+import base64, hashlib, json, os, sys, zlib
+
+def walk(root):
+    for (d, dirs, files) in os.walk(root):
+        for f in files:
+            path = os.path.join(d, f)
+            if os.path.isfile(path) and not os.path.islink(path):
+                yield os.path.relpath(path, root).replace(os.sep, '/')
+
+def read(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+cmd, root = sys.argv[1], sys.argv[2]
+if cmd == 'manifest':
+    manifest = {}
+    if os.path.isdir(root):
+        for rel in walk(root):
+            manifest[rel] = hashlib.md5(read(os.path.join(root, rel))).hexdigest()
+    print(json.dumps(manifest))
+elif cmd == 'signatures':
+    size = int(sys.argv[3])
+    result = {}
+    for rel in json.loads(sys.stdin.read()):
+        data = read(os.path.join(root, rel))
+        result[rel] = [[zlib.adler32(data[i:i + size]) & 0xffffffff, hashlib.md5(data[i:i + size]).hexdigest()]
+                       for i in range(0, len(data), size)]
+    print(json.dumps(result))
+elif cmd == 'patch':
+    size = int(sys.argv[3])
+    patch = json.loads(sys.stdin.read())
+    for (rel, delta) in patch['files'].items():
+        path = os.path.join(root, rel)
+        basis = read(path) if os.path.isfile(path) else b''
+        parts = []
+        for (op, arg) in delta:
+            if op == 'c':
+                parts.append(basis[arg * size:(arg + 1) * size])
+            else:
+                parts.append(base64.b64decode(arg))
+        data = b''.join(parts)
+        if hashlib.md5(data).hexdigest() != patch['digests'][rel]:
+            sys.stderr.write('digest mismatch: %s\n' % rel)
+            sys.exit(2)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path + '.part', 'wb') as f:
+            f.write(data)
+        os.rename(path + '.part', path)
+    for rel in patch['delete']:
+        os.remove(os.path.join(root, rel))
+'''
+
+
+class DeltaSync(object):
+    """rsync like synchronization of a local directory to a remote one.
+
+    File digests are compared in one call first, only changed files get their block signatures fetched, and
+    only blocks that the remote copy does not have yet are sent. Remote files missing locally are deleted,
+    except those excluded: relative paths of files or directories generated on the remote side, which are
+    neither sent nor deleted.
+    """
+    HELPER_PATH = '~/.chainup_delta.py'
+
+    def __init__(self, host, local_dir, remote_dir, block_size=None, exclude=(), stopped=None):
+        self.host = host
+        self.local_dir = local_dir
+        self.remote_dir = host.absolute_path(remote_dir)
+        self.block_size = block_size or Settings.delta_block_size
+        self.exclude = [path.strip('/') for path in exclude]
+        # Checked between the calls to the remote side, see sync()
+        self.stopped = stopped or (lambda: False)
+        self._helper = host.absolute_path(DeltaSync.HELPER_PATH)
+
+    def is_excluded(self, rel):
+        return any(rel == path or rel.startswith(path + '/') for path in self.exclude)
+
+    def sync(self):
+        """Returns statistics: numbers of files, changed and deleted files, bytes sent and total bytes. Returns None
+        if stopped before the remote directory is patched.
+        """
+        self.host.put_content(REMOTE_HELPER.encode('utf-8'), self._helper)
+        if self.stopped():
+            return None
+        v_local = dict((rel, digest) for (rel, digest) in self._local_manifest().items() if not self.is_excluded(rel))
+        v_remote = dict((rel, digest) for (rel, digest) in json.loads(self._call('manifest')).items()
+                        if not self.is_excluded(rel))
+
+        v_changed = sorted(rel for (rel, digest) in v_local.items() if v_remote.get(rel) != digest)
+        v_deleted = sorted(rel for rel in v_remote.keys() if rel not in v_local)
+        stats = {'files': len(v_local), 'changed': len(v_changed), 'deleted': len(v_deleted),
+                 'sent': 0, 'total': 0}
+        if not v_changed and not v_deleted:
+            return stats
+
+        v_existing = [rel for rel in v_changed if rel in v_remote]
+        if self.stopped():
+            return None
+        v_signatures = json.loads(self._call('signatures', json.dumps(v_existing))) if v_existing else {}
+
+        patch = {'files': {}, 'digests': {}, 'delete': v_deleted}
+        for rel in v_changed:
+            data = self._read_local(rel)
+            delta = compute_delta(data, v_signatures.get(rel, []), self.block_size)
+            for op in delta:
+                if op[0] == 'd':
+                    stats['sent'] += len(op[1])
+                    op[1] = base64.b64encode(op[1]).decode('ascii')
+            stats['total'] += len(data)
+            patch['files'][rel] = delta
+            patch['digests'][rel] = v_local[rel]
+            if self.stopped():
+                return None
+        self._call('patch', json.dumps(patch))
+        logger.debug('Delta sync %s -> %s: %s' % (self.local_dir, self.remote_dir, stats))
+        return stats
+
+    def _call(self, command, data=''):
+        exit_code, output = self.host.exec_command_input(
+            'python %s %s %s %d' % (self._helper, command, self.remote_dir, self.block_size), data)
+        if exit_code != 0:
+            raise IOError('Delta sync %s failed on %s: %s' % (command, self.host.address, output.strip()))
+        return output
+
+    def _local_manifest(self):
+        manifest = {}
+        for (d, dirs, files) in os.walk(self.local_dir):
+            for f in files:
+                rel = os.path.relpath(os.path.join(d, f), self.local_dir).replace(os.sep, '/')
+                manifest[rel] = strong_checksum(self._read_local(rel))
+        return manifest
+
+    def _read_local(self, rel):
+        with open(os.path.join(self.local_dir, rel), 'rb') as f:
+            return f.read()
@@ -1,3 +1,5 @@
+import hashlib
+
 from chainup.host import Host
 
 
@@ -7,6 +9,13 @@ class DeploySchema(object):
     PRESET_PROD_FOUR = 'preset_prod_four'
     CUSTOM_SCHEMA = 'custom'
     PLAYBOOKS_DIR = '~/.playbooks'
+    # Ansible config of chainup runs, generated in PLAYBOOKS_DIR from the ansible.cfg of the playbooks
+    ANSIBLE_CFG = 'chainup-ansible.cfg'
+    ANSIBLE_FACTS_DIR = '~/.ansible/facts'
+    # Settings of the deployment by the part of it they concern
+    CHAIN_SETTINGS = ('chain_peer_port', 'chain_rpc_port', 'chain_proxy_app', 'chain_home', 'chain_crypto_sm')
+    OPS_SETTINGS = ('ops_es_port', 'ops_monitor_home', 'ops_kibana_port')
+    EXPLORER_SETTINGS = ('chain_explorer_port', 'chain_explorer_home')
 
     def __init__(self):
         self.res_type = None
@@ -24,6 +33,7 @@ class DeploySchema(object):
         self.ops_monitor_home = '~/.monitor'
         self.ops_kibana_port = '5601'
         self.num_ops = 0
+        self.ansible_fast_profile = True
 
         self.chain_explorer_port = '8080'
         self.chain_explorer_home = '~/.explorer'
@@ -89,6 +99,40 @@ class HostDeploySchema(DeploySchema):
         self.ca_servers.pop(host_addr, None)
         self.all_hosts.pop(host_addr, None)
 
+    def inventory_hosts(self):
+        """[(group, inventory name, host), ...] in the order of the ansible inventory. Chain nodes are numbered
+        tcnode0, tcnode1, ..., validators first, other hosts are named by their notes.
+        """
+        v_hosts = []
+        index = 0
+        for (group, hosts) in (('validators', self.chain_validators), ('nonvalidators', self.chain_non_validators)):
+            for (k, host) in hosts.items():
+                v_hosts.append((group, 'tcnode%d' % index, host))
+                index += 1
+        for (group, hosts) in (('explorer', self.chain_explorers), ('ops-master', self.ops_master),
+                               ('ops-worker', self.ops_workers), ('ca-server', self.ca_servers)):
+            for (k, host) in hosts.items():
+                v_hosts.append((group, host.note, host))
+        return v_hosts
+
+    def snapshot(self, groups=None, settings=None):
+        """Hosts of the inventory groups and the settings given(all by default) as a json-able dict, which is
+        equal for two schemas exactly when a deployment of those parts would be the same. Passwords are hashed.
+        """
+        if settings is None:
+            settings = DeploySchema.CHAIN_SETTINGS + DeploySchema.OPS_SETTINGS + DeploySchema.EXPLORER_SETTINGS
+        v_hosts = {}
+        for (group, name, host) in self.inventory_hosts():
+            if groups is None or group in groups:
+                v_hosts[name] = {
+                    'group': group,
+                    'address': host.address,
+                    'sshport': str(host.sshport),
+                    'username': host.username,
+                    'password': hashlib.sha256((host.password or '').encode('utf-8')).hexdigest(),
+                }
+        return {'settings': dict((name, getattr(self, name)) for name in settings), 'hosts': v_hosts}
+
     def has_enough_chain_validators(self):
         return self.chain_validators.__len__() == self.num_chain_validators
 
@@ -0,0 +1,91 @@
+import json
+import os
+import threading
+import time
+
+from chainup.log import logger
+from chainup.settings import Settings
+
+
+class FactCache(object):
+    """On-disk cache of host facts(Host.info), keyed by host address and SSH host key fingerprint.
+
+    Entries older than ttl seconds are only used to show something at once, hosts are still probed again
+    in the background. New entries are written to disk by flush(), once per batch of hosts probed.
+    """
+
+    def __init__(self, path=None, ttl=None):
+        self.path = path or Settings.fact_cache_path
+        self.ttl = ttl or Settings.fact_cache_ttl
+        self._lock = threading.Lock()
+        self._entries = None
+        # Entries put since the last save
+        self._dirty = False
+
+    @staticmethod
+    def key_of(address, port):
+        return '%s:%s' % (address, port)
+
+    def get(self, address, port, fingerprint=None, fresh_only=True):
+        """Return cached facts, or None if there is no (fresh) entry matching the host key fingerprint."""
+        with self._lock:
+            entry = self._load().get(FactCache.key_of(address, port))
+        if entry is None:
+            return None
+        if fingerprint is not None and entry.get('fingerprint') != fingerprint:
+            logger.debug('Host key of %s changed, cached facts dropped.' % address)
+            self.invalidate(address, port)
+            return None
+        if fresh_only and time.time() - entry.get('time', 0) > self.ttl:
+            return None
+        return dict(entry.get('info', {}))
+
+    def put(self, address, port, fingerprint, info):
+        with self._lock:
+            self._load().update({FactCache.key_of(address, port): {
+                'fingerprint': fingerprint,
+                'time': time.time(),
+                'info': info,
+            }})
+            self._dirty = True
+
+    def flush(self):
+        """Save the entries put since the last save, if any."""
+        with self._lock:
+            if self._dirty:
+                self._save()
+
+    def invalidate(self, address=None, port=None):
+        """Forget facts of one host, or of all hosts if no address given."""
+        with self._lock:
+            entries = self._load()
+            if address is None:
+                entries.clear()
+            else:
+                for key in list(entries.keys()):
+                    if key == FactCache.key_of(address, port) or (port is None and key.split(':')[0] == address):
+                        entries.pop(key)
+            self._save()
+
+    def _load(self):
+        if self._entries is None:
+            try:
+                with open(self.path, encoding='utf-8') as f:
+                    self._entries = json.load(f)
+            except (OSError, ValueError):
+                self._entries = {}
+        return self._entries
+
+    def _save(self):
+        self._dirty = False
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp_path = self.path + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(self._entries, f, ensure_ascii=False, indent=1)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.error('Save fact cache to %s failed: %s' % (self.path, e))
+
+
+fact_cache = FactCache()
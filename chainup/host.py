@@ -1,9 +1,18 @@
+import io
+import os
+import select
 import socket
 import sys
+import threading
 
 import paramiko
 
+from chainup.connection_pool import pool
+from chainup.fact_cache import fact_cache
 from chainup.log import logger
+from chainup.settings import Settings
+from chainup.transfer import ParallelUploader
+from chainup.utils import Utils
 
 
 class Host(object):
@@ -15,6 +24,21 @@ class Host(object):
     OPS_WORKER = 1 << 4
     CA_SERVER = 1 << 5
     NOT_INSTALLED = '(Not installed)'
+    # Written into the extracted directory, holds sha256 of the archive it was extracted from.
+    ARCHIVE_STAMP = '.chainup.sha256'
+    # Prefix of the line with the remote process group id, see open_channel
+    PGID_MARKER = 'CHAINUP_PGID='
+    # Bytes read from a channel at once by exec_command_fast
+    RECV_SIZE = 1048576
+
+    # All facts are gathered by one command, each section starts with a delimiter line.
+    FACTS_DELIMITER = '@@chainup-fact:'
+    FACTS_PROBE = \
+        'echo "' + FACTS_DELIMITER + 'os"; cat /etc/centos-release 2>/dev/null; ' + \
+        'echo "' + FACTS_DELIMITER + 'hostname"; hostname; ' + \
+        'echo "' + FACTS_DELIMITER + 'cpuinfo"; cat /proc/cpuinfo; ' + \
+        'echo "' + FACTS_DELIMITER + 'meminfo"; cat /proc/meminfo; ' + \
+        'echo "' + FACTS_DELIMITER + 'docker"; docker version 2>/dev/null'
 
     def __init__(self, address=None, username='root', password=None, sshport='22', note=None):
         self.address = address
@@ -22,33 +46,69 @@ class Host(object):
         self.username = username
         self.password = password
         self.note = note
-        self._sftp = None
-        self._client = None
+        self._connection = None
+        # Guards _connection, so threads sharing this host share one lease
+        self._lease_lock = threading.RLock()
         self.output = None
+        # True or False once connected, None while only cached facts are known(see load_cached_info)
         self.is_valid = False
         self.info = {}
         self.role = 0
 
+    def __copy__(self):
+        # Copies borrow their own lease from the pool instead of sharing this one.
+        v_host = Host.__new__(Host)
+        v_host.__dict__.update(self.__dict__)
+        v_host._connection = None
+        v_host._lease_lock = threading.RLock()
+        return v_host
+
+    @property
+    def _client(self):
+        return self._lease().client
+
+    @property
+    def _sftp(self):
+        return self._lease().open_sftp()
+
+    def _lease(self):
+        """Borrow a connection from the shared pool, replacing the current one if its transport has closed. Whether
+        the connection still works is probed by the pool at lease time only.
+        """
+        with self._lease_lock:
+            if self._connection is not None and not self._connection.is_active():
+                self.close()
+            if self._connection is None:
+                self._connection = pool.acquire(self.address, self.sshport, self.username, self.password)
+            return self._connection
+
     def set_role(self, role):
         self.role = role
 
     def has_role(self, role):
         return self.role & role == role
 
-    def try_connect(self):
+    def try_connect(self, refresh=False):
         """Try to connect with host, and get information about OS/CPU/Mem etc.
+
+        Facts are taken from the fact cache if they are fresh and the host key is unchanged, unless refresh
+        is True.
         """
         try:
-            ssh = paramiko.SSHClient()
-            ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-            ssh.connect(hostname=self.address, username=self.username, password=self.password, port=int(self.sshport),
-                        timeout=1)
-            self._client = ssh
-            self._sftp = ssh.open_sftp()
+            # Credentials may have changed since the last lease.
+            self.close()
+            v_fingerprint = self._lease().fingerprint()
+            v_cached_info = None
+            if not refresh:
+                v_cached_info = fact_cache.get(self.address, self.sshport, v_fingerprint)
             self.info.clear()
-            if self._check_os():
+            if v_cached_info:
+                self.info.update(v_cached_info)
                 self.is_valid = True
-                self._get_info()
+            else:
+                self.is_valid = self._get_info()
+                if self.is_valid:
+                    fact_cache.put(self.address, self.sshport, v_fingerprint, dict(self.info))
         except paramiko.BadAuthenticationType:
             logger.error('Bad authentication type: Host[%s].' % self.address)
             self.is_valid = False
@@ -69,23 +129,42 @@ class Host(object):
             logger.error('Connect to Host[%s] get addr info failed.' % self.address)
             self.is_valid = False
             self.info.update({'Invalid': '主机地址填写有误。'})
+        except OSError as e:
+            # e.g. paramiko.ssh_exception.NoValidConnectionsError, connection refused on every address.
+            logger.error('Connect to Host[%s] failed: %s' % (self.address, e))
+            self.is_valid = False
+            self.info.update({'Invalid': '无法连接该主机，请检查地址和SSH端口。'})
+        except Exception as e:
+            logger.error('Connect to Host[%s] failed: %s' % (self.address, e))
+            self.is_valid = False
+            self.info.update({'Invalid': '无法连接该主机：%s' % e})
         # finally:
         #     ssh.close()
 
+    def load_cached_info(self):
+        """Fill info from the fact cache without connecting, return True if there was anything cached. Whether the
+        host is valid stays unknown(None) until try_connect.
+        """
+        v_cached_info = fact_cache.get(self.address, self.sshport, fresh_only=False)
+        if not v_cached_info:
+            return False
+        self.info.clear()
+        self.info.update(v_cached_info)
+        self.is_valid = None
+        return True
+
     def download(self, remote_path, local_path, callback=None):
-        if self._sftp is None:
-            self.try_connect()
         self._sftp.get(remote_path, local_path, callback=callback)
 
     def upload(self, local_path, remote_path, callback=None):
-        if self._sftp is None:
-            self.try_connect()
-        self._sftp.put(local_path, remote_path, callback=callback)
+        ParallelUploader(self._lease()).upload(local_path, remote_path, callback)
 
     def unarchive(self, local_file_path, remote_dir_path, upload_callback=None):
         """unarchive uploads local file(local_file_path) to '/tmp' of remote host,
         and then extract this file to remote_dir_path.
         """
+        if Host.is_streamed(local_file_path):
+            return self.unarchive_streaming(local_file_path, remote_dir_path, upload_callback)
         file_name = local_file_path[local_file_path.rfind('\\') + 1:]
         self.upload(local_file_path, '/tmp/' + file_name, upload_callback)
         v_remote_dir = self.absolute_path(remote_dir_path)
@@ -93,9 +172,57 @@ class Host(object):
             'rm -rf ' + v_remote_dir + \
             ' && mkdir -p ' + v_remote_dir + \
             ' && tar xzvvf /tmp/' + file_name + ' -C ' + v_remote_dir + \
-            ' && rm -f /tmp/' + file_name
+            ' && rm -f /tmp/' + file_name + \
+            ' && echo ' + Utils.file_sha256(local_file_path) + ' > ' + v_remote_dir + '/' + Host.ARCHIVE_STAMP
         return self.exec_command_tail(command)
 
+    @staticmethod
+    def is_streamed(local_file_path):
+        """Whether unarchive pipes the file into tar, instead of uploading it by ParallelUploader first."""
+        return Settings.stream_extract and os.path.getsize(local_file_path) <= Settings.stream_extract_max_size
+
+    def unarchive_streaming(self, local_file_path, remote_dir_path, upload_callback=None):
+        """Pipe local file(local_file_path) into tar on remote host, extraction overlaps the transfer and nothing
+        is staged in '/tmp'. Returns the output of tar at once, while the file is still being sent.
+        """
+        v_remote_dir = self.absolute_path(remote_dir_path)
+        command = \
+            'rm -rf ' + v_remote_dir + \
+            ' && mkdir -p ' + v_remote_dir + \
+            ' && tar xzvvf - -C ' + v_remote_dir + ' 2>&1' + \
+            ' && echo ' + Utils.file_sha256(local_file_path) + ' > ' + v_remote_dir + '/' + Host.ARCHIVE_STAMP
+        channel = self._client.get_transport().open_session(timeout=300)
+        channel.exec_command(command)
+        logger.debug('unarchive_streaming: %s.' % command)
+        feeder = threading.Thread(target=Host._feed_channel,
+                                  args=(channel, local_file_path, upload_callback))
+        feeder.daemon = True
+        feeder.start()
+        return channel.makefile('r')
+
+    @staticmethod
+    def _feed_channel(channel, local_file_path, callback=None):
+        v_file_size = os.path.getsize(local_file_path)
+        v_sent = 0
+        try:
+            with open(local_file_path, 'rb') as f:
+                for block in iter(lambda: f.read(Settings.upload_chunk_size), b''):
+                    channel.sendall(block)
+                    v_sent += len(block)
+                    if callback is not None:
+                        callback(v_sent, v_file_size)
+            channel.shutdown_write()
+        except Exception as e:
+            # tar fails on the truncated stream, and the caller sees a non-zero exit status.
+            logger.error('Stream %s failed: %s' % (local_file_path, e))
+            channel.close()
+
+    def is_archive_extracted(self, local_file_path, remote_dir_path):
+        """Whether remote_dir_path holds the extracted content of exactly this local archive."""
+        v_stamp_file = self.absolute_path(remote_dir_path) + '/' + Host.ARCHIVE_STAMP
+        exit_code, output = self.shell_command('cat ' + v_stamp_file + ' 2>/dev/null')
+        return exit_code == 0 and output.strip() == Utils.file_sha256(local_file_path)
+
     def absolute_path(self, path):
         if path.startswith('~'):
             if self.username == 'root':
@@ -104,33 +231,85 @@ class Host(object):
                 return path.replace('~', '/home/%s' % self.username)
         return path
 
-    def exec_command(self, command):
-        if self._client is None:
-            self.try_connect()
-        stdin, stdout, stderr = self._client.exec_command(command, timeout=300, get_pty=True)
+    def exec_command(self, command, pty=True):
+        stdin, stdout, stderr = self._client.exec_command(command, timeout=300, get_pty=pty)
         stdin.close()
         v_exit_code = stdout.channel.recv_exit_status()
         logger.debug('exec_command: %s, exit %d.' % (command, v_exit_code))
         return v_exit_code, stdout
 
-    def exec_command_tail(self, command):
-        if self._client is None:
-            self.try_connect()
-        stdin, stdout, stderr = self._client.exec_command(command, timeout=300, get_pty=True)
+    def exec_command_tail(self, command, pty=True):
+        stdin, stdout, stderr = self._client.exec_command(command, timeout=300, get_pty=pty)
         logger.debug('exec_command_tail: %s.' % command)
         stdin.close()
         return stdout
 
-    def _check_os(self):
-        stdin, stdout, stderr = self._client.exec_command('cat /etc/centos-release', get_pty=True)
-        result = stdout.readline().strip()
-        if result.find('CentOS Linux release 7') > -1:
-            self.info.update({'OS': result.replace('Linux release ', '')})
-            return True
-        else:
-            self.is_valid = False
-            self.info.update({'Invalid': '请使用CentOS7系统'})
-            return False
+    def open_channel(self, command, pty=True, timeout=300, report_pgid=False):
+        """Start command on a new channel and return the channel, e.g. to be followed by the multiplexer.
+
+        With report_pgid the first output line is PGID_MARKER followed by the process group id of the command,
+        sshd starts each command in a new session, so the remote shell leads the group of everything it runs.
+        """
+        if report_pgid:
+            command = 'echo %s$$; %s' % (Host.PGID_MARKER, command)
+        channel = self._client.get_transport().open_session(timeout=timeout)
+        if pty:
+            channel.get_pty()
+        channel.exec_command(command)
+        channel.shutdown_write()
+        logger.debug('open_channel: %s.' % command)
+        return channel
+
+    def kill_process_group(self, pgid, grace=1):
+        """SIGTERM the remote process group, and SIGKILL whatever is left of it after grace seconds."""
+        self.exec_command_fast('kill -TERM -- -%s 2>/dev/null; sleep %d; kill -KILL -- -%s 2>/dev/null; true' % (
+            pgid, grace, pgid), timeout=grace + 30)
+
+    def exec_command_fast(self, command, data=None, timeout=300):
+        """Run command without a pty, returns exit code, stdout and stderr as text.
+
+        Both streams are drained in large chunks whenever the channel is readable, so bulk output neither waits
+        for the line discipline of a terminal nor blocks on the other stream.
+        """
+        channel = self._client.get_transport().open_session(timeout=timeout)
+        try:
+            channel.exec_command(command)
+            if data:
+                channel.sendall(data.encode('utf-8') if isinstance(data, str) else data)
+            channel.shutdown_write()
+            v_stdout = []
+            v_stderr = []
+            while True:
+                v_readable = select.select([channel], [], [], timeout)[0]
+                if not v_readable:
+                    raise socket.timeout('exec_command_fast: %s timed out.' % command)
+                while channel.recv_ready():
+                    v_stdout.append(channel.recv(Host.RECV_SIZE))
+                while channel.recv_stderr_ready():
+                    v_stderr.append(channel.recv_stderr(Host.RECV_SIZE))
+                if channel.eof_received and not channel.recv_ready() and not channel.recv_stderr_ready():
+                    break
+            v_exit_code = channel.recv_exit_status()
+        finally:
+            channel.close()
+        logger.debug('exec_command_fast: %s, exit %d.' % (command, v_exit_code))
+        return v_exit_code, b''.join(v_stdout).decode('utf-8', 'replace'), b''.join(v_stderr).decode('utf-8', 'replace')
+
+    def shell_command(self, command):
+        """Run a short command in the persistent shell session of the connection, returns exit code and output."""
+        return self._lease().shell_session().run(command)
+
+    def shell_commands(self, commands):
+        """Run short commands one after another in the persistent shell session, returns [(exit_code, output)]."""
+        return self._lease().shell_session().run_batch(commands)
+
+    def exec_command_input(self, command, data):
+        """Run command with data as its stdin(no pty), returns exit code and stdout, or stderr on failure."""
+        v_exit_code, v_output, v_error = self.exec_command_fast(command, data)
+        return v_exit_code, v_output if v_exit_code == 0 else v_error + v_output
+
+    def put_content(self, data, remote_path):
+        self._sftp.putfo(io.BytesIO(data), self.absolute_path(remote_path))
 
     # def check_port_accessible(self, port=None):
     #     sk = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
@@ -149,11 +328,41 @@ class Host(object):
     #         sk.close()
 
     def _get_info(self):
-        self._get_hostname()
-        self._check_os()
-        self._get_host_cpu()
-        self._get_host_mem()
-        self._get_host_docker_info()
+        """Collect all facts in one round trip, and fill them into info in one pass."""
+        exit_code, output, error = self.exec_command_fast(Host.FACTS_PROBE, timeout=30)
+        facts = Host._split_facts(output.splitlines())
+        if not self._check_os(facts.get('os', [])):
+            return False
+        self.info.update({'Hostname': facts.get('hostname', [''])[0].strip()})
+        self.info.update({'CPU': Host._parse_cpu(facts.get('cpuinfo', []))})
+        v_mem = Host._parse_mem(facts.get('meminfo', []))
+        if v_mem:
+            self.info.update({'Memory': v_mem})
+        self.info.update({'Docker': Host._parse_docker(facts.get('docker', []))})
+        return True
+
+    @staticmethod
+    def _split_facts(lines):
+        """Split output of FACTS_PROBE into {section: [lines]}."""
+        facts = {}
+        section = None
+        for line in lines:
+            if line.startswith(Host.FACTS_DELIMITER):
+                section = line[len(Host.FACTS_DELIMITER):].strip()
+                facts[section] = []
+            elif section is not None:
+                facts[section].append(line)
+        return facts
+
+    def _check_os(self, lines):
+        result = lines[0].strip() if lines else ''
+        if result.find('CentOS Linux release 7') > -1:
+            self.info.update({'OS': result.replace('Linux release ', '')})
+            return True
+        else:
+            self.is_valid = False
+            self.info.update({'Invalid': '请使用CentOS7系统'})
+            return False
 
     def host_info_str(self):
         host_info = ''
@@ -162,41 +371,32 @@ class Host(object):
         host_info = host_info[0:-1]
         return host_info
 
-    def _get_host_mem(self):
-        stdin, stdout, stderr = self._client.exec_command('cat /proc/meminfo')
-        for line in stdout.readlines():
+    @staticmethod
+    def _parse_mem(lines):
+        for line in lines:
             if line.startswith('MemTotal'):
                 mem = int(line.split()[1].strip())
-                mem = '%.f' % (mem / 1024.0) + ' MB'
-                self.info.update({'Memory': mem})
-                break
+                return '%.f' % (mem / 1024.0) + ' MB'
+        return None
 
-    def _get_host_cpu(self):
+    @staticmethod
+    def _parse_cpu(lines):
         cpu_model = 0
         cpu_num = 0
-        stdin, stdout, stderr = self._client.exec_command('cat /proc/cpuinfo')
-        for line in stdout.readlines():
+        for line in lines:
             if line.startswith('processor'):
                 cpu_num += 1
             if line.startswith('model name'):
                 cpu_model = line.split(':')[1].strip().split()
                 cpu_model = cpu_model[0] + ' ' + cpu_model[2] + ' ' + cpu_model[-1]
-            if line == '':
-                break
-        self.info.update({'CPU': '%s x %s' % (cpu_model, cpu_num)})
+        return '%s x %s' % (cpu_model, cpu_num)
 
-    def _get_host_docker_info(self):
-        stdin, stdout, stderr = self._client.exec_command('docker version')
-        for line in stdout.readlines():
+    @staticmethod
+    def _parse_docker(lines):
+        for line in lines:
             if line.startswith('  Version:'):
-                docker_version = line.split(':')[1].strip()
-                self.info.update({'Docker': docker_version})
-                return
-        self.info.update({'Docker': Host.NOT_INSTALLED})
-
-    def _get_hostname(self):
-        stdin, stdout, stderr = self._client.exec_command('hostname')
-        self.info.update({'Hostname': stdout.readline().strip()})
+                return line.split(':')[1].strip()
+        return Host.NOT_INSTALLED
 
     def get_description(self):
         v_host_desc = 'new-host'
@@ -207,10 +407,14 @@ class Host(object):
         return v_host_desc
 
     def close(self):
-        if self._sftp:
-            self._sftp.close()
-        if self._client:
-            self._client.close()
+        """Return the leased connection to the pool, the socket itself stays open for reuse. Commands other threads
+        run on this host at the time keep their channels, but threads doing many commands at once should each use
+        a copy of the host, which has a lease of its own.
+        """
+        with self._lease_lock:
+            if self._connection is not None:
+                pool.release(self._connection)
+                self._connection = None
 
 
 def progress_info(transferred, toBeTransferred):
@@ -0,0 +1,100 @@
+import csv
+import os
+
+from chainup.host import Host
+
+
+class InventoryError(Exception):
+    pass
+
+
+class Inventory(object):
+    """Loads hosts in bulk from a CSV or YAML inventory file.
+
+    CSV files have a header line with the columns address, sshport, username, password, roles and note,
+    e.g.:
+
+        address,sshport,username,password,roles,note
+        10.1.1.30,22,root,kk,validator|ops,node-0
+
+    YAML files contain a list of mappings with the same keys (optionally under a 'hosts' key), where roles
+    may also be given as a list.
+    """
+    ROLES = {
+        'validator': Host.CHAIN_VALIDATOR,
+        'nonvalidator': Host.CHAIN_NON_VALIDATOR,
+        'non-validator': Host.CHAIN_NON_VALIDATOR,
+        'explorer': Host.CHAIN_EXPLORER,
+        'ops': Host.OPS_MASTER,
+        'ops-master': Host.OPS_MASTER,
+        'ops-worker': Host.OPS_WORKER,
+        'caserver': Host.CA_SERVER,
+        'ca-server': Host.CA_SERVER,
+    }
+
+    @staticmethod
+    def load(path):
+        ext = os.path.splitext(path)[1].lower()
+        if ext == '.csv':
+            records = Inventory._read_csv(path)
+        elif ext in ('.yml', '.yaml'):
+            records = Inventory._read_yaml(path)
+        else:
+            raise InventoryError('不支持的主机清单格式：%s' % ext)
+        hosts = []
+        for (i, record) in enumerate(records):
+            hosts.append(Inventory._to_host(record, i + 1))
+        return hosts
+
+    @staticmethod
+    def _read_csv(path):
+        with open(path, newline='', encoding='utf-8-sig') as f:
+            return [r for r in csv.DictReader(f) if any(v and v.strip() for v in r.values() if isinstance(v, str))]
+
+    @staticmethod
+    def _read_yaml(path):
+        try:
+            import yaml
+        except ImportError:
+            raise InventoryError('导入YAML格式的主机清单需要安装PyYAML。')
+        with open(path, encoding='utf-8') as f:
+            records = yaml.safe_load(f) or []
+        if isinstance(records, dict):
+            records = records.get('hosts', [])
+        if not isinstance(records, list):
+            raise InventoryError('主机清单格式有误，应为主机列表。')
+        return records
+
+    @staticmethod
+    def _to_host(record, line_no):
+        if not isinstance(record, dict):
+            raise InventoryError('第%d个主机格式有误。' % line_no)
+        record = {str(k).strip().lower(): v for (k, v) in record.items() if k is not None}
+        address = str(record.get('address') or '').strip()
+        if address == '':
+            raise InventoryError('第%d个主机缺少主机地址。' % line_no)
+        host = Host(address,
+                    str(record.get('username') or 'root').strip(),
+                    str(record.get('password') or '').strip(),
+                    str(record.get('sshport') or record.get('port') or '22').strip(),
+                    str(record.get('note') or '').strip())
+        host.set_role(Inventory.parse_roles(record.get('roles'), line_no))
+        return host
+
+    @staticmethod
+    def parse_roles(roles, line_no=0):
+        if roles is None:
+            return 0
+        if isinstance(roles, str):
+            roles = roles.replace(';', '|').replace(',', '|').replace(' ', '|').split('|')
+        v_role = 0
+        for role in roles:
+            role = str(role).strip().lower()
+            if role == '':
+                continue
+            if role not in Inventory.ROLES:
+                raise InventoryError('第%d个主机的部署内容"%s"无法识别。' % (line_no, role))
+            v_role |= Inventory.ROLES[role]
+        if v_role & Host.CHAIN_VALIDATOR and v_role & Host.CHAIN_NON_VALIDATOR:
+            raise InventoryError('第%d个主机不能同时部署出块节点和非出块节点。' % line_no)
+        return v_role
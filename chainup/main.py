@@ -4,18 +4,26 @@ import cgitb
 
 from PyQt5.QtWidgets import (QApplication, QDesktopWidget)
 
+from chainup.connection_pool import pool
+from chainup.fact_cache import fact_cache
+from chainup.ui.async_loop import qt_asyncio
 from chainup.window import MainWindow
 
 
 def main():
     app = QApplication(sys.argv)
+    qt_asyncio.start()
     window = MainWindow()
     desktop = QDesktopWidget().availableGeometry()
     width = (desktop.width() - window.width()) / 2
     height = (desktop.height() - window.height()) / 2
     window.show()
     window.move(width, height)
-    sys.exit(app.exec_())
+    exit_code = app.exec_()
+    qt_asyncio.stop()
+    pool.close_all()
+    fact_cache.flush()
+    sys.exit(exit_code)
 
 
 if __name__ == "__main__":
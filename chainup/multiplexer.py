@@ -0,0 +1,162 @@
+import selectors
+import socket
+import threading
+
+from chainup.log import logger
+
+
+class ChannelWatch(object):
+    """One channel followed by the multiplexer."""
+
+    def __init__(self, tag, channel, callback=None):
+        self.tag = tag
+        self.channel = channel
+        self.callback = callback
+        self.exit_status = None
+        self.fd = None
+        self._partial = {'stdout': b'', 'stderr': b''}
+        self._done = threading.Event()
+
+    def wait(self, timeout=None):
+        """Block until the remote command exits, returns its exit status(None on timeout)."""
+        self._done.wait(timeout)
+        return self.exit_status
+
+    def is_done(self):
+        return self._done.is_set()
+
+
+class ChannelMultiplexer(object):
+    """Follows many paramiko channels from one thread.
+
+    Whatever is ready on any channel is read in large chunks, split into lines per channel and stream, and
+    sent as (tag, event, data) to the callback of the channel and to every subscriber, where event is
+    'stdout' or 'stderr' with a line of text, or 'exit' with the exit status. Channels are registered through
+    a queue and a wakeup socket, so the selector is only touched by its own thread.
+    """
+    RECV_SIZE = 65536
+    # Seconds between checks for exit statuses that arrive after EOF
+    EXIT_POLL_INTERVAL = 0.05
+    # Seconds between checks for channels closed by other threads, which do not wake the selector
+    CLOSE_POLL_INTERVAL = 1
+
+    def __init__(self):
+        self._selector = selectors.DefaultSelector()
+        self._lock = threading.Lock()
+        self._pending = []
+        self._watches = {}
+        self._exiting = []
+        self._subscribers = []
+        self._thread = None
+        self._wakeup_r, self._wakeup_w = socket.socketpair()
+        self._wakeup_r.setblocking(False)
+        self._selector.register(self._wakeup_r, selectors.EVENT_READ, None)
+
+    def subscribe(self, callback):
+        with self._lock:
+            self._subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        with self._lock:
+            if callback in self._subscribers:
+                self._subscribers.remove(callback)
+
+    def add(self, tag, channel, callback=None):
+        """Follow channel, returns a ChannelWatch to wait for its exit status."""
+        watch = ChannelWatch(tag, channel, callback)
+        with self._lock:
+            self._pending.append(watch)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, name='channel-multiplexer')
+                self._thread.daemon = True
+                self._thread.start()
+        self._wakeup_w.send(b'x')
+        return watch
+
+    def close(self, channel):
+        """Close a followed channel from any thread, its watch finishes with exit status -1 at once."""
+        channel.close()
+        self._wakeup_w.send(b'x')
+
+    def _loop(self):
+        while True:
+            if self._exiting:
+                timeout = ChannelMultiplexer.EXIT_POLL_INTERVAL
+            else:
+                timeout = ChannelMultiplexer.CLOSE_POLL_INTERVAL if self._watches else None
+            for (key, mask) in self._selector.select(timeout):
+                if key.data is None:
+                    try:
+                        self._wakeup_r.recv(4096)
+                    except (BlockingIOError, InterruptedError):
+                        pass
+                else:
+                    self._read(key.data)
+            self._register_pending()
+            for watch in list(self._watches.values()):
+                if watch.channel.closed:
+                    self._read(watch)
+            self._check_exiting()
+
+    def _register_pending(self):
+        with self._lock:
+            v_pending = self._pending
+            self._pending = []
+        for watch in v_pending:
+            # Registered by descriptor, paramiko drops the pipe behind fileno() once a channel is closed.
+            watch.fd = watch.channel.fileno()
+            self._watches[watch.fd] = watch
+            self._selector.register(watch.fd, selectors.EVENT_READ, watch)
+            # Data may have arrived before registration.
+            self._read(watch)
+
+    def _read(self, watch):
+        channel = watch.channel
+        try:
+            while channel.recv_ready():
+                self._feed(watch, 'stdout', channel.recv(ChannelMultiplexer.RECV_SIZE))
+            while channel.recv_stderr_ready():
+                self._feed(watch, 'stderr', channel.recv_stderr(ChannelMultiplexer.RECV_SIZE))
+        except Exception as e:
+            logger.error('Read channel of %s failed: %s' % (watch.tag, e))
+            channel.close()
+        if (channel.closed or channel.eof_received) and watch.fd in self._watches:
+            self._selector.unregister(watch.fd)
+            self._watches.pop(watch.fd)
+            for stream in ('stdout', 'stderr'):
+                if watch._partial[stream]:
+                    self._emit(watch, stream, watch._partial[stream].decode('utf-8', 'replace'))
+                    watch._partial[stream] = b''
+            self._exiting.append(watch)
+
+    def _feed(self, watch, stream, data):
+        v_lines = (watch._partial[stream] + data).split(b'\n')
+        watch._partial[stream] = v_lines.pop()
+        for line in v_lines:
+            self._emit(watch, stream, line.rstrip(b'\r').decode('utf-8', 'replace'))
+
+    def _check_exiting(self):
+        for watch in list(self._exiting):
+            channel = watch.channel
+            if channel.exit_status_ready():
+                watch.exit_status = channel.recv_exit_status()
+            elif channel.closed:
+                watch.exit_status = -1
+            else:
+                continue
+            self._exiting.remove(watch)
+            channel.close()
+            self._emit(watch, 'exit', watch.exit_status)
+            watch._done.set()
+
+    def _emit(self, watch, event, data):
+        with self._lock:
+            v_callbacks = ([watch.callback] if watch.callback else []) + self._subscribers
+        for callback in v_callbacks:
+            try:
+                callback(watch.tag, event, data)
+            except Exception as e:
+                logger.error('Channel subscriber failed on %s: %s' % (watch.tag, e))
+
+
+multiplexer = ChannelMultiplexer()
@@ -1,117 +1,231 @@
-import time
-
+import binascii
+import configparser
+import copy
+import io
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from chainup.ansible_events import AnsibleEvents, CALLBACK_PLUGIN
+from chainup.ansible_facts import AnsibleFactCache
+from chainup.artifact_relay import ArtifactRelay, RELAY_SERVER
+from chainup.delta_sync import DeltaSync
 from chainup.deploy_schema import DeploySchema
+from chainup.host import Host
+from chainup.log import logger
 from chainup.settings import Settings
 from chainup.processes.process import Process
 
 
 class PreparePlaybooks(Process):
     def __init__(self):
-        Process.__init__(self, '准备playbooks', 30)
+        Process.__init__(self, '准备playbooks', 20)
 
     def _run(self):
-        if not self._check_playbooks_exist():
+        if os.path.isdir(Settings.res_playbooks_dir):
+            self._sync_playbooks()
+        elif not self._check_playbooks_exist():
             self._extract_playbooks()
         self._generate_inventory()
+        self._generate_ansible_cfg()
+        self._install_callback_plugin()
+        self._update_fact_cache()
         self._update_groupvars()
 
+    def _inputs(self):
+        return [self.deploy_schema.snapshot(), self.deploy_schema.ansible_fast_profile, self._playbooks_digest()]
+
+    @staticmethod
+    def generated_files():
+        """Paths in PLAYBOOKS_DIR which chainup generates on the ops master, not part of the playbooks."""
+        return ['trustchain-nodes', DeploySchema.ANSIBLE_CFG, '%s/%s.py' % (AnsibleEvents.PLUGIN_DIR, AnsibleEvents.PLUGIN_NAME),
+                CombinedCheckRun.PLAYBOOK, Host.ARCHIVE_STAMP]
+
     def _check_playbooks_exist(self):
-        if Process.all_stopped:
+        if self._stopped():
             return
         host = self._get_first_ops_host()
-        exit_code, output = host.exec_command('ls ' + host.absolute_path(DeploySchema.PLAYBOOKS_DIR) + ' &> /dev/null')
-        output.close()
-        if exit_code == 0:
-            self._summary('{%s} playbooks已存在' % host.address)
+        # Extracted from the same playbooks.tar.gz, not just any version of it.
+        v_exist = host.is_archive_extracted(Settings.res_playbooks, DeploySchema.PLAYBOOKS_DIR)
+        if v_exist:
+            self._summary('{%s} playbooks已存在且为最新' % host.address)
             self._progress_forward(80)
-        return exit_code == 0
+        return v_exist
+
+    def _sync_playbooks(self):
+        """Only changed blocks of changed files are sent, so editing a few playbooks costs a few KB."""
+        if self._stopped():
+            return
+        host = self._get_first_ops_host()
+        self._log_msg('{%s} 正在同步playbooks >>>' % host.address)
+        try:
+            stats = DeltaSync(host, Settings.res_playbooks_dir, DeploySchema.PLAYBOOKS_DIR,
+                              exclude=PreparePlaybooks.generated_files(), stopped=self._stopped).sync()
+        except Exception as e:
+            self._log_msg(str(e), False)
+            self._summary('{%s} 同步playbooks失败' % host.address, False)
+            self._process_failed()
+            return
+        if stats is None:
+            # Cancelled.
+            return
+        self._summary('{%s} 同步playbooks成功，共%d个文件，更新%d个，删除%d个，发送%.1fKB/%.1fKB' % (
+            host.address, stats['files'], stats['changed'], stats['deleted'],
+            stats['sent'] / 1024.0, stats['total'] / 1024.0))
+        self._progress_forward(80)
 
     def _extract_playbooks(self):
-        if Process.all_stopped:
+        if self._stopped():
             return
         host = self._get_first_ops_host()
+        self._progress_begin(80)
         self._upload_extract('playbooks', Settings.res_playbooks, host, DeploySchema.PLAYBOOKS_DIR)
         self._progress_forward(80)
 
     def _generate_inventory(self):
-        if Process.all_stopped:
+        if self._stopped():
             return
-        index = 0
         host = self._get_first_ops_host()
         inventory_file = host.absolute_path(DeploySchema.PLAYBOOKS_DIR + '/trustchain-nodes')
+        v_hosts = Process.deploy_schema.inventory_hosts()
         command = 'echo \"[validators]\" > ' + inventory_file
-        for (k, host) in Process.deploy_schema.chain_validators.items():
-            command = command + \
-                      ' && echo \"tcnode%d ansible_ssh_host=%s ansible_ssh_user=%s ansible_ssh_port=%s ansible_ssh_pass=%s\" >> %s' % (
-                          index, host.address, host.username, host.sshport, host.password, inventory_file)
-            index += 1
-
-        command = command + ' && echo -e \"\\n[nonvalidators]\" >> ' + inventory_file
-        for (k, host) in Process.deploy_schema.chain_non_validators.items():
-            command = command + \
-                      ' && echo \"tcnode%d ansible_ssh_host=%s ansible_ssh_user=%s ansible_ssh_port=%s ansible_ssh_pass=%s\" >> %s' % (
-                          index, host.address, host.username, host.sshport, host.password, inventory_file)
-            index += 1
-
-        command = command + ' && echo -e \"\\n[explorer]\" >> ' + inventory_file
-        for (k, host) in Process.deploy_schema.chain_explorers.items():
-            command = command + \
-                      ' && echo \"%s ansible_ssh_host=%s ansible_ssh_user=%s ansible_ssh_port=%s ansible_ssh_pass=%s\" >> %s' % (
-                          host.note, host.address, host.username, host.sshport, host.password, inventory_file)
-
-        command = command + ' && echo -e \"\\n[ops-master]\" >> ' + inventory_file
-        for (k, host) in Process.deploy_schema.ops_master.items():
-            command = command + \
-                      ' && echo \"%s ansible_ssh_host=%s ansible_ssh_user=%s ansible_ssh_port=%s ansible_ssh_pass=%s\" >> %s' % (
-                          host.note, host.address, host.username, host.sshport, host.password, inventory_file)
-
-        command = command + ' && echo -e \"\\n[ops-worker]\" >> ' + inventory_file
-        for (k, host) in Process.deploy_schema.ops_workers.items():
-            command = command + \
-                      ' && echo \"%s ansible_ssh_host=%s ansible_ssh_user=%s ansible_ssh_port=%s ansible_ssh_pass=%s\" >> %s' % (
-                          host.note, host.address, host.username, host.sshport, host.password, inventory_file)
-
-        command = command + ' && echo -e \"\\n[ca-server]\" >> ' + inventory_file
-        for (k, host) in Process.deploy_schema.ca_servers.items():
-            command = command + \
-                      ' && echo \"%s ansible_ssh_host=%s ansible_ssh_user=%s ansible_ssh_port=%s ansible_ssh_pass=%s\" >> %s' % (
-                          host.note, host.address, host.username, host.sshport, host.password, inventory_file)
+        for group in ('validators', 'nonvalidators', 'explorer', 'ops-master', 'ops-worker', 'ca-server'):
+            if group != 'validators':
+                command = command + ' && echo -e \"\\n[%s]\" >> %s' % (group, inventory_file)
+            for (v_group, name, v_host) in v_hosts:
+                if v_group != group:
+                    continue
+                command = command + \
+                          ' && echo \"%s ansible_ssh_host=%s ansible_ssh_user=%s ansible_ssh_port=%s ansible_ssh_pass=%s\" >> %s' % (
+                              name, v_host.address, v_host.username, v_host.sshport, v_host.password, inventory_file)
 
         command = command + ' && echo -e \"\\n[ops:children]\\nops-master\\nops-worker\\n\\n[chainnodes:children]\\nvalidators\\nnonvalidators\" >> ' + inventory_file
 
         self._exec('生成inventory文件', host, command)
-        self._progress_forward(10)
+        self._progress_forward(5)
+
+    def _generate_ansible_cfg(self):
+        """DeploySchema.ANSIBLE_CFG next to the inventory: the ansible.cfg shipped with the playbooks, if any, with
+        the options of chainup set over it. ansible-playbook is pointed to it by ANSIBLE_CONFIG(see
+        Process._ansible_env), so the shipped file is left as it is.
+        """
+        if self._stopped():
+            return
+        host = self._get_first_ops_host()
+        v_dir = host.absolute_path(DeploySchema.PLAYBOOKS_DIR)
+        v_hosts = set(name for (group, name, h) in Process.deploy_schema.inventory_hosts()).__len__()
+        v_forks = min(max(v_hosts, 5), Settings.ansible_max_forks)
+        v_options = {'defaults': {
+            'inventory': v_dir + '/trustchain-nodes',
+            'host_key_checking': 'False',
+            'forks': str(v_forks),
+            # Facts are kept across runs, see AnsibleFactCache.
+            'gathering': 'smart',
+            'fact_caching': 'jsonfile',
+            'fact_caching_connection': DeploySchema.ANSIBLE_FACTS_DIR,
+            'fact_caching_timeout': str(Settings.ansible_fact_cache_timeout),
+        }}
+        if Process.deploy_schema.ansible_fast_profile:
+            v_options['ssh_connection'] = {
+                'pipelining': 'True',
+                'control_path_dir': '~/.ansible/cp',
+                'ssh_args': '-o ControlMaster=auto -o ControlPersist=%ds' % Settings.ansible_control_persist,
+            }
+        try:
+            exit_code, v_shipped = host.shell_command('cat %s/ansible.cfg 2>/dev/null' % v_dir)
+            host.put_content(PreparePlaybooks.merge_ansible_cfg(v_shipped if exit_code == 0 else '', v_options)
+                             .encode('utf-8'), v_dir + '/' + DeploySchema.ANSIBLE_CFG)
+        except Exception as e:
+            self._log_msg(str(e), False)
+            self._summary('{%s} 生成ansible配置失败' % host.address, False)
+            self._process_failed()
+            return
+        self._summary('{%s} 生成ansible配置成功，%s，forks=%d' % (
+            host.address, '快速模式' if Process.deploy_schema.ansible_fast_profile else '默认模式', v_forks))
+        self._progress_forward(5)
+
+    @staticmethod
+    def merge_ansible_cfg(shipped, options):
+        """Text of the shipped ansible.cfg with options({section: {key: value}}) set over it. ssh_args are added
+        to the shipped ones, and a shipped file which can not be parsed is left out.
+        """
+        v_parser = configparser.ConfigParser(interpolation=None, strict=False, allow_no_value=True)
+        v_parser.optionxform = str
+        try:
+            v_parser.read_string(shipped)
+        except configparser.Error as e:
+            logger.error('Parse shipped ansible.cfg failed: %s' % e)
+            v_parser = configparser.ConfigParser(interpolation=None, allow_no_value=True)
+            v_parser.optionxform = str
+        for (section, values) in sorted(options.items()):
+            if not v_parser.has_section(section):
+                v_parser.add_section(section)
+            for (key, value) in sorted(values.items()):
+                if key == 'ssh_args' and v_parser.get(section, key, fallback=None):
+                    value = v_parser.get(section, key) + ' ' + value
+                v_parser.set(section, key, value)
+        v_text = io.StringIO()
+        v_parser.write(v_text)
+        return '# Generated by chainup from ansible.cfg of the playbooks, changes are overwritten on every check.\n' \
+            + v_text.getvalue()
+
+    def _install_callback_plugin(self):
+        """The chainup_events callback plugin, by which playbook runs are followed(see AnsibleEvents)."""
+        if self._stopped():
+            return
+        host = self._get_first_ops_host()
+        v_dir = host.absolute_path(DeploySchema.PLAYBOOKS_DIR + '/' + AnsibleEvents.PLUGIN_DIR)
+        try:
+            exit_code, output = host.shell_command('mkdir -p ' + v_dir)
+            if exit_code != 0:
+                raise Exception(output.strip())
+            host.put_content(CALLBACK_PLUGIN.encode('utf-8'), '%s/%s.py' % (v_dir, AnsibleEvents.PLUGIN_NAME))
+        except Exception as e:
+            self._log_msg(str(e), False)
+            self._summary('{%s} 安装ansible回调插件失败' % host.address, False)
+            self._process_failed()
+            return
+        self._log_msg('{%s} 安装ansible回调插件成功' % host.address)
+
+    def _update_fact_cache(self):
+        if self._stopped():
+            return
+        host = self._get_first_ops_host()
+        try:
+            v_dropped = AnsibleFactCache(host).update(Process.deploy_schema)
+        except Exception as e:
+            # Only costs a full fact gathering.
+            self._log_msg('{%s} 更新facts缓存失败：%s' % (host.address, e), False)
+            return
+        if v_dropped:
+            self._log_msg('{%s} 主机已变更，清除facts缓存：%s' % (host.address, ', '.join(v_dropped)))
 
     def _update_groupvars(self):
-        if Process.all_stopped:
+        if self._stopped():
             return
         host = self._get_first_ops_host()
         group_var_file = host.absolute_path(DeploySchema.PLAYBOOKS_DIR + '/group_vars/all')
-        command = \
-            'sed -i \'/^peer_port: /c\\peer_port: "' + self.deploy_schema.chain_peer_port + '"\' ' + group_var_file + ' && ' + \
-            'sed -i \'/^rpc_port: /c\\rpc_port: "' + self.deploy_schema.chain_rpc_port + '"\' ' + group_var_file + ' && ' + \
-            'sed -i \'/^proxy_app: /c\\proxy_app: "' + self.deploy_schema.chain_proxy_app + '"\' ' + group_var_file + ' && ' + \
-            'sed -i \'/^chain_home : /c\\chain_home : "' + host.absolute_path(
-                self.deploy_schema.chain_home) + '"\' ' + group_var_file + ' && ' + \
-            'sed -i \'/^es_host: /c\\es_host: "' + host.address + '"\' ' + group_var_file + ' && ' + \
-            'sed -i \'/^es_port: /c\\es_port: "' + self.deploy_schema.ops_es_port + '"\' ' + group_var_file + ' && ' + \
-            'sed -i \'/^monitor_home : /c\\monitor_home : "' + host.absolute_path(
-                self.deploy_schema.ops_monitor_home) + '"\' ' + group_var_file + ' && ' + \
-            'sed -i \'/^kibana_port: /c\\kibana_port: "' + self.deploy_schema.ops_kibana_port + '"\' ' + group_var_file + ' && ' + \
-            'sed -i \'/^explorer_home : /c\\explorer_home : "' + host.absolute_path(
-                self.deploy_schema.chain_explorer_home) + '"\' ' + group_var_file + ' && ' + \
-            'sed -i \'/^explorer_port: /c\\explorer_port: "' + self.deploy_schema.chain_explorer_port + '"\' ' + group_var_file + ' && ' + \
-            'sed -i \'/^explorer_connected_host: /c\\explorer_connect_host: "' + self._get_one_validator_address() + '"\' ' + group_var_file + ' && '
-        if self.deploy_schema.chain_crypto_sm:
-            command = command + 'sed -i \'/^crypto_with_sm2: /c\\crypto_with_sm2: "true"\' ' + group_var_file
-        else:
-            command = command + 'sed -i \'/^crypto_with_sm2: /c\\crypto_with_sm2: "false"\' ' + group_var_file
-
-        self._exec('更新group_vars/all文件', host, command)
+        v_vars = self._group_vars()
+        # All seds go to the shell session of the host at once, each with its own exit code.
+        commands = ['sed -i \'/^%s/c\\%s"%s"\' %s' % (pattern, key, value, group_var_file)
+                    for (pattern, key, value) in v_vars]
+        self._log_msg('{%s} 更新group_vars/all文件 >>' % host.address)
+        v_failed = False
+        for (command, (exit_code, output)) in zip(commands, host.shell_commands(commands)):
+            if exit_code != 0:
+                self._log_msg('| %s: %s' % (command, output.strip()), False)
+                v_failed = True
+        if v_failed:
+            self._summary('{%s} 更新group_vars/all文件失败' % host.address, False)
+            self._process_failed()
+            return
+        self._summary('{%s} 更新group_vars/all文件成功' % host.address)
         self._progress_forward(10)
 
 
 class InstallAnsible(Process):
+    depends_on = (PreparePlaybooks,)
+
     def __init__(self):
         Process.__init__(self, '安装ansible', 15)
 
@@ -123,22 +237,22 @@ class InstallAnsible(Process):
         self._ssh_copyid()
 
     def _check_ansible_installed(self):
-        if Process.all_stopped:
+        if self._stopped():
             return
         host = self._get_first_ops_host()
-        exit_code, output = host.exec_command('which ansible-playbook')
-        output.close()
+        exit_code, output = host.shell_command('which ansible-playbook')
         if exit_code == 0:
             self._summary('{%s} ansible已安装' % host.address)
             self._progress_forward(60)
         return exit_code == 0
 
     def _install_ansible(self):
-        if Process.all_stopped:
+        if self._stopped():
             return
         # Only one host in ops_master
         host = self._get_first_ops_host()
-        # extract rpm_ansible.tar.gz first
+        # extract rpm_ansible.tar.gz first, yum takes the rest of its part
+        self._progress_begin(40)
         self._upload_extract('ansible', Settings.res_rpm_ansible, host, '/tmp/rpm_ansible')
 
         # and then install ansible
@@ -149,20 +263,20 @@ class InstallAnsible(Process):
         self._progress_forward(60)
 
     def _check_sshpass_installed(self):
-        if Process.all_stopped:
+        if self._stopped():
             return
         host = self._get_first_ops_host()
-        exit_code, output = host.exec_command('which sshpass')
-        output.close()
+        exit_code, output = host.shell_command('which sshpass')
         if exit_code == 0:
             self._log_msg('{%s} sshpass已安装' % host.address)
             self._progress_forward(30)
         return exit_code == 0
 
     def _install_sshpass(self):
-        if Process.all_stopped:
+        if self._stopped():
             return
         host = self._get_first_ops_host()
+        self._progress_begin(20)
         self._upload_extract('sshpass', Settings.res_rpm_sshpass, host, '/tmp/rpm_sshpass')
 
         # and then install sshpass
@@ -173,7 +287,7 @@ class InstallAnsible(Process):
         self._progress_forward(30)
 
     def _ssh_copyid(self):
-        if Process.all_stopped:
+        if self._stopped():
             return
         host = self._get_first_ops_host()
         ssh_copyid_script = host.absolute_path(DeploySchema.PLAYBOOKS_DIR + '/ssh-copy-id-nodes.sh')
@@ -182,7 +296,224 @@ class InstallAnsible(Process):
         self._progress_forward(10)
 
 
+class DistributeArtifacts(Process):
+    """Distributes the image archives which the playbooks copy to nodes, before the playbooks run.
+
+    Copy tasks of the playbooks on the ops master are scanned for image archives(*.tar), and each is placed at
+    the destination of its task on every chain node, so that ansible finds it there with the same checksum and
+    does not send it again. The ops master holds them first, and then every node that already has an archive
+    serves it to one node that has not, over http on its own address under a token of this run. The number of
+    holders doubles each round and distribution time grows with log2 of the number of nodes instead of loading
+    the uplink of the ops master only. A failed fetch is retried once from another holder, and then the ops
+    master copies the archive to the node itself(SSH keys are set up by InstallAnsible), e.g. when a firewall
+    keeps nodes from reaching each other. Every copy is verified with sha256 before it is used.
+    """
+    depends_on = (InstallAnsible,)
+
+    def __init__(self):
+        Process.__init__(self, '分发部署文件', 10)
+
+    def _run(self):
+        if self._stopped():
+            return
+        v_images = self._find_images(self._get_first_ops_host())
+        if not v_images:
+            self._summary('playbooks中没有需要分发的镜像文件')
+            self._progress_forward(100)
+            return
+        for image in v_images:
+            if self._stopped():
+                return
+            self._distribute(image, 100.0 / v_images.__len__())
+
+    def _inputs(self):
+        return [self.deploy_schema.snapshot(('validators', 'nonvalidators', 'ops-master'),
+                                            DeploySchema.CHAIN_SETTINGS),
+                self._playbooks_digest()]
+
+    def _find_images(self, seed):
+        """[{'name', 'source'(path on the ops master), 'dest'(path on nodes), 'digest'}] of the image archives
+        copied by the playbooks.
+        """
+        v_dir = seed.absolute_path(DeploySchema.PLAYBOOKS_DIR)
+        exit_code, output, error = seed.exec_command_fast(
+            'cd %s && for f in *.yml roles/*/tasks/*.yml; do [ -f "$f" ] && echo "%s$f" && cat "$f"; done' % (
+                v_dir, ArtifactRelay.FILE_MARKER))
+        v_copies = []
+        for part in output.split(ArtifactRelay.FILE_MARKER)[1:]:
+            (task_file, text) = part.split('\n', 1) if '\n' in part else (part, '')
+            v_copies += [(task_file.strip(), src, dest) for (src, dest) in ArtifactRelay.image_copies(text)]
+        if not v_copies:
+            return []
+
+        v_candidates = sorted(set(c for (task_file, src, dest) in v_copies
+                                  for c in ArtifactRelay.source_candidates(task_file, src)))
+        exit_code, output, error = seed.exec_command_fast(
+            'cd %s && sha256sum %s 2>/dev/null' % (v_dir, ' '.join("'%s'" % c for c in v_candidates)))
+        v_digests = {}
+        for line in output.split('\n'):
+            v_fields = line.strip().split(None, 1)
+            if v_fields.__len__() == 2:
+                v_digests[v_fields[1].lstrip('*')] = v_fields[0]
+        v_vars = dict((key.strip(' :'), value) for (pattern, key, value) in self._group_vars())
+
+        v_images = []
+        for (task_file, src, dest) in v_copies:
+            v_source = next((c for c in ArtifactRelay.source_candidates(task_file, src) if c in v_digests), None)
+            v_dest = ArtifactRelay.resolve(dest, v_vars)
+            if v_source is None or v_dest is None:
+                self._log_msg('%s中的%s无法确定源文件或目标路径，由playbook分发' % (task_file, src))
+                continue
+            if v_dest.endswith('/'):
+                v_dest += src.split('/')[-1]
+            v_image = {'name': src.split('/')[-1], 'source': v_source if v_source.startswith('/') else
+                       v_dir + '/' + v_source, 'dest': v_dest, 'digest': v_digests[v_source]}
+            if v_image not in v_images:
+                v_images.append(v_image)
+        return v_images
+
+    def _distribute(self, image, share):
+        seed = self._get_first_ops_host()
+        v_nodes = [h for h in self._get_chain_nodes() if h.address != seed.address]
+        with ThreadPoolExecutor(max_workers=Settings.artifact_relay_max_threads) as executor:
+            v_has = self._have_image(v_nodes, image)
+            holders = [seed] + [h for (h, has) in zip(v_nodes, v_has) if has]
+            pending = [h for (h, has) in zip(v_nodes, v_has) if not has]
+            self._log_msg('%s：%d个节点已有，%d个节点待分发' % (
+                image['name'], holders.__len__(), pending.__len__()))
+            # Failed targets go back to pending, so progress counts the targets which got the image.
+            v_pending_count = pending.__len__()
+            v_initial_holders = holders.__len__()
+            self._progress_begin(share)
+
+            v_token = binascii.hexlify(os.urandom(16)).decode('ascii')
+            v_servers = {}
+            # Addresses of the holders each node has failed to fetch from
+            v_failed_from = dict((h.address, set()) for h in pending)
+            v_round = 0
+            try:
+                while pending and not self._stopped():
+                    v_round += 1
+                    v_free = list(holders)
+                    v_pairs = []
+                    for target in list(pending):
+                        v_failed = v_failed_from[target.address]
+                        if v_failed.__len__() >= 2 or all(h.address in v_failed for h in holders):
+                            # Copied by the ops master itself.
+                            v_pairs.append((None, target))
+                            pending.remove(target)
+                            continue
+                        v_holder = next((h for h in v_free if h.address not in v_failed), None)
+                        if v_holder is not None:
+                            v_free.remove(v_holder)
+                            v_pairs.append((v_holder, target))
+                            pending.remove(target)
+                    # Holders of the round start their servers at once, each waits only for its own.
+                    v_new = []
+                    for (holder, target) in v_pairs:
+                        if holder is not None and holder.address not in v_servers and holder not in v_new:
+                            v_new.append(holder)
+                    v_pids = executor.map(lambda h: self._start_relay(h, self._image_path(h, seed, image), v_token),
+                                          v_new)
+                    v_servers.update((h.address, (h, pid)) for (h, pid) in zip(v_new, v_pids))
+                    v_results = list(executor.map(lambda p: self._fetch(p[0], p[1], image, v_token)
+                                                  if p[0] is not None else self._push(seed, p[1], image), v_pairs))
+                    if Process.cancelled:
+                        return
+                    for ((holder, target), ok) in zip(v_pairs, v_results):
+                        if ok:
+                            holders.append(target)
+                            self._log_msg('| 第%d轮 {%s} -> {%s} %s' % (
+                                v_round, (holder or seed).address, target.address, image['name']))
+                        elif holder is not None:
+                            # Tried again from another holder, or by the ops master.
+                            v_failed_from[target.address].add(holder.address)
+                            pending.append(target)
+                        else:
+                            self._summary('{%s} 分发%s失败' % (target.address, image['name']), False)
+                            self._process_failed()
+                            return
+                    self._progress_part((holders.__len__() - v_initial_holders) / float(v_pending_count))
+            finally:
+                list(executor.map(lambda server: self._stop_relay(*server), v_servers.values()))
+        self._summary('%s已分发至%d个节点，共%d轮' % (image['name'], v_nodes.__len__() + 1, v_round))
+        self._progress_forward(share)
+
+    @staticmethod
+    def _image_path(host, seed, image):
+        """Where host holds image, the ops master has it in the playbooks."""
+        return image['source'] if host is seed else host.absolute_path(image['dest'])
+
+    def _have_image(self, hosts, image):
+        """Whether each of hosts has image at its destination."""
+        v_results = self._exec_on_hosts(
+            hosts, lambda h: 'sha256sum ' + h.absolute_path(image['dest']) + ' 2>/dev/null | cut -d" " -f1')
+        return [exit_code == 0 and output.strip() == image['digest'] for (exit_code, output) in v_results]
+
+    def _start_relay(self, host, path, token):
+        """Serve path of host over http on its address at /token, returns pid of the server once it answers, or
+        after Settings.artifact_relay_ready_timeout seconds.
+        """
+        v_server = host.absolute_path(ArtifactRelay.SERVER_PATH)
+        host.put_content(RELAY_SERVER.encode('utf-8'), v_server)
+        v_args = '%s %s %d %s %s' % (v_server, host.address, Settings.artifact_relay_port, token, path)
+        command = \
+            '(setsid sh -c "python %s || python3 %s" > /dev/null 2>&1 & echo $!) && ' % (v_args, v_args) + \
+            'for i in $(seq %d); do curl -s -o /dev/null http://%s:%d/ && break; sleep 0.1; done' % (
+                Settings.artifact_relay_ready_timeout * 10, host.address, Settings.artifact_relay_port)
+        exit_code, output, error = host.exec_command_fast(command)
+        return output.strip()
+
+    def _stop_relay(self, host, pid):
+        if pid.isdigit():
+            host.exec_command_fast('kill -- -%s 2>/dev/null || kill %s' % (pid, pid))
+
+    def _fetch(self, holder, target, image, token):
+        """target downloads image from holder."""
+        v_dest = target.absolute_path(image['dest'])
+        return self._receive(target, image, 'curl -sf --retry 2 http://%s:%d/%s -o %s.part' % (
+            holder.address, Settings.artifact_relay_port, token, v_dest))
+
+    def _push(self, seed, target, image):
+        """The ops master copies image to target, by the key login set up by InstallAnsible."""
+        v_dest = target.absolute_path(image['dest'])
+        exit_code, output = self._exec_output(target, 'mkdir -p ' + os.path.dirname(v_dest))
+        if exit_code != 0:
+            self._log_msg('{%s} %s' % (target.address, output.strip()), False)
+            return False
+        # Pushes run in parallel, each on a lease of its own.
+        v_seed = copy.copy(seed)
+        try:
+            exit_code, output = self._exec_output(
+                v_seed, 'scp -q -P %s -o StrictHostKeyChecking=no -o BatchMode=yes %s %s@%s:%s.part' % (
+                    target.sshport, image['source'], target.username, target.address, v_dest))
+        finally:
+            v_seed.close()
+        if exit_code != 0:
+            self._log_msg('{%s} %s' % (seed.address, output.strip()), False)
+            return False
+        return self._receive(target, image, 'true')
+
+    def _receive(self, target, image, command):
+        """Run command on target to have image at its destination plus '.part', and keep it only if the digest
+        matches.
+        """
+        v_dest = target.absolute_path(image['dest'])
+        command = \
+            'mkdir -p ' + os.path.dirname(v_dest) + \
+            ' && ' + command + \
+            ' && echo "%s  %s.part" | sha256sum -c --quiet' % (image['digest'], v_dest) + \
+            ' && mv -f %s.part %s' % (v_dest, v_dest)
+        exit_code, output = self._exec_output(target, command)
+        if exit_code != 0:
+            self._log_msg('{%s} %s' % (target.address, output.strip()), False)
+            target.exec_command_fast('rm -f %s.part' % v_dest)
+        return exit_code == 0
+
+
 class InstallDocker(Process):
+    depends_on = (InstallAnsible,)
+
     def __init__(self):
         Process.__init__(self, '安装Docker', 10)
 
@@ -191,30 +522,136 @@ class InstallDocker(Process):
         self._progress_forward(100)
 
 
-class CheckComputing(Process):
-    def __init__(self):
-        Process.__init__(self, '检查系统资源', 10)
+class CheckStep(Process):
+    """A check done by one playbook. With Settings.combined_checks all check steps share one ansible-playbook
+    run(CombinedCheckRun) instead of each paying for startup, SSH connections and fact gathering.
+    """
+    depends_on = (InstallDocker,)
+    playbook = None
+    # Checks look at the hosts as they are now, which their inputs do not tell.
+    journaled = False
 
     def _run(self):
-        self._run_ansible_playbook("check_computing")
+        if not Settings.combined_checks:
+            self._run_ansible_playbook(self.playbook)
+            self._progress_forward(100)
+            return
+        if self._stopped():
+            return
+        v_passed = CombinedCheckRun.join(self)
+        if Process.cancelled:
+            return
+        host = self._get_first_ops_host()
+        if v_passed:
+            self._summary('{%s} %s成功' % (host.address, self.name))
+        else:
+            self._summary('{%s} %s失败' % (host.address, self.name), False)
+            self._process_failed()
         self._progress_forward(100)
 
 
-class CheckNetwork(Process):
+class CombinedCheckRun(object):
+    """One ansible-playbook run of every check playbook, shared by the check steps of a run.
+
+    The first step that joins runs it, the others wait for its result. Each check playbook is preceded by a
+    marker play, which also clears host errors so a host failing one check still gets the others. Events of the
+    run are split at the markers into sections, and a check has passed if no host failed in its section.
+    """
+    PLAYBOOK = 'chainup_checks.yml'
+    MARKER = 'chainup-check: '
+
+    _lock = threading.Lock()
+    _current = None
+
+    def __init__(self, run_id, playbooks):
+        self.run_id = run_id
+        self.playbooks = playbooks
+        self.owner = None
+        self.results = {}
+        self.done = threading.Event()
+        self._failures = dict((p, 0) for p in playbooks)
+        self._seen = set()
+        self._section = None
+        self.events = AnsibleEvents()
+
+    @staticmethod
+    def join(step):
+        """Returns whether the check of step has passed."""
+        with CombinedCheckRun._lock:
+            v_run = CombinedCheckRun._current
+            if v_run is None or v_run.run_id != Process.run_id:
+                v_run = CombinedCheckRun(Process.run_id, [c.playbook for c in CheckStep.__subclasses__()])
+                CombinedCheckRun._current = v_run
+            v_owner = v_run.owner is None
+            if v_owner:
+                v_run.owner = step
+        if v_owner:
+            try:
+                v_run._execute(step)
+            finally:
+                v_run.done.set()
+        else:
+            step._log_msg('%s与其他检查合并执行，等待结果...' % step.name)
+            v_run.done.wait()
+        return v_run.results.get(step.playbook, False)
+
+    def _execute(self, step):
+        host = step._get_first_ops_host()
+        v_dir = host.absolute_path(DeploySchema.PLAYBOOKS_DIR)
+        host.put_content(self.wrapper().encode('utf-8'), v_dir + '/' + CombinedCheckRun.PLAYBOOK)
+        step._log_msg('{%s} 合并执行检查：%s >>' % (host.address, ', '.join(self.playbooks)))
+        step._log_fact_cache(host)
+        # Facts gathered by the first play are reused by the following ones.
+        exit_code = step._follow(host, 'cd %s && ANSIBLE_GATHERING=smart %s ansible-playbook %s' % (
+            v_dir, Process._ansible_env(host), CombinedCheckRun.PLAYBOOK), lambda line: self.parse_line(step, line))
+        self.results = self.evaluate(exit_code)
+
+    def wrapper(self):
+        v_plays = ''
+        for playbook in self.playbooks:
+            v_plays += \
+                '- name: "%s%s"\n  hosts: all\n  gather_facts: no\n  tasks:\n    - meta: clear_host_errors\n' \
+                '- import_playbook: %s.yml\n' % (CombinedCheckRun.MARKER, playbook, playbook)
+        return '---\n' + v_plays
+
+    def parse_line(self, step, line):
+        """Count failed hosts of each section, returns whether line was an event(see AnsibleEvents)."""
+        event = self.events.feed(line)
+        if event is None:
+            return False
+        kind = event.get('event')
+        if kind == 'play' and (event.get('name') or '').startswith(CombinedCheckRun.MARKER):
+            self._section = event.get('name')[len(CombinedCheckRun.MARKER):]
+            self._seen.add(self._section)
+        elif kind in ('failed', 'unreachable') and not event.get('ignored') and self._section in self._failures:
+            self._failures[self._section] += 1
+        return step._show_ansible_event(self.events, event)
+
+    def evaluate(self, exit_code):
+        """{playbook: passed}, a check whose section never started has not passed."""
+        results = dict((p, p in self._seen and self._failures[p] <= 0) for p in self.playbooks)
+        if exit_code != 0 and all(results.values()):
+            # Failed without any failed task, e.g. a syntax error, nothing can be trusted.
+            results = dict((p, False) for p in self.playbooks)
+        return results
+
+
+class CheckComputing(CheckStep):
+    playbook = "check_computing"
+
+    def __init__(self):
+        Process.__init__(self, '检查系统资源', 10)
+
+
+class CheckNetwork(CheckStep):
+    playbook = "check_network"
+
     def __init__(self):
         Process.__init__(self, '检查网络资源', 25)
 
-    def _run(self):
-        self._run_ansible_playbook("check_network")
-        self._progress_forward(100)
 
+class CheckStorage(CheckStep):
+    playbook = "check_storage"
 
-class CheckStorage(Process):
     def __init__(self):
         Process.__init__(self, '检查存储资源', 10)
-
-    def _run(self):
-        self._run_ansible_playbook("check_storage")
-        self._progress_forward(100)
-        time.sleep(1)
-        self.signals.finished.emit()
@@ -1,30 +1,195 @@
+import math
+import time
+
+from chainup.deploy_schema import DeploySchema
 from chainup.processes.process import Process
+from chainup.run_journal import run_journal
+from chainup.settings import Settings
 
 
-class DeployChain(Process):
-    def __init__(self):
-        Process.__init__(self, '部署链节点', 50)
+class DeployStep(Process):
+    """Deploys one part of the schema(hosts of groups and settings) by a playbook, limited to what has changed.
+
+    The part deployed is compared with the one this step deployed when it last passed. Changed settings,
+    group_vars or playbooks, a dependency that has run with other inputs since, and changed hosts of
+    full_groups(which the other hosts are configured from), take a run on all hosts. Otherwise the playbook runs
+    with --limit on the added and changed hosts only, or not at all. A forced full run(Process.force_full_run)
+    always runs on all hosts.
+    """
+    playbook = None
+    groups = ()
+    settings = ()
+    # Keys of group_vars/all the playbook uses(see Process._group_vars), some are taken from other groups
+    group_vars = ()
+    full_groups = ()
+
+    def _inputs(self):
+        return [self._snapshot(), self._playbooks_digest()]
+
+    def _snapshot(self):
+        v_snapshot = self.deploy_schema.snapshot(self.groups, self.settings)
+        v_vars = dict((key.strip(' :'), value) for (pattern, key, value) in self._group_vars())
+        v_snapshot['settings'].update(('group_vars/' + name, v_vars[name]) for name in self.group_vars)
+        return v_snapshot
 
     def _run(self):
-        self._run_ansible_playbook("deploy_chain")
+        v_current = self._snapshot()
+        v_current['playbooks'] = self._playbooks_digest()
+        v_current['upstream'] = sorted(self.upstream_digests)
+        v_last = run_journal.last_snapshot(type(self).__name__)
+        # A full run redeploys nodes that have crashed or been wiped since, which the snapshots do not tell.
+        v_limit = None if Process.force_full_run else DeployStep.limit_of(v_last, v_current, self.full_groups)
+        if v_limit is None:
+            self._deploy(v_current, None, v_last)
+        elif v_limit:
+            self._log_msg('%s仅部署变更的主机：%s' % (self.name, ', '.join(v_limit)))
+            self._deploy(v_current, v_limit, v_last)
+        else:
+            self._summary('%s无变更，跳过' % self.name)
+        self.journal_snapshot = v_current
         self._progress_forward(100)
 
+    def _deploy(self, snapshot, limit, last):
+        """Run the playbook on the inventory names in limit, or on all hosts if None. last is the snapshot
+        deployed when this step last passed, None if it never did.
+        """
+        self._run_ansible_playbook(self.playbook, limit)
+
+    @staticmethod
+    def limit_of(last, current, full_groups=()):
+        """Inventory names to deploy to go from snapshot last to current, None for all hosts."""
+        if last is None or last['settings'] != current['settings'] or last.get('playbooks') != current['playbooks'] \
+                or last.get('upstream') != current.get('upstream'):
+            return None
+        v_hosts = dict(last['hosts'])
+        v_changed = []
+        for (name, host) in current['hosts'].items():
+            if v_hosts.pop(name, None) != host:
+                v_changed.append(name)
+        # Hosts left in v_hosts have been removed, nothing is undeployed from them.
+        for name in v_changed + list(v_hosts.keys()):
+            for snapshot in (last, current):
+                if name in snapshot['hosts'] and snapshot['hosts'][name]['group'] in full_groups:
+                    return None
+        return sorted(v_changed)
+
+
+class DeployOps(DeployStep):
+    playbook = "deploy_monitor"
+    groups = ('ops-master', 'ops-worker')
+    settings = DeploySchema.OPS_SETTINGS
+    group_vars = ('es_port', 'monitor_home', 'kibana_port')
+    full_groups = ('ops-master',)
 
-class DeployOps(Process):
     def __init__(self):
         Process.__init__(self, '部署运维平台', 25)
 
-    def _run(self):
-        self._run_ansible_playbook("deploy_monitor")
-        self._progress_forward(100)
 
+class DeployChain(DeployStep):
+    depends_on = (DeployOps,)
+    playbook = "deploy_chain"
+    groups = ('validators', 'nonvalidators')
+    settings = DeploySchema.CHAIN_SETTINGS
+    group_vars = ('peer_port', 'rpc_port', 'proxy_app', 'chain_home', 'es_host', 'es_port', 'crypto_with_sm2')
+    # The genesis and the peers of every node are made from the validators.
+    full_groups = ('validators',)
 
-class DeployExplorer(Process):
     def __init__(self):
-        Process.__init__(self, '部署链浏览器', 25)
+        Process.__init__(self, '部署链节点', 50)
 
-    def _run(self):
-        self._run_ansible_playbook("deploy_explorer")
-        self._progress_forward(100)
-        self.signals.checking_finished.emit()
+    def _deploy(self, snapshot, limit, last):
+        if not DeployChain.is_rolling_upgrade(last, snapshot):
+            # A new chain, or new validators, take the genesis and the peers made from all validators at once.
+            DeployStep._deploy(self, snapshot, limit, last)
+            return
+        v_names = [n for n in snapshot['hosts'] if limit is None or n in limit]
+        v_batches = DeployChain.rolling_batches(snapshot, v_names, Settings.chain_rolling_batch)
+        if v_names.__len__() <= Settings.chain_rolling_threshold or v_batches.__len__() <= 1:
+            DeployStep._deploy(self, snapshot, limit, last)
+            return
+        v_unhealthy = []
+        for (i, (group, batch)) in enumerate(v_batches):
+            if self._stopped():
+                return
+            self._log_msg('%s第%d/%d批：%s' % (self.name, i + 1, v_batches.__len__(), ', '.join(batch)))
+            # Each batch takes its part of progress by its number of nodes.
+            v_share = 100.0 * batch.__len__() / v_names.__len__()
+            # Batches of non-validators do not depend on each other, a failed one does not stop the rest.
+            v_exit_code = self._run_ansible_playbook(self.playbook, batch, v_share, group == 'validators')
+            if self._stopped():
+                return
+            self._progress_forward(v_share)
+            if v_exit_code != 0:
+                v_unhealthy += [snapshot['hosts'][n]['address'] for n in batch]
+                continue
+            v_failed = self._wait_healthy([snapshot['hosts'][n]['address'] for n in batch])
+            if not v_failed:
+                self._summary('%s第%d批%d个节点运行正常' % (self.name, i + 1, batch.__len__()))
+                continue
+            self._summary('%s第%d批节点未就绪(RPC无响应或仍在同步区块)：%s' % (
+                self.name, i + 1, ', '.join(v_failed)), False)
+            if group == 'validators':
+                # Further validators would only join a network that can not reach consensus.
+                self._summary('验证节点部署失败，停止后续批次', False)
+                self._process_failed()
+                return
+            v_unhealthy += v_failed
+        if v_unhealthy:
+            self._summary('%s部分非验证节点部署失败：%s' % (self.name, ', '.join(v_unhealthy)), False)
+            self._process_failed()
+
+    @staticmethod
+    def is_rolling_upgrade(last, current):
+        """Whether nodes can be deployed batch by batch, joining a running chain whose validators are the same."""
+        if last is None:
+            return False
+        v_validators = [dict((name, host) for (name, host) in snapshot['hosts'].items()
+                             if host['group'] == 'validators') for snapshot in (last, current)]
+        return v_validators[0] == v_validators[1]
+
+    @staticmethod
+    def rolling_batches(snapshot, names, batch):
+        """[(group, names)] to deploy one after another, validators first and never mixed with non-validators.
+
+        batch is a number of nodes, or a percentage of all names like '20%', so a small group is not split into
+        single nodes.
+        """
+        if str(batch).endswith('%'):
+            v_size = int(math.ceil(names.__len__() * float(str(batch)[:-1]) / 100))
+        else:
+            v_size = int(batch)
+        v_size = max(v_size, 1)
+        v_batches = []
+        for group in ('validators', 'nonvalidators'):
+            v_group = [n for n in names if snapshot['hosts'][n]['group'] == group]
+            v_batches += [(group, v_group[i:i + v_size]) for i in range(0, v_group.__len__(), v_size)]
+        return v_batches
 
+    def _wait_healthy(self, addresses):
+        """Poll rpc /status of the nodes from the ops master until all have caught up with the chain, returns
+        those which never did. A node that answers but is still catching up has not joined consensus yet.
+        """
+        host = self._get_first_ops_host()
+        v_deadline = time.time() + Settings.chain_health_timeout
+        v_pending = list(addresses)
+        while True:
+            # Cancellable, the nodes may take several seconds each to answer.
+            exit_code, output = self._exec_output(host,
+                'for a in %s; do curl -sf -m 3 http://$a:%s/status | grep -Eq \'"(catching_up|syncing)": *false\' '
+                '|| echo $a; done' % (
+                    ' '.join(v_pending), self.deploy_schema.chain_rpc_port))
+            v_pending = [a for a in output.split() if a in v_pending]
+            if not v_pending or time.time() > v_deadline or self._stopped() or Process.cancelled:
+                return v_pending
+            time.sleep(Settings.chain_health_interval)
+
+
+class DeployExplorer(DeployStep):
+    depends_on = (DeployChain,)
+    playbook = "deploy_explorer"
+    groups = ('explorer',)
+    settings = DeploySchema.EXPLORER_SETTINGS
+    group_vars = ('explorer_home', 'explorer_port', 'explorer_connect_host', 'rpc_port')
+
+    def __init__(self):
+        Process.__init__(self, '部署链浏览器', 25)
@@ -1,8 +1,20 @@
+import os
+import threading
+import time
+
 from PyQt5.QtCore import QRunnable
 from PyQt5.QtGui import QPixmap
 
+from chainup.ansible_events import AnsibleEvents
+from chainup.ansible_facts import AnsibleFactCache
+from chainup.connection_pool import pool
 from chainup.deploy_schema import DeploySchema
+from chainup.host import Host
 from chainup.log import logger
+from chainup.multiplexer import multiplexer
+from chainup.processes.progress import ProgressTracker
+from chainup.run_journal import run_journal
+from chainup.settings import Settings
 from chainup.ui.singles import SignalsForThreads
 from chainup.utils import Utils
 
@@ -14,15 +26,36 @@ class Process(QRunnable):
     STATUS_CHECKING = 1
     STATUS_PASSED = 2
     STATUS_FAILED = 3
+    STATUS_CANCELLED = 4
 
     TYPE_CHECKING = "checking"
     TYPE_DEPLOYMENT = "deployment"
 
     deploy_schema = None
     all_stopped = False
-    progress_value = 0
+    # Set by cancel_all(), the step that was running ends as cancelled instead of failed.
+    cancelled = False
+    # Set from the page of a run, every step runs and deploys to all hosts whatever the run journal says
+    force_full_run = False
+    # Incremented each time a run of checking or deployment jobs starts
+    run_id = 0
+    # Overall progress of the current run, see ProcessScheduler
+    progress = ProgressTracker()
     job_type = TYPE_CHECKING
     ui = None
+    # Process classes which have to pass before this one starts, see ProcessScheduler
+    depends_on = ()
+    # Whether a step that passed with the same inputs is skipped, see RunJournal
+    journaled = True
+    # Digest of the inputs of the current run and digests of the dependencies, see RunJournal
+    input_digest = None
+    upstream_digests = ()
+    # Recorded in the run journal when this step passes, see DeployStep
+    journal_snapshot = None
+
+    # Remote commands being followed by any step, killed by cancel_all()
+    _remote_commands = []
+    _remote_lock = threading.Lock()
 
     def __init__(self, name, progress_weight=20):
         super().__init__()
@@ -31,6 +64,13 @@ class Process(QRunnable):
         self.status_widget = None
         self.progress_weight = progress_weight
         self.signals = SignalsForThreads()
+        self._transfer_progress = {}
+        # Guards _transfer_progress, updated by the upload thread and the process thread at once
+        self._transfer_lock = threading.Lock()
+        # Percent of this step done, and the part of it being worked on(see _progress_begin)
+        self._progress_done = 0
+        self._progress_share = None
+        self._progress_partial = 0
 
     def set_status(self, status):
         self.status = status
@@ -48,15 +88,69 @@ class Process(QRunnable):
         elif status == Process.STATUS_FAILED:
             self.status_widget.setPixmap(QPixmap(":/icons/images/no.png"))
             self.status_widget.parent().setStyleSheet("border-color:#D81E06")
+        elif status == Process.STATUS_CANCELLED:
+            self.status_widget.setPixmap(QPixmap(":/icons/images/stop_checking.png"))
+            self.status_widget.parent().setStyleSheet("border-color:#FF9900")
 
     def run(self):
-        if Process.all_stopped:
-            return
-        self._log_msg('==========' + Utils.time_stamp() + ' 开始' + self.name + '==========')
-        self.set_status(Process.STATUS_CHECKING)
-        self._run()
-        if self.status == Process.STATUS_CHECKING:
-            self.set_status(Process.STATUS_PASSED)
+        try:
+            self.input_digest = run_journal.digest(type(self).__name__, self._inputs(), self.upstream_digests)
+            if self.journaled and not Process.force_full_run \
+                    and run_journal.has_passed(type(self).__name__, self.input_digest):
+                self._summary('%s上次已成功且输入未变，跳过' % self.name)
+                self.set_status(Process.STATUS_PASSED)
+                self._progress_forward(100)
+                return
+            self.journal_snapshot = None
+            self._progress_done = 0
+            self._progress_share = None
+            self._progress_partial = 0
+            self._log_msg('==========' + Utils.time_stamp() + ' 开始' + self.name + '==========')
+            self.set_status(Process.STATUS_CHECKING)
+            self._run()
+            if self.status == Process.STATUS_CHECKING and Process.cancelled:
+                # Stopped between remote commands.
+                self._process_cancelled('%s已取消' % self.name)
+            if self.status == Process.STATUS_CHECKING:
+                self.set_status(Process.STATUS_PASSED)
+            run_journal.record(type(self).__name__, self.input_digest, self.status == Process.STATUS_PASSED,
+                               self.journal_snapshot)
+        except Exception as e:
+            if Process.cancelled:
+                # A channel or shell session closed by cancel_all.
+                self._process_cancelled('%s已取消' % self.name)
+            else:
+                self._log_msg('%s异常：%s' % (self.name, e), False)
+                self._summary('%s失败' % self.name, False)
+                self._process_failed()
+            if self.input_digest is not None:
+                run_journal.record(type(self).__name__, self.input_digest, False)
+        finally:
+            self.signals.process_done.emit(self)
+
+    def skip(self, failed_dependency=None):
+        """Mark as cancelled without running, because a dependency did not pass or the run was stopped."""
+        self.set_status(Process.STATUS_CANCELLED)
+        if failed_dependency is not None:
+            self._summary('%s未执行：%s未通过' % (self.name, failed_dependency), False)
+
+    def _stopped(self):
+        """Whether this step should not go on, the run was stopped or an earlier part of this step failed."""
+        return Process.all_stopped or self.status in (Process.STATUS_FAILED, Process.STATUS_CANCELLED)
+
+    def _inputs(self):
+        """Everything this step depends on besides its dependencies, as a json-able object. Hosts and settings
+        of the whole schema by default.
+        """
+        return self.deploy_schema.snapshot()
+
+    @staticmethod
+    def _playbooks_digest():
+        if os.path.isdir(Settings.res_playbooks_dir):
+            return Utils.path_sha256(Settings.res_playbooks_dir)
+        if os.path.exists(Settings.res_playbooks):
+            return Utils.file_sha256(Settings.res_playbooks)
+        return None
 
     def _run(self):
         pass
@@ -79,63 +173,330 @@ class Process(QRunnable):
     def _summary(self, msg, passed=True):
         self.signals.summary_add.emit(passed, msg)
 
-    def _exec(self, command_desc, host, command):
-        output = host.exec_command_tail(command)
+    def _exec(self, command_desc, host, command, on_line=None, fail_step=True):
+        """Run command and report its outcome, a failure fails this step unless fail_step is False. Returns the
+        exit code.
+        """
         self._log_msg('{%s} %s >>' % (host.address, command_desc))
         # self._log_msg('')
-        self._log_stdout(output)
-        exit_code = output.channel.recv_exit_status()
+        exit_code = self._follow(host, command, on_line)
 
-        if exit_code == 0:
+        if Process.cancelled:
+            self._process_cancelled('{%s} %s已取消' % (host.address, command_desc))
+        elif exit_code == 0:
             self._summary('{%s} %s成功' % (host.address, command_desc))
         else:
             self._summary('{%s} %s失败' % (host.address, command_desc), False)
-            self._process_failed()
-        output.close()
+            if fail_step:
+                self._process_failed()
+        return exit_code
+
+    def _follow(self, host, command, on_line=None):
+        """Run command(cancellable, see cancel_all) and pass each line of its output to on_line, lines are
+        logged unless on_line returns True. Returns the exit code.
+        """
+        v_remote = RemoteCommand(host, host.open_channel(command, report_pgid=True))
+        Process._track(v_remote)
+        try:
+            return multiplexer.add(host.address, v_remote.channel,
+                                   lambda tag, event, data: self._log_channel_line(v_remote, event, data, on_line)).wait()
+        finally:
+            Process._untrack(v_remote)
+
+    def _exec_output(self, host, command):
+        """Run command like _follow(cancellable, with a pty), returns exit code and output instead of logging it."""
+        v_lines = []
+        exit_code = self._follow(host, command, lambda line: v_lines.append(line.rstrip('\r\n')) or True)
+        return exit_code, '\n'.join(v_lines)
+
+    def _log_channel_line(self, remote, event, data, on_line=None):
+        if event == 'exit':
+            return
+        if remote.pgid is None and data.startswith(Host.PGID_MARKER):
+            remote.pgid = data[len(Host.PGID_MARKER):].strip()
+            return
+        if on_line is not None and on_line(data):
+            return
+        self.signals.log_append.emit("| " + data.strip())
+        logger.debug(data.strip())
+
+    @staticmethod
+    def _exec_on_hosts(hosts, command_of):
+        """Run command_of(host) on all hosts at once(no pty), followed by the multiplexer instead of one thread
+        per host. Returns [(exit_code, stdout)] in the order of hosts.
+        """
+        v_outputs = [[] for host in hosts]
+        v_watches = []
+        v_remotes = []
+        try:
+            for (i, host) in enumerate(hosts):
+                def v_collect(tag, event, data, lines=v_outputs[i]):
+                    if event == 'stdout':
+                        lines.append(data)
+                v_remotes.append(RemoteCommand(host, host.open_channel(command_of(host), False)))
+                Process._track(v_remotes[-1])
+                v_watches.append(multiplexer.add(host.address, v_remotes[-1].channel, v_collect))
+            return [(watch.wait(), '\n'.join(lines)) for (watch, lines) in zip(v_watches, v_outputs)]
+        finally:
+            for remote in v_remotes:
+                Process._untrack(remote)
 
     def _upload_extract(self, src_desc, local_src, host, remote_dest):
-        self._log_msg('{%s} 正在上传%s >>>' % (host.address, src_desc))
-        self._log_msg('')
-        output = host.unarchive(local_src, remote_dest, self._upload_progress)
-        self._log_msg('{%s} 正在解压%s' % (host.address, src_desc))
-        self._log_stdout(output)
-        exit_code = output.channel.recv_exit_status()
-
-        if exit_code != 0:
+        if host.is_archive_extracted(local_src, remote_dest):
+            self._summary('{%s} %s已是最新，跳过上传及解压' % (host.address, src_desc))
+            return
+        self._transfer_progress = {'uploaded': 0, 'upload_size': 0, 'files': 0, 'bytes': 0, 'emitted': 0}
+        if Host.is_streamed(local_src):
+            self._log_msg('{%s} 正在上传并解压%s >>>' % (host.address, src_desc))
+            self._log_msg('')
+            output = host.unarchive(local_src, remote_dest, self._upload_progress)
+        else:
+            self._log_msg('{%s} 正在上传%s >>>' % (host.address, src_desc))
+            self._log_msg('')
+            output = host.unarchive(local_src, remote_dest, self._upload_progress)
+            self._log_msg('{%s} 正在解压%s' % (host.address, src_desc))
+            self._log_msg('')
+        v_remote = RemoteCommand(host, output.channel)
+        Process._track(v_remote)
+        try:
+            self._log_extract(output)
+            exit_code = output.channel.recv_exit_status()
+        finally:
+            Process._untrack(v_remote)
+        self._emit_transfer_progress(True)
+
+        if Process.cancelled:
+            self._process_cancelled('{%s} 上传并解压%s已取消' % (host.address, src_desc))
+        elif exit_code != 0:
             self._log_msg('{%s} 解压%s失败' % (host.address, src_desc))
             self._process_failed()
         else:
             self._summary('{%s} 上传并解压%s成功' % (host.address, src_desc))
-            self._log_msg('{%s} 解压%s成功' % (host.address, src_desc))
+            self._log_msg('{%s} 解压%s成功：%d个文件，共%.2fMB' % (
+                host.address, src_desc, self._transfer_progress['files'],
+                self._transfer_progress['bytes'] / 1048576))
+
+    def _log_extract(self, output):
+        """Count files and bytes in the verbose listing of tar, instead of sending each line to ui.
+        The listing itself is written to log file only if Settings.extract_listing is set.
+        """
+        for line in iter(output.readline, ""):
+            fields = line.split()
+            # e.g. '-rw-r--r-- root/root      1234 2018-08-01 10:00 playbooks/site.yml'
+            if len(fields) >= 6 and fields[2].isdigit():
+                # Directories are listed too, e.g. 'drwxr-xr-x root/root 0 2018-08-01 10:00 playbooks/'
+                if not fields[0].startswith('d') and not fields[-1].endswith('/'):
+                    with self._transfer_lock:
+                        self._transfer_progress['files'] += 1
+                        self._transfer_progress['bytes'] += int(fields[2])
+                if Settings.extract_listing:
+                    logger.debug(line.strip())
+            else:
+                # Not a listing line, e.g. error messages of tar.
+                logger.error(line.strip())
+            self._emit_transfer_progress()
 
     def _upload_progress(self, transferred, to_be_transferred):
-        self.signals.log_overwrite_last_line.emit(
-            '| 已上传%.2fMB/%.2fMB(%.1f%%)' % (transferred / 1048576, to_be_transferred / 1048576,
-                                            transferred * 100 / to_be_transferred))
+        with self._transfer_lock:
+            self._transfer_progress['uploaded'] = transferred
+            self._transfer_progress['upload_size'] = to_be_transferred
+        self._emit_transfer_progress()
+
+    def _emit_transfer_progress(self, force=False):
+        """Overwrite the last log line with upload and extraction progress, at most once per
+        Settings.progress_interval seconds.
+        """
+        now = time.time()
+        with self._transfer_lock:
+            if not force and now - self._transfer_progress['emitted'] < Settings.progress_interval:
+                return
+            self._transfer_progress['emitted'] = now
+            v_progress = dict(self._transfer_progress)
+        msg = '|'
+        if v_progress['upload_size'] > 0:
+            msg += ' 已上传%.2fMB/%.2fMB(%.1f%%)' % (
+                v_progress['uploaded'] / 1048576, v_progress['upload_size'] / 1048576,
+                v_progress['uploaded'] * 100 / v_progress['upload_size'])
+        msg += ' 已解压%d个文件(%.2fMB)' % (v_progress['files'], v_progress['bytes'] / 1048576)
+        self.signals.log_overwrite_last_line.emit(msg)
+        if v_progress['upload_size'] > 0:
+            self._progress_part(v_progress['uploaded'] / v_progress['upload_size'])
 
     def _get_first_ops_host(self):
         v_host = sorted(self.deploy_schema.ops_master.keys())[0]
         return self.deploy_schema.ops_master[v_host]
 
+    def _get_chain_nodes(self):
+        v_nodes = dict(self.deploy_schema.chain_validators)
+        v_nodes.update(self.deploy_schema.chain_non_validators)
+        return [v_nodes[k] for k in sorted(v_nodes.keys())]
+
     def _get_one_validator_address(self):
         return sorted(self.deploy_schema.chain_validators.keys())[0]
 
-    def _run_ansible_playbook(self, playbook):
-        if Process.all_stopped:
-            return
+    def _group_vars(self):
+        """(pattern, key, value) of the lines of group_vars/all which are set from the schema, see
+        PreparePlaybooks. Some values come from hosts of other groups, e.g. es_host is the ops master.
+        """
+        host = self._get_first_ops_host()
+        return [
+            ('peer_port: ', 'peer_port: ', self.deploy_schema.chain_peer_port),
+            ('rpc_port: ', 'rpc_port: ', self.deploy_schema.chain_rpc_port),
+            ('proxy_app: ', 'proxy_app: ', self.deploy_schema.chain_proxy_app),
+            ('chain_home : ', 'chain_home : ', host.absolute_path(self.deploy_schema.chain_home)),
+            ('es_host: ', 'es_host: ', host.address),
+            ('es_port: ', 'es_port: ', self.deploy_schema.ops_es_port),
+            ('monitor_home : ', 'monitor_home : ', host.absolute_path(self.deploy_schema.ops_monitor_home)),
+            ('kibana_port: ', 'kibana_port: ', self.deploy_schema.ops_kibana_port),
+            ('explorer_home : ', 'explorer_home : ', host.absolute_path(self.deploy_schema.chain_explorer_home)),
+            ('explorer_port: ', 'explorer_port: ', self.deploy_schema.chain_explorer_port),
+            ('explorer_connected_host: ', 'explorer_connect_host: ', self._get_one_validator_address()),
+            ('crypto_with_sm2: ', 'crypto_with_sm2: ', 'true' if self.deploy_schema.chain_crypto_sm else 'false'),
+        ]
+
+    def _run_ansible_playbook(self, playbook, limit=None, share=None, fail_step=True):
+        """limit: inventory names to run on instead of all hosts of the playbook. share: percent of this step
+        the run takes(see _progress_begin). fail_step: see _exec. Returns the exit code, None if not run.
+        """
+        if self._stopped():
+            return None
+        self._progress_begin(share)
         host = self._get_first_ops_host()
-        self._exec(self.name, host,
-                   'cd %s && ansible-playbook %s.yml' % (host.absolute_path(DeploySchema.PLAYBOOKS_DIR), playbook))
+        self._log_fact_cache(host)
+        command = 'cd %s && %s ansible-playbook %s.yml' % (
+            host.absolute_path(DeploySchema.PLAYBOOKS_DIR), Process._ansible_env(host), playbook)
+        if limit:
+            command += " --limit '%s'" % ','.join(limit)
+        v_events = AnsibleEvents()
+        return self._exec(self.name, host, command,
+                          lambda line: self._show_ansible_event(v_events, v_events.feed(line)), fail_step)
+
+    @staticmethod
+    def _ansible_env(host):
+        """Prepended to ansible-playbook on the ops master: the config generated by PreparePlaybooks, and the
+        callback plugin by which runs are followed.
+        """
+        return 'ANSIBLE_CONFIG=%s %s' % (
+            host.absolute_path(DeploySchema.PLAYBOOKS_DIR + '/' + DeploySchema.ANSIBLE_CFG), AnsibleEvents.ENV)
+
+    def _show_ansible_event(self, events, event):
+        """Log an event of the chainup_events callback plugin, a failed host is reported at once. Returns
+        False for lines which are no event.
+        """
+        if event is None:
+            return False
+        kind = event.get('event')
+        if kind == 'play':
+            self._log_msg('| PLAY [%s]' % event.get('name'))
+        elif kind == 'task':
+            self._log_msg('| TASK [%s]' % event.get('name'))
+        elif kind in ('failed', 'unreachable') and not event.get('ignored'):
+            v_msg = '{%s} %s%s：%s' % (event.get('host'), event.get('task'),
+                                      '失败' if kind == 'failed' else '无法连接', event.get('msg', '').strip())
+            self._log_msg('| ' + v_msg, False)
+            self._summary(v_msg[:200], False)
+            self._progress_part(events.fraction())
+        elif kind in AnsibleEvents.RESULTS:
+            self.signals.log_overwrite_last_line.emit('| TASK [%s] %d台主机已完成' % (events.task, events.task_done))
+            self._progress_part(events.fraction())
+        elif kind == 'stats':
+            for (name, recap) in sorted((event.get('hosts') or {}).items()):
+                self._log_msg('| {%s} ok=%d changed=%d unreachable=%d failed=%d skipped=%d' % (
+                    name, recap.get('ok', 0), recap.get('changed', 0), recap.get('unreachable', 0),
+                    recap.get('failures', 0), recap.get('skipped', 0)),
+                    not recap.get('failures') and not recap.get('unreachable'))
+        return True
+
+    def _log_fact_cache(self, host):
+        """Hits and misses of the ansible fact cache for the playbook about to run."""
+        v_names = sorted(set(name for (group, name, h) in self.deploy_schema.inventory_hosts()))
+        try:
+            v_hits, v_misses = AnsibleFactCache(host).stats(v_names)
+        except Exception as e:
+            logger.debug('Count ansible fact cache on %s failed: %s' % (host.address, e))
+            return
+        self._log_msg('{%s} facts缓存命中%d台，未命中%d台' % (host.address, v_hits, v_misses))
 
     def _progress_forward(self, delta):
-        delta_value = round(delta * self.progress_weight / 100)
-        if Process.progress_value + delta_value < 100:
-            Process.progress_value = Process.progress_value + delta_value
-        else:
-            Process.progress_value = 99
-        self.signals.progress_value_change.emit(Process.progress_value)
+        """delta percent more of this step is done, which ends the part begun by _progress_begin."""
+        self._progress_done = min(self._progress_done + delta, 100)
+        self._progress_share = None
+        self._progress_partial = 0
+        self._report_progress()
+
+    def _progress_begin(self, share=None):
+        """The part of this step started now takes share percent of it, the rest of the step by default.
+        Progress within the part is reported by _progress_part, until _progress_forward is called.
+        """
+        self._progress_share = share
+        self._progress_partial = 0
+
+    def _progress_part(self, fraction):
+        """fraction(0~1) of the current part is done, e.g. bytes uploaded or host results of a playbook."""
+        v_share = self._progress_share if self._progress_share is not None else 100 - self._progress_done
+        self._progress_partial = v_share * max(0, min(fraction, 1))
+        self._report_progress()
+
+    def _report_progress(self):
+        v_value, v_eta = Process.progress.update(self, self._progress_done + self._progress_partial)
+        self.signals.progress_value_change.emit(v_value)
+        self.signals.progress_eta_change.emit(int(v_eta))
 
     def _process_failed(self):
-        Process.all_stopped = True
+        """Steps depending on this one are skipped by the scheduler, independent ones go on."""
         self.set_status(Process.STATUS_FAILED)
-        self.signals.finished.emit()
+
+    def _process_cancelled(self, msg):
+        self.set_status(Process.STATUS_CANCELLED)
+        self._summary(msg, False)
+
+    @staticmethod
+    def _track(remote):
+        with Process._remote_lock:
+            Process._remote_commands.append(remote)
+
+    @staticmethod
+    def _untrack(remote):
+        with Process._remote_lock:
+            if remote in Process._remote_commands:
+                Process._remote_commands.remove(remote)
+
+    @staticmethod
+    def cancel_all():
+        """Stop the current run at once: no further step starts, the remote commands being followed are killed
+        and their channels closed, and the shell sessions are closed, so the running step returns within about a
+        second as cancelled. Steps check Process.cancelled between other units of work.
+        """
+        Process.all_stopped = True
+        Process.cancelled = True
+        with Process._remote_lock:
+            v_remotes = list(Process._remote_commands)
+        for remote in v_remotes:
+            remote.cancel()
+        # Short commands in shell sessions fail at once, instead of being waited for.
+        pool.close_shell_sessions()
+        logger.info('Cancelled, %d remote commands killed.' % v_remotes.__len__())
+
+
+class RemoteCommand(object):
+    """A command started by a step on a remote host, with its process group id once the command reported it."""
+
+    def __init__(self, host, channel):
+        self.host = host
+        self.channel = channel
+        self.pgid = None
+
+    def cancel(self):
+        v_pgid = self.pgid
+        # Closing the channel makes reads return at once and hangs up the pty of the command.
+        multiplexer.close(self.channel)
+        if v_pgid and v_pgid.isdigit():
+            v_killer = threading.Thread(target=self._kill, args=(v_pgid,))
+            v_killer.daemon = True
+            v_killer.start()
+
+    def _kill(self, pgid):
+        try:
+            self.host.kill_process_group(pgid)
+        except Exception as e:
+            logger.error('Kill process group %s on %s failed: %s' % (pgid, self.host.address, e))
@@ -0,0 +1,45 @@
+import threading
+import time
+from collections import deque
+
+from chainup.settings import Settings
+
+
+class ProgressTracker(object):
+    """Overall progress of a run of processes and the time it has left.
+
+    Each process reports how much of its own work is done(0~100), and the overall progress is the average
+    weighted by Process.progress_weight. The time left is estimated from the progress made within the last
+    Settings.progress_eta_window seconds, so it follows the current throughput rather than the average one.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._weights = {}
+        self._done = {}
+        self._samples = deque()
+
+    def start(self, jobs):
+        with self._lock:
+            self._weights = dict((job, job.progress_weight) for job in jobs)
+            self._done = {}
+            self._samples = deque([(time.time(), 0.0)])
+
+    def update(self, job, percent):
+        """Returns overall progress(0~100) and estimated seconds left, -1 if unknown yet."""
+        with self._lock:
+            self._weights.setdefault(job, job.progress_weight)
+            self._done[job] = max(0.0, min(float(percent), 100.0))
+            v_total = sum(self._weights.values()) or 1
+            v_value = sum(w * self._done.get(j, 0.0) for (j, w) in self._weights.items()) / v_total
+            now = time.time()
+            self._samples.append((now, v_value))
+            while self._samples.__len__() > 2 and now - self._samples[1][0] > Settings.progress_eta_window:
+                self._samples.popleft()
+            (v_then, v_value_then) = self._samples[0]
+        v_eta = -1
+        if v_value >= 100:
+            v_eta = 0
+        elif v_value > v_value_then and now - v_then >= Settings.progress_eta_min_elapsed:
+            v_eta = (100 - v_value) * (now - v_then) / (v_value - v_value_then)
+        return int(v_value), v_eta
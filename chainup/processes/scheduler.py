@@ -0,0 +1,70 @@
+from PyQt5.QtCore import QObject, QThreadPool, pyqtSignal, pyqtSlot
+
+from chainup.log import logger
+from chainup.processes.process import Process
+from chainup.settings import Settings
+
+
+class ProcessScheduler(QObject):
+    """Runs processes as a dependency graph declared by Process.depends_on.
+
+    A process is started as soon as all of its dependencies have passed, so independent steps run at the same
+    time and a run takes as long as its critical path. When a process fails or is cancelled only the processes
+    downstream of it are skipped, and a process that has passed last time with the same inputs passes at once
+    without running(see RunJournal). all_finished is emitted once nothing is running or left to start.
+    """
+    all_finished = pyqtSignal()
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._thread_pool = QThreadPool()
+        self._thread_pool.setMaxThreadCount(Settings.process_max_parallel)
+        self._jobs = []
+        self._running = set()
+        self._connected = set()
+
+    def start(self, jobs):
+        self._jobs = list(jobs)
+        self._running.clear()
+        Process.run_id += 1
+        Process.progress.start(self._jobs)
+        for job in self._jobs:
+            job.set_status(Process.STATUS_NOT_STARTED)
+            job.input_digest = None
+            if id(job) not in self._connected:
+                job.signals.process_done.connect(self.slot_process_done)
+                self._connected.add(id(job))
+        self._schedule()
+
+    def is_running(self):
+        return self._running.__len__() > 0
+
+    @pyqtSlot(object)
+    def slot_process_done(self, job):
+        logger.debug('%s done, status %d.' % (job.name, job.status))
+        self._running.discard(job)
+        self._schedule()
+
+    def _dependencies(self, job):
+        v_jobs = {type(j): j for j in self._jobs}
+        return [v_jobs[t] for t in job.depends_on if t in v_jobs]
+
+    def _schedule(self):
+        v_changed = True
+        while v_changed:
+            v_changed = False
+            for job in self._jobs:
+                if job.status != Process.STATUS_NOT_STARTED or job in self._running:
+                    continue
+                v_deps = self._dependencies(job)
+                v_blocking = [d for d in v_deps if d.status in (Process.STATUS_FAILED, Process.STATUS_CANCELLED)]
+                if Process.all_stopped or v_blocking:
+                    # Skipping may unblock skipping of further downstream processes.
+                    job.skip(v_blocking[0].name if v_blocking else None)
+                    v_changed = True
+                elif all(d.status == Process.STATUS_PASSED for d in v_deps):
+                    job.upstream_digests = [d.input_digest for d in v_deps]
+                    self._running.add(job)
+                    self._thread_pool.start(job)
+        if not self._running:
+            self.all_finished.emit()
@@ -0,0 +1,74 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+from chainup.log import logger
+from chainup.settings import Settings
+
+
+class RunJournal(object):
+    """On-disk journal of check and deployment steps, so that a new run goes on where the last one stopped.
+
+    Each step is recorded with the digest of its inputs and its outcome. The digest covers the digests of the
+    steps it depends on, so a step whose dependency has run with other inputs runs again as well. A step that
+    has passed with the same digest within ttl seconds is not run again.
+    """
+
+    def __init__(self, path=None, ttl=None):
+        self.path = path or Settings.run_journal_path
+        self.ttl = ttl or Settings.run_journal_ttl
+        self._lock = threading.Lock()
+        self._entries = None
+
+    @staticmethod
+    def digest(step, inputs, upstream_digests=()):
+        v_data = json.dumps({'step': step, 'inputs': inputs, 'upstream': sorted(upstream_digests)},
+                            sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(v_data.encode('utf-8')).hexdigest()
+
+    def has_passed(self, step, digest):
+        with self._lock:
+            entry = self._load().get(step)
+        return entry is not None and entry.get('digest') == digest and entry.get('passed') \
+            and time.time() - entry.get('time', 0) <= self.ttl
+
+    def record(self, step, digest, passed, snapshot=None):
+        """snapshot is what a passed step has deployed, kept until the step passes again with a new one."""
+        with self._lock:
+            entries = self._load()
+            entry = {'digest': digest, 'passed': passed, 'time': time.time()}
+            if passed and snapshot is not None:
+                entry['snapshot'] = snapshot
+            elif 'snapshot' in entries.get(step, {}):
+                entry['snapshot'] = entries[step]['snapshot']
+            entries.update({step: entry})
+            self._save()
+
+    def last_snapshot(self, step):
+        """What step has deployed when it last passed, or None."""
+        with self._lock:
+            return self._load().get(step, {}).get('snapshot')
+
+    def _load(self):
+        if self._entries is None:
+            try:
+                with open(self.path, encoding='utf-8') as f:
+                    self._entries = json.load(f)
+            except (OSError, ValueError):
+                self._entries = {}
+        return self._entries
+
+    def _save(self):
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp_path = self.path + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(self._entries, f, ensure_ascii=False, indent=1)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.error('Save run journal to %s failed: %s' % (self.path, e))
+
+
+run_journal = RunJournal()
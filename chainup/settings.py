@@ -1,7 +1,79 @@
+import os
+
+
 class Settings(object):
     res_dir = 'D:\ChainUp\\'
     res_rpm_ansible = res_dir + "rpm_ansible.tar.gz"
     res_rpm_sshpass = res_dir + "rpm_sshpass.tar.gz"
     res_playbooks = res_dir + "playbooks.tar.gz"
+    # Synchronized with block-level deltas instead of res_playbooks when it exists
+    res_playbooks_dir = res_dir + "playbooks"
 
     log_path = 'D:\ChainUp\\chainup.log'
+
+    # SSH connection pool shared by all hosts
+    ssh_pool_max_connections = 64
+    ssh_pool_idle_timeout = 300
+    ssh_pool_wait_timeout = 30
+
+    # Host facts cached on disk, refreshed after ttl seconds
+    fact_cache_path = os.path.join(os.path.expanduser('~'), '.chainup', 'facts.json')
+    fact_cache_ttl = 24 * 3600
+
+    # Files are uploaded in chunks over several SFTP channels
+    upload_streams = 4
+    upload_chunk_size = 4 * 1048576
+
+    # Archives up to stream_extract_max_size bytes are piped into tar on remote hosts instead of being staged in
+    # /tmp, larger ones are uploaded over upload_streams channels first, which is faster than one stream
+    stream_extract = True
+    stream_extract_max_size = 32 * 1048576
+
+    # Full tar listings are written to log file only when set
+    extract_listing = False
+    # Minimal seconds between two progress updates of one transfer
+    progress_interval = 0.2
+
+    # Nodes holding an image archive serve it to others on this port of their address while distributing
+    artifact_relay_port = 18080
+    artifact_relay_max_threads = 32
+    # Seconds a node waits for its relay server to answer before it is used anyway
+    artifact_relay_ready_timeout = 5
+
+    # Block size of the rolling checksum in delta synchronization
+    delta_block_size = 2048
+
+    # The asyncio loop is stepped by the Qt loop every tick(milliseconds), blocking calls of async hosts
+    # run on at most async_max_blocking_threads threads
+    async_tick_interval = 10
+    async_max_blocking_threads = 16
+
+    # Check or deployment steps whose dependencies have passed run at the same time, up to this many
+    process_max_parallel = 4
+
+    # All check playbooks run in one ansible-playbook invocation
+    combined_checks = True
+
+    # Ansible config generated in the playbooks directory: forks follow the number of hosts up to ansible_max_forks,
+    # the fast profile caches facts for ansible_fact_cache_timeout seconds and keeps SSH connections open for
+    # ansible_control_persist seconds
+    ansible_max_forks = 50
+    ansible_fact_cache_timeout = 24 * 3600
+    ansible_control_persist = 600
+
+    # Steps recorded in the run journal as passed are not run again with the same inputs within ttl seconds
+    run_journal_path = os.path.join(os.path.expanduser('~'), '.chainup', 'journal.json')
+    run_journal_ttl = 24 * 3600
+
+    # Chain nodes are deployed in batches of chain_rolling_batch nodes(or a percentage like '20%') when there are
+    # more than chain_rolling_threshold of them, validators first. Each batch has to answer on rpc /status
+    # within chain_health_timeout seconds before the next one starts
+    chain_rolling_batch = '20%'
+    chain_rolling_threshold = 20
+    chain_health_timeout = 120
+    chain_health_interval = 3
+
+    # The time left of a run is estimated from the progress of the last progress_eta_window seconds, once
+    # progress_eta_min_elapsed seconds of it have been seen
+    progress_eta_window = 60
+    progress_eta_min_elapsed = 5
@@ -0,0 +1,75 @@
+import threading
+import uuid
+
+from chainup.log import logger
+
+
+class ShellSession(object):
+    """A long-lived remote shell(no pty) running queued commands over one channel.
+
+    Every command runs in a subshell with stdin from /dev/null and stderr merged into stdout, followed by a
+    sentinel line holding a token, its sequence number and its exit code, by which the output stream is split
+    back into the results of each command. Running a command costs one write instead of opening a channel and
+    allocating a pty.
+    """
+    SENTINEL = '@@chainup-end:'
+
+    def __init__(self, client, timeout=300):
+        self._channel = client.get_transport().open_session(timeout=timeout)
+        self._channel.settimeout(timeout)
+        self._channel.exec_command('/bin/sh')
+        self._token = uuid.uuid4().hex
+        self._sequence = 0
+        self._buffer = b''
+        self._lock = threading.Lock()
+
+    def is_alive(self):
+        return not self._channel.closed and not self._channel.exit_status_ready()
+
+    def run(self, command):
+        """Returns exit code and output of command."""
+        return self.run_batch([command])[0]
+
+    def run_batch(self, commands):
+        """Send all commands at once, and return [(exit_code, output), ...] in the same order."""
+        with self._lock:
+            v_first = self._sequence + 1
+            v_script = ''
+            for command in commands:
+                self._sequence += 1
+                v_script += '( %s\n) < /dev/null 2>&1; printf "\\n%s%s:%d:%%d\\n" $?\n' % (
+                    command, ShellSession.SENTINEL, self._token, self._sequence)
+            results = []
+            try:
+                self._channel.sendall(v_script.encode('utf-8'))
+                for i in range(commands.__len__()):
+                    results.append(self._read_result(v_first + i))
+                    logger.debug('shell_session: %s, exit %d.' % (commands[i], results[-1][0]))
+            except Exception:
+                # The stream can not be framed any more, a new session is opened next time.
+                self.close()
+                raise
+            return results
+
+    def _read_result(self, sequence):
+        v_marker = ('\n%s%s:%d:' % (ShellSession.SENTINEL, self._token, sequence)).encode('utf-8')
+        while True:
+            v_start = self._buffer.find(v_marker)
+            if v_start > -1:
+                v_end = self._buffer.find(b'\n', v_start + v_marker.__len__())
+                if v_end > -1:
+                    break
+            data = self._channel.recv(65536)
+            if not data:
+                raise EOFError('Remote shell closed.')
+            self._buffer += data
+        v_output = self._buffer[:v_start].decode('utf-8', 'replace')
+        v_exit_code = int(self._buffer[v_start + v_marker.__len__():v_end])
+        self._buffer = self._buffer[v_end + 1:]
+        return v_exit_code, v_output
+
+    def close(self):
+        try:
+            self._channel.close()
+        except Exception as e:
+            logger.debug('Close shell session failed: %s' % e)
@@ -0,0 +1,25 @@
+import json
+
+from chainup.ansible_events import AnsibleEvents
+
+
+def _line(event, **fields):
+    fields['event'] = event
+    return AnsibleEvents.PREFIX + json.dumps(fields)
+
+
+def test_ansible_events():
+    events = AnsibleEvents()
+    assert events.feed(' [WARNING]: provided hosts list is empty') is None
+    assert events.feed(_line('play', name='deploy', hosts=['tcnode0', 'tcnode1'], tasks=3))['event'] == 'play'
+    events.feed(_line('task', name='start node'))
+    events.feed(_line('ok', host='tcnode0', task='start node', changed=True, ignored=False))
+    events.feed(_line('failed', host='tcnode1', task='start node', changed=False, ignored=True, msg='ignored'))
+    assert events.task == 'start node' and events.task_done == 2
+    assert events.failed_hosts() == []
+
+    events.feed(_line('task', name='check port'))
+    events.feed(_line('unreachable', host='tcnode1', task='check port', changed=False, ignored=False, msg='timeout'))
+    assert events.task_done == 1
+    assert events.failed_hosts() == ['tcnode1']
+    assert events.results == {'tcnode0': {'ok': 1}, 'tcnode1': {'failed': 1, 'unreachable': 1}}
@@ -0,0 +1,15 @@
+from chainup.ansible_facts import AnsibleFactCache
+
+
+def test_stale_names():
+    index = {'tcnode0': 'root@10.1.1.30:22', 'tcnode1': 'root@10.1.1.31:22', 'ops-0': 'root@10.1.1.32:22'}
+    inventory = {'tcnode0': 'root@10.1.1.30:22', 'tcnode1': 'root@10.1.1.33:22', 'tcnode2': 'root@10.1.1.31:22'}
+    # tcnode1 stands for another host now, ops-0 is gone
+    assert AnsibleFactCache.stale_names(index, inventory) == ['ops-0', 'tcnode1']
+    # no index: whatever is cached is dropped
+    assert AnsibleFactCache.stale_names({'tcnode0': None, 'old': None}, inventory) == ['old', 'tcnode0']
+
+
+def test_count():
+    mtimes = {'tcnode0': 1000, 'tcnode1': 100}
+    assert AnsibleFactCache.count(mtimes, 1100, ['tcnode0', 'tcnode1', 'tcnode2'], 600) == (1, 2)
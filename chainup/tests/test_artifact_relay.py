@@ -0,0 +1,29 @@
+from chainup.artifact_relay import ArtifactRelay
+
+
+def test_image_copies():
+    text = '''
+- name: copy node image
+  copy:
+    src: img-node.tar
+    dest: "{{ chain_home }}/images/"
+  tags: image
+
+- name: load node image
+  shell: docker load -i {{ chain_home }}/images/img-node.tar
+
+- name: copy config
+  copy: src=config.toml dest={{ chain_home }}/config/
+
+- copy: src=img-proxy.tar dest=/opt/images/img-proxy.tar mode=0644
+'''
+    assert ArtifactRelay.image_copies(text) == [('img-node.tar', '{{ chain_home }}/images/'),
+                                                ('img-proxy.tar', '/opt/images/img-proxy.tar')]
+
+
+def test_source_and_dest():
+    assert ArtifactRelay.source_candidates('roles/chain/tasks/main.yml', 'img-node.tar') == \
+        ['roles/chain/files/img-node.tar', 'roles/chain/img-node.tar']
+    assert ArtifactRelay.source_candidates('deploy_chain.yml', 'img-node.tar') == ['files/img-node.tar', 'img-node.tar']
+    assert ArtifactRelay.resolve('{{ chain_home }}/images/', {'chain_home': '/root/chain'}) == '/root/chain/images/'
+    assert ArtifactRelay.resolve('{{ image_dir }}/', {'chain_home': '/root/chain'}) is None
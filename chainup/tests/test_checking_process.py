@@ -0,0 +1,18 @@
+from chainup.processes.checking_process import PreparePlaybooks
+
+
+def test_merge_ansible_cfg():
+    shipped = '[defaults]\nroles_path = ./roles\nforks = 5\n\n[ssh_connection]\nssh_args = -o ServerAliveInterval=30\n'
+    cfg = PreparePlaybooks.merge_ansible_cfg(shipped, {
+        'defaults': {'forks': '20', 'inventory': '/root/.playbooks/trustchain-nodes'},
+        'ssh_connection': {'ssh_args': '-o ControlMaster=auto'}})
+    assert 'roles_path = ./roles\n' in cfg
+    assert 'forks = 20\n' in cfg and 'forks = 5' not in cfg
+    assert 'inventory = /root/.playbooks/trustchain-nodes\n' in cfg
+    assert 'ssh_args = -o ServerAliveInterval=30 -o ControlMaster=auto\n' in cfg
+
+
+def test_merge_without_shipped_cfg():
+    cfg = PreparePlaybooks.merge_ansible_cfg('', {'defaults': {'gathering': 'smart'}})
+    assert '[defaults]\ngathering = smart\n' in cfg
+    assert PreparePlaybooks.merge_ansible_cfg('forks = 5\n', {'defaults': {}}).count('forks') == 0
@@ -0,0 +1,34 @@
+import os
+
+from chainup.delta_sync import DeltaSync, apply_delta, block_signatures, compute_delta
+from chainup.host import Host
+
+
+def test_delta_round_trip():
+    basis = os.urandom(10000)
+    data = basis[:3000] + b'inserted' + basis[3000:7000] + basis[7100:]
+    delta = compute_delta(data, block_signatures(basis, 512), 512)
+    assert apply_delta(basis, delta, 512) == data
+    assert sum(len(arg) for (op, arg) in delta if op == 'd') < 2 * 512
+
+
+def test_delta_without_basis():
+    data = b'- hosts: all\n'
+    assert compute_delta(data, [], 512) == [['d', data]]
+    assert apply_delta(b'', compute_delta(b'', [], 512), 512) == b''
+
+
+def test_excluded_paths():
+    sync = DeltaSync(Host('10.1.1.30', 'root', '', 22), '/tmp/playbooks', '~/playbooks',
+                     exclude=['trustchain-nodes', 'callback_plugins/'])
+    assert sync.is_excluded('trustchain-nodes')
+    assert sync.is_excluded('callback_plugins/chainup_events.py')
+    assert not sync.is_excluded('trustchain-nodes.bak')
+    assert not sync.is_excluded('roles/chain/tasks/main.yml')
+
+
+def test_stopped_sync():
+    host = Host('10.1.1.30', 'root', '', 22)
+    host.put_content = lambda data, path: None
+    host.exec_command_fast = lambda *args, **kwargs: (_ for _ in ()).throw(AssertionError('called'))
+    assert DeltaSync(host, '/tmp/playbooks', '~/playbooks', stopped=lambda: True).sync() is None
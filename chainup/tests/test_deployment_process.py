@@ -0,0 +1,61 @@
+from chainup.processes.deployment_process import DeployChain, DeployStep
+
+
+def _snapshot(hosts, settings=None, upstream=None):
+    return {'settings': settings or {'chain_rpc_port': '26657'}, 'playbooks': 'aa', 'upstream': upstream or ['bb'],
+            'hosts': dict((name, {'group': group, 'address': address}) for (name, group, address) in hosts)}
+
+
+def test_limit_of():
+    last = _snapshot([('tcnode0', 'validators', '10.1.1.30'), ('tcnode1', 'nonvalidators', '10.1.1.31')])
+    full_groups = ('validators',)
+    assert DeployStep.limit_of(None, last, full_groups) is None
+    assert DeployStep.limit_of(last, last, full_groups) == []
+
+    # a non-validator added
+    current = _snapshot([('tcnode0', 'validators', '10.1.1.30'), ('tcnode1', 'nonvalidators', '10.1.1.31'),
+                         ('tcnode2', 'nonvalidators', '10.1.1.32')])
+    assert DeployStep.limit_of(last, current, full_groups) == ['tcnode2']
+
+    # validators changed, or settings changed
+    current = _snapshot([('tcnode0', 'validators', '10.1.1.33'), ('tcnode1', 'nonvalidators', '10.1.1.31')])
+    assert DeployStep.limit_of(last, current, full_groups) is None
+    current = _snapshot([('tcnode0', 'validators', '10.1.1.30'), ('tcnode1', 'nonvalidators', '10.1.1.31')],
+                        {'chain_rpc_port': '36657'})
+    assert DeployStep.limit_of(last, current, full_groups) is None
+
+    # a dependency has deployed other inputs, e.g. the ops master moved
+    current = _snapshot([('tcnode0', 'validators', '10.1.1.30'), ('tcnode1', 'nonvalidators', '10.1.1.31')],
+                        upstream=['cc'])
+    assert DeployStep.limit_of(last, current, full_groups) is None
+
+
+def test_is_rolling_upgrade():
+    last = _snapshot([('tcnode0', 'validators', '10.1.1.30'), ('tcnode1', 'nonvalidators', '10.1.1.31')])
+    assert not DeployChain.is_rolling_upgrade(None, last)
+    assert DeployChain.is_rolling_upgrade(last, last)
+    current = _snapshot([('tcnode0', 'validators', '10.1.1.30'), ('tcnode1', 'nonvalidators', '10.1.1.32')])
+    assert DeployChain.is_rolling_upgrade(last, current)
+    current = _snapshot([('tcnode0', 'validators', '10.1.1.33'), ('tcnode1', 'nonvalidators', '10.1.1.31')])
+    assert not DeployChain.is_rolling_upgrade(last, current)
+
+
+def test_rolling_batches():
+    names = ['tcnode%d' % i for i in range(10)]
+    snapshot = _snapshot([(n, 'validators', '10.1.1.%d' % i) for (i, n) in enumerate(names)])
+    assert DeployChain.rolling_batches(snapshot, names, 4) == \
+        [('validators', names[0:4]), ('validators', names[4:8]), ('validators', names[8:10])]
+    assert DeployChain.rolling_batches(snapshot, names, '20%') == \
+        [('validators', names[i:i + 2]) for i in (0, 2, 4, 6, 8)]
+    assert DeployChain.rolling_batches(snapshot, names[:3], '20%') == [('validators', [n]) for n in names[:3]]
+    assert DeployChain.rolling_batches(snapshot, [], 4) == []
+
+
+def test_rolling_batches_small_group():
+    # 20% of 30 nodes is 6 per batch, for the 8 non-validators too.
+    hosts = [('tcnode%d' % i, 'validators' if i < 22 else 'nonvalidators', '10.1.1.%d' % i) for i in range(30)]
+    names = [name for (name, group, address) in hosts]
+    batches = DeployChain.rolling_batches(_snapshot(hosts), names, '20%')
+    assert [(group, batch.__len__()) for (group, batch) in batches] == \
+        [('validators', 6), ('validators', 6), ('validators', 6), ('validators', 4),
+         ('nonvalidators', 6), ('nonvalidators', 2)]
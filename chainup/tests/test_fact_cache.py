@@ -0,0 +1,35 @@
+import time
+
+from chainup.fact_cache import FactCache
+
+
+def test_fact_cache(tmpdir):
+    path = str(tmpdir.join('facts.json'))
+    cache = FactCache(path, ttl=60)
+    cache.put('10.1.1.30', '22', 'aa:bb', {'OS': 'CentOS 7.5.1804 (Core)'})
+
+    # saved by flush only
+    assert FactCache(path, ttl=60).get('10.1.1.30', '22') is None
+    cache.flush()
+
+    # survives a restart
+    cache = FactCache(path, ttl=60)
+    assert cache.get('10.1.1.30', '22', 'aa:bb') == {'OS': 'CentOS 7.5.1804 (Core)'}
+    assert cache.get('10.1.1.30', '22') == {'OS': 'CentOS 7.5.1804 (Core)'}
+    assert cache.get('10.1.1.31', '22') is None
+
+    # a changed host key invalidates the entry
+    assert cache.get('10.1.1.30', '22', 'cc:dd') is None
+    assert cache.get('10.1.1.30', '22') is None
+
+
+def test_fact_cache_ttl(tmpdir, monkeypatch):
+    cache = FactCache(str(tmpdir.join('facts.json')), ttl=60)
+    now = time.time()
+    monkeypatch.setattr(time, 'time', lambda: now - 120)
+    cache.put('10.1.1.30', '22', 'aa:bb', {'OS': 'CentOS'})
+    monkeypatch.setattr(time, 'time', lambda: now)
+    assert cache.get('10.1.1.30', '22', 'aa:bb') is None
+    assert cache.get('10.1.1.30', '22', 'aa:bb', fresh_only=False) == {'OS': 'CentOS'}
+    cache.invalidate('10.1.1.30')
+    assert cache.get('10.1.1.30', '22', fresh_only=False) is None
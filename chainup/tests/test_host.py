@@ -1,5 +1,9 @@
+import threading
+import time
+
 import pytest
 
+from chainup import host as host_module
 from chainup.host import Host
 
 
@@ -7,3 +11,41 @@ def test_connect():
     host = Host('10.1.1.30', 'root', 'kk', 22, 'test')
     host.try_connect()
     host.close()
+
+
+def test_parse_facts():
+    lines = [Host.FACTS_DELIMITER + 'os', 'CentOS Linux release 7.5.1804 (Core)',
+             Host.FACTS_DELIMITER + 'hostname', 'node-1',
+             Host.FACTS_DELIMITER + 'cpuinfo', 'processor\t: 0', 'model name\t: Intel(R) Xeon(R) CPU E5-2620 @ 2.00GHz',
+             'processor\t: 1', 'model name\t: Intel(R) Xeon(R) CPU E5-2620 @ 2.00GHz',
+             Host.FACTS_DELIMITER + 'meminfo', 'MemTotal:        8010132 kB', 'MemFree:         1234 kB',
+             Host.FACTS_DELIMITER + 'docker']
+    facts = Host._split_facts(lines)
+    host = Host('10.1.1.30', 'root', 'kk', 22, 'test')
+    assert host._check_os(facts['os'])
+    assert host.info['OS'] == 'CentOS 7.5.1804 (Core)'
+    assert facts['hostname'] == ['node-1']
+    assert Host._parse_cpu(facts['cpuinfo']) == 'Intel(R) CPU 2.00GHz x 2'
+    assert Host._parse_mem(facts['meminfo']) == '7822 MB'
+    assert Host._parse_docker(facts['docker']) == Host.NOT_INSTALLED
+
+
+def test_concurrent_lease(monkeypatch):
+    class Pool(object):
+        acquired = 0
+
+        def acquire(self, *args):
+            Pool.acquired += 1
+            time.sleep(0.05)
+            return self
+
+        def is_active(self):
+            return True
+    monkeypatch.setattr(host_module, 'pool', Pool())
+    host = Host('10.1.1.30', 'root', 'kk', 22, 'test')
+    threads = [threading.Thread(target=host._lease) for i in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert Pool.acquired == 1
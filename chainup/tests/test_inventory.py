@@ -0,0 +1,24 @@
+import pytest
+
+from chainup.host import Host
+from chainup.inventory import Inventory, InventoryError
+
+
+def test_load_csv(tmpdir):
+    inventory = tmpdir.join('hosts.csv')
+    inventory.write('address,sshport,username,password,roles,note\n'
+                    '10.1.1.30,22,root,kk,validator|ops,node-0\n'
+                    '10.1.1.31,2222,admin,kk,nonvalidator,\n')
+    hosts = Inventory.load(str(inventory))
+    assert [h.address for h in hosts] == ['10.1.1.30', '10.1.1.31']
+    assert hosts[0].has_role(Host.CHAIN_VALIDATOR) and hosts[0].has_role(Host.OPS_MASTER)
+    assert hosts[1].sshport == '2222' and hosts[1].username == 'admin'
+    assert hosts[1].role == Host.CHAIN_NON_VALIDATOR
+
+
+def test_parse_roles():
+    assert Inventory.parse_roles(['explorer', 'caserver']) == Host.CHAIN_EXPLORER | Host.CA_SERVER
+    with pytest.raises(InventoryError):
+        Inventory.parse_roles('validator nonvalidator')
+    with pytest.raises(InventoryError):
+        Inventory.parse_roles('miner')
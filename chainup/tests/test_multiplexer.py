@@ -0,0 +1,80 @@
+import os
+
+from chainup.multiplexer import ChannelMultiplexer
+
+
+class FakeChannel(object):
+    """Just enough of paramiko.Channel: readable descriptor, buffered stdout/stderr and an exit status."""
+
+    def __init__(self):
+        self._r, self._w = os.pipe()
+        self._buffers = {'stdout': b'', 'stderr': b''}
+        self.eof_received = False
+        self.closed = False
+        self._exit_status = None
+
+    def feed(self, stream, data):
+        self._buffers[stream] += data
+        os.write(self._w, b'x')
+
+    def finish(self, exit_status):
+        self.eof_received = True
+        self._exit_status = exit_status
+        os.write(self._w, b'x')
+
+    def fileno(self):
+        return self._r
+
+    def _take(self, stream, size):
+        data, self._buffers[stream] = self._buffers[stream][:size], self._buffers[stream][size:]
+        if not self._buffers['stdout'] and not self._buffers['stderr'] and not self.eof_received:
+            os.read(self._r, 4096)
+        return data
+
+    def recv_ready(self):
+        return len(self._buffers['stdout']) > 0
+
+    def recv_stderr_ready(self):
+        return len(self._buffers['stderr']) > 0
+
+    def recv(self, size):
+        return self._take('stdout', size)
+
+    def recv_stderr(self, size):
+        return self._take('stderr', size)
+
+    def exit_status_ready(self):
+        return self._exit_status is not None
+
+    def recv_exit_status(self):
+        return self._exit_status
+
+    def close(self):
+        self.closed = True
+
+
+def test_multiplexer():
+    events = []
+    mux = ChannelMultiplexer()
+    mux.subscribe(lambda tag, event, data: events.append((tag, event, data)))
+    channels = [FakeChannel() for i in range(50)]
+    watches = [mux.add('host%d' % i, c) for (i, c) in enumerate(channels)]
+    for (i, c) in enumerate(channels):
+        c.feed('stdout', b'line 1\r\nli')
+        c.feed('stderr', b'oops\n')
+        c.feed('stdout', b'ne 2\nno newline')
+        c.finish(i % 3)
+    assert [w.wait(5) for w in watches] == [i % 3 for i in range(50)]
+    v_host7 = [(event, data) for (tag, event, data) in events if tag == 'host7']
+    assert [data for (event, data) in v_host7 if event == 'stdout'] == ['line 1', 'line 2', 'no newline']
+    assert ('stderr', 'oops') in v_host7
+    assert v_host7[-1] == ('exit', 1)
+
+
+def test_multiplexer_close():
+    mux = ChannelMultiplexer()
+    channel = FakeChannel()
+    watch = mux.add('host0', channel)
+    channel.feed('stdout', b'running\n')
+    mux.close(channel)
+    assert watch.wait(0.5) == -1
@@ -0,0 +1,30 @@
+from chainup.processes.progress import ProgressTracker
+from chainup.settings import Settings
+
+
+class Job(object):
+    def __init__(self, progress_weight):
+        self.progress_weight = progress_weight
+
+
+def test_progress_tracker(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr('time.time', lambda: now[0])
+    monkeypatch.setattr(Settings, 'progress_eta_window', 60)
+    monkeypatch.setattr(Settings, 'progress_eta_min_elapsed', 5)
+    small, large = Job(25), Job(75)
+    tracker = ProgressTracker()
+    tracker.start([small, large])
+
+    now[0] += 1
+    assert tracker.update(small, 100) == (25, -1)
+    # 55 percent in 30 seconds, 45 left
+    now[0] += 29
+    (value, eta) = tracker.update(large, 40)
+    assert value == 55 and round(eta) == 25
+
+    # older samples drop out of the window: 60 percent in the last 89 seconds, 15 left
+    now[0] += 60
+    (value, eta) = tracker.update(large, 80)
+    assert value == 85 and round(eta) == 22
+    assert tracker.update(large, 100) == (100, 0)
@@ -0,0 +1,25 @@
+from chainup.run_journal import RunJournal
+
+
+def test_run_journal(tmpdir):
+    path = str(tmpdir.join('journal.json'))
+    journal = RunJournal(path, ttl=60)
+    ops = RunJournal.digest('DeployOps', {'hosts': ['10.1.1.30']})
+    chain = RunJournal.digest('DeployChain', {'hosts': ['10.1.1.31']}, [ops])
+    journal.record('DeployOps', ops, True)
+    journal.record('DeployChain', chain, False)
+
+    # survives a restart, failed steps run again
+    journal = RunJournal(path, ttl=60)
+    assert journal.has_passed('DeployOps', ops)
+    assert not journal.has_passed('DeployChain', chain)
+
+    # changed inputs upstream change the digest downstream
+    journal.record('DeployChain', chain, True)
+    assert journal.has_passed('DeployChain', chain)
+    ops_changed = RunJournal.digest('DeployOps', {'hosts': ['10.1.1.32']})
+    assert not journal.has_passed('DeployChain', RunJournal.digest('DeployChain', {'hosts': ['10.1.1.31']},
+                                                                   [ops_changed]))
+
+    journal._entries['DeployOps']['time'] -= 120
+    assert not journal.has_passed('DeployOps', ops)
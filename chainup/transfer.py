@@ -0,0 +1,98 @@
+import os
+import queue
+import threading
+
+import paramiko
+
+from chainup.log import logger
+from chainup.settings import Settings
+
+
+class ParallelUploader(object):
+    """Uploads a file over several SFTP channels of one SSH transport at once.
+
+    The file is split into chunks which are written at their offsets of a remote '.part' file by a few
+    workers, each with its own channel and pipelined writes, so the link is not left idle while waiting for
+    acknowledgements. The '.part' file is renamed once every chunk has been written.
+    """
+
+    def __init__(self, connection, streams=None, chunk_size=None):
+        self._connection = connection
+        self.streams = streams or Settings.upload_streams
+        self.chunk_size = chunk_size or Settings.upload_chunk_size
+        self._lock = threading.Lock()
+        self._transferred = 0
+        self._errors = []
+
+    def upload(self, local_path, remote_path, callback=None):
+        file_size = os.path.getsize(local_path)
+        v_chunks = (file_size + self.chunk_size - 1) // self.chunk_size
+        if self.streams < 2 or v_chunks < 2:
+            self._connection.open_sftp().put(local_path, remote_path, callback=callback)
+            return
+
+        part_path = remote_path + '.part'
+        # A client of its own, the one of the connection is shared with other users and stays open.
+        sftp = paramiko.SFTPClient.from_transport(self._connection.client.get_transport())
+        try:
+            with sftp.open(part_path, 'wb') as f:
+                f.truncate(file_size)
+
+            chunks = queue.Queue()
+            for i in range(v_chunks):
+                chunks.put(i * self.chunk_size)
+            workers = []
+            for i in range(min(self.streams, v_chunks)):
+                worker = threading.Thread(target=self._upload_chunks,
+                                          args=(local_path, part_path, file_size, chunks, callback))
+                worker.daemon = True
+                worker.start()
+                workers.append(worker)
+            for worker in workers:
+                worker.join()
+
+            if self._errors:
+                raise self._errors[0]
+            if sftp.stat(part_path).st_size != file_size:
+                raise IOError('Size mismatch after uploading %s to %s.' % (local_path, remote_path))
+            sftp.posix_rename(part_path, remote_path)
+        except Exception:
+            # Do not leave a truncated file behind.
+            try:
+                sftp.remove(part_path)
+            except (IOError, OSError) as e:
+                logger.debug('Remove %s failed: %s' % (part_path, e))
+            raise
+        finally:
+            sftp.close()
+        logger.debug('Uploaded %s to %s with %d streams.' % (local_path, remote_path, len(workers)))
+
+    def _upload_chunks(self, local_path, part_path, file_size, chunks, callback):
+        sftp = None
+        try:
+            sftp = paramiko.SFTPClient.from_transport(self._connection.client.get_transport())
+            with open(local_path, 'rb') as local_file, sftp.open(part_path, 'r+b') as remote_file:
+                remote_file.set_pipelined(True)
+                while not self._errors:
+                    try:
+                        offset = chunks.get_nowait()
+                    except queue.Empty:
+                        break
+                    local_file.seek(offset)
+                    data = local_file.read(self.chunk_size)
+                    remote_file.seek(offset)
+                    remote_file.write(data)
+                    self._progress(len(data), file_size, callback)
+        except Exception as e:
+            logger.error('Upload %s failed: %s' % (local_path, e))
+            with self._lock:
+                self._errors.append(e)
+        finally:
+            if sftp is not None:
+                sftp.close()
+
+    def _progress(self, size, file_size, callback):
+        with self._lock:
+            self._transferred += size
+            if callback is not None:
+                callback(self._transferred, file_size)
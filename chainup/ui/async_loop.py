@@ -0,0 +1,68 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+from PyQt5.QtCore import QTimer
+
+from chainup.log import logger
+from chainup.settings import Settings
+
+
+class QtAsyncioBridge(object):
+    """Runs an asyncio event loop inside the Qt event loop of the ui thread.
+
+    A QTimer steps the asyncio loop once every Settings.async_tick_interval milliseconds while tasks are pending,
+    so coroutines run on the ui thread and may update widgets directly. Remote commands are followed by the channel multiplexer and
+    only blocking calls(SSH handshakes, SFTP uploads) go to a small executor.
+    """
+
+    def __init__(self):
+        self._loop = None
+        self._timer = None
+
+    @property
+    def loop(self):
+        return self._loop
+
+    def start(self):
+        """Call after QApplication has been created."""
+        if self._loop is not None:
+            return
+        self._loop = asyncio.new_event_loop()
+        self._loop.set_default_executor(ThreadPoolExecutor(max_workers=Settings.async_max_blocking_threads))
+        asyncio.set_event_loop(self._loop)
+        self._timer = QTimer()
+        self._timer.timeout.connect(self._step)
+
+    def create_task(self, coro):
+        self.start()
+        v_task = self._loop.create_task(coro)
+        if not self._timer.isActive():
+            self._timer.start(Settings.async_tick_interval)
+        return v_task
+
+    def _step(self):
+        # A nested Qt loop(e.g. a modal dialog opened by a coroutine) fires the timer again while stepping.
+        if self._loop.is_running():
+            return
+        self._loop.call_soon(self._loop.stop)
+        self._loop.run_forever()
+        if not [t for t in asyncio.all_tasks(self._loop) if not t.done()]:
+            # Idle, the timer is started again by create_task.
+            self._timer.stop()
+
+    def stop(self):
+        if self._loop is None:
+            return
+        self._timer.stop()
+        v_tasks = [t for t in asyncio.all_tasks(self._loop) if not t.done()]
+        for task in v_tasks:
+            task.cancel()
+        if v_tasks:
+            self._loop.run_until_complete(asyncio.gather(*v_tasks, return_exceptions=True))
+        self._loop.run_until_complete(self._loop.shutdown_asyncgens())
+        self._loop.close()
+        logger.debug('asyncio loop stopped, %d tasks cancelled.' % v_tasks.__len__())
+        self._loop = None
+
+
+qt_asyncio = QtAsyncioBridge()
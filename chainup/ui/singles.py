@@ -8,5 +8,8 @@ class SignalsForThreads(QObject):
     log_append = pyqtSignal(str)
     log_overwrite_last_line = pyqtSignal(str)
     progress_value_change = pyqtSignal(int)
+    # Seconds left of the run, -1 if unknown
+    progress_eta_change = pyqtSignal(int)
     finished = pyqtSignal()
+    process_done = pyqtSignal(object)
 
@@ -1,14 +1,43 @@
-from PyQt5.QtCore import QRunnable
+from PyQt5.QtCore import QObject, pyqtSignal
 
-from chainup.ui.singles import SignalsForThreads
+from chainup.async_host import AsyncHost
+from chainup.fact_cache import fact_cache
+from chainup.ui.async_loop import qt_asyncio
 
 
-class HostInfoUpdater(QRunnable):
-    def __init__(self, host):
-        super().__init__()
-        self.host = host
-        self.signals = SignalsForThreads()
+class HostsValidator(QObject):
+    """Validates hosts concurrently as coroutines on the asyncio loop of the ui thread, so probes never wait
+    behind checking or deployment jobs. Results are reported one by one as they arrive.
+    """
+    host_validated = pyqtSignal(object)
+    all_validated = pyqtSignal()
 
-    def run(self):
-        self.host.try_connect()
-        self.signals.validate_finished.emit()
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._pending = 0
+
+    def validate(self, hosts, refresh=False):
+        for host in hosts:
+            self.validate_one(host, refresh)
+
+    def validate_one(self, host, refresh=False):
+        self._pending += 1
+        qt_asyncio.create_task(self._validate(host, refresh))
+
+    def is_running(self):
+        return self._pending > 0
+
+    async def _validate(self, host, refresh):
+        v_host = AsyncHost(host)
+        try:
+            await v_host.connect(refresh)
+        finally:
+            # Give the connection back to the pool, the saved copy of this host will lease it again.
+            v_host.close()
+            self._pending -= 1
+            # Even if validation broke, the host is given back and the buttons are enabled again.
+            self.host_validated.emit(host)
+            if self._pending == 0:
+                # Facts of the whole batch are saved at once.
+                fact_cache.flush()
+                self.all_validated.emit()
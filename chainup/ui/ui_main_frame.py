@@ -439,6 +439,21 @@ class Ui_MainWindow(object):
         self.btn_host_add_save.setAutoRaise(False)
         self.btn_host_add_save.setObjectName("btn_host_add_save")
         self.tool_buttons.addWidget(self.btn_host_add_save)
+        self.btn_host_validate_all = QtWidgets.QToolButton(self.page_2)
+        self.btn_host_validate_all.setEnabled(False)
+        icon14 = QtGui.QIcon()
+        icon14.addPixmap(QtGui.QPixmap(":/icons/images/host_connect.png"), QtGui.QIcon.Normal, QtGui.QIcon.Off)
+        self.btn_host_validate_all.setIcon(icon14)
+        self.btn_host_validate_all.setToolButtonStyle(QtCore.Qt.ToolButtonTextBesideIcon)
+        self.btn_host_validate_all.setObjectName("btn_host_validate_all")
+        self.tool_buttons.addWidget(self.btn_host_validate_all)
+        self.btn_host_import = QtWidgets.QToolButton(self.page_2)
+        icon15 = QtGui.QIcon()
+        icon15.addPixmap(QtGui.QPixmap(":/icons/images/input.png"), QtGui.QIcon.Normal, QtGui.QIcon.Off)
+        self.btn_host_import.setIcon(icon15)
+        self.btn_host_import.setToolButtonStyle(QtCore.Qt.ToolButtonTextBesideIcon)
+        self.btn_host_import.setObjectName("btn_host_import")
+        self.tool_buttons.addWidget(self.btn_host_import)
         spacerItem4 = QtWidgets.QSpacerItem(40, 20, QtWidgets.QSizePolicy.Expanding, QtWidgets.QSizePolicy.Minimum)
         self.tool_buttons.addItem(spacerItem4)
         self.btn_host_delete = QtWidgets.QToolButton(self.page_2)
@@ -567,14 +582,21 @@ class Ui_MainWindow(object):
         self.ops_kibana_port.setClearButtonEnabled(True)
         self.ops_kibana_port.setObjectName("ops_kibana_port")
         self.formLayout_4.setWidget(2, QtWidgets.QFormLayout.FieldRole, self.ops_kibana_port)
+        self.label_ansible_profile = QtWidgets.QLabel(self.ops_info)
+        self.label_ansible_profile.setObjectName("label_ansible_profile")
+        self.formLayout_4.setWidget(3, QtWidgets.QFormLayout.LabelRole, self.label_ansible_profile)
+        self.ops_ansible_fast = QtWidgets.QCheckBox(self.ops_info)
+        self.ops_ansible_fast.setChecked(True)
+        self.ops_ansible_fast.setObjectName("ops_ansible_fast")
+        self.formLayout_4.setWidget(3, QtWidgets.QFormLayout.FieldRole, self.ops_ansible_fast)
         self.label_ops_onhosts = QtWidgets.QLabel(self.ops_info)
         self.label_ops_onhosts.setAlignment(QtCore.Qt.AlignLeading|QtCore.Qt.AlignLeft|QtCore.Qt.AlignTop)
         self.label_ops_onhosts.setObjectName("label_ops_onhosts")
-        self.formLayout_4.setWidget(3, QtWidgets.QFormLayout.LabelRole, self.label_ops_onhosts)
+        self.formLayout_4.setWidget(4, QtWidgets.QFormLayout.LabelRole, self.label_ops_onhosts)
         self.ops_onhosts = QtWidgets.QListWidget(self.ops_info)
         self.ops_onhosts.setAlternatingRowColors(True)
         self.ops_onhosts.setObjectName("ops_onhosts")
-        self.formLayout_4.setWidget(3, QtWidgets.QFormLayout.FieldRole, self.ops_onhosts)
+        self.formLayout_4.setWidget(4, QtWidgets.QFormLayout.FieldRole, self.ops_onhosts)
         self.label_es_data = QtWidgets.QLabel(self.ops_info)
         self.label_es_data.setObjectName("label_es_data")
         self.formLayout_4.setWidget(1, QtWidgets.QFormLayout.LabelRole, self.label_es_data)
@@ -704,6 +726,9 @@ class Ui_MainWindow(object):
         self.check_progress.setTextVisible(False)
         self.check_progress.setObjectName("check_progress")
         self.horizontalLayout_7.addWidget(self.check_progress)
+        self.check_force_full = QtWidgets.QCheckBox(self.page_4)
+        self.check_force_full.setObjectName("check_force_full")
+        self.horizontalLayout_7.addWidget(self.check_force_full)
         self.btn_check_start = QtWidgets.QToolButton(self.page_4)
         icon13 = QtGui.QIcon()
         icon13.addPixmap(QtGui.QPixmap(":/icons/images/start_checking.png"), QtGui.QIcon.Normal, QtGui.QIcon.Off)
@@ -712,6 +737,15 @@ class Ui_MainWindow(object):
         self.btn_check_start.setToolButtonStyle(QtCore.Qt.ToolButtonIconOnly)
         self.btn_check_start.setObjectName("btn_check_start")
         self.horizontalLayout_7.addWidget(self.btn_check_start)
+        self.btn_check_stop = QtWidgets.QToolButton(self.page_4)
+        self.btn_check_stop.setEnabled(False)
+        icon16 = QtGui.QIcon()
+        icon16.addPixmap(QtGui.QPixmap(":/icons/images/stop_checking.png"), QtGui.QIcon.Normal, QtGui.QIcon.Off)
+        self.btn_check_stop.setIcon(icon16)
+        self.btn_check_stop.setIconSize(QtCore.QSize(22, 22))
+        self.btn_check_stop.setToolButtonStyle(QtCore.Qt.ToolButtonIconOnly)
+        self.btn_check_stop.setObjectName("btn_check_stop")
+        self.horizontalLayout_7.addWidget(self.btn_check_stop)
         self.verticalLayout_12.addLayout(self.horizontalLayout_7)
         self.horizontalLayout_9 = QtWidgets.QHBoxLayout()
         self.horizontalLayout_9.setObjectName("horizontalLayout_9")
@@ -763,12 +797,22 @@ class Ui_MainWindow(object):
         self.deployment_progress.setTextVisible(False)
         self.deployment_progress.setObjectName("deployment_progress")
         self.horizontalLayout_8.addWidget(self.deployment_progress)
+        self.deployment_force_full = QtWidgets.QCheckBox(self.page_5)
+        self.deployment_force_full.setObjectName("deployment_force_full")
+        self.horizontalLayout_8.addWidget(self.deployment_force_full)
         self.btn_deployment_start = QtWidgets.QToolButton(self.page_5)
         self.btn_deployment_start.setIcon(icon13)
         self.btn_deployment_start.setIconSize(QtCore.QSize(22, 22))
         self.btn_deployment_start.setToolButtonStyle(QtCore.Qt.ToolButtonIconOnly)
         self.btn_deployment_start.setObjectName("btn_deployment_start")
         self.horizontalLayout_8.addWidget(self.btn_deployment_start)
+        self.btn_deployment_stop = QtWidgets.QToolButton(self.page_5)
+        self.btn_deployment_stop.setEnabled(False)
+        self.btn_deployment_stop.setIcon(icon16)
+        self.btn_deployment_stop.setIconSize(QtCore.QSize(22, 22))
+        self.btn_deployment_stop.setToolButtonStyle(QtCore.Qt.ToolButtonIconOnly)
+        self.btn_deployment_stop.setObjectName("btn_deployment_stop")
+        self.horizontalLayout_8.addWidget(self.btn_deployment_stop)
         self.verticalLayout_6.addLayout(self.horizontalLayout_8)
         self.horizontalLayout_10 = QtWidgets.QHBoxLayout()
         self.horizontalLayout_10.setObjectName("horizontalLayout_10")
@@ -960,7 +1004,9 @@ class Ui_MainWindow(object):
         MainWindow.setTabOrder(self.host_deploy_ops, self.host_deploy_explorer)
         MainWindow.setTabOrder(self.host_deploy_explorer, self.host_deploy_caserver)
         MainWindow.setTabOrder(self.host_deploy_caserver, self.btn_host_add_save)
-        MainWindow.setTabOrder(self.btn_host_add_save, self.text_8)
+        MainWindow.setTabOrder(self.btn_host_add_save, self.btn_host_validate_all)
+        MainWindow.setTabOrder(self.btn_host_validate_all, self.btn_host_import)
+        MainWindow.setTabOrder(self.btn_host_import, self.text_8)
         MainWindow.setTabOrder(self.text_8, self.chain_peer_port)
         MainWindow.setTabOrder(self.chain_peer_port, self.chain_rpc_port)
         MainWindow.setTabOrder(self.chain_rpc_port, self.chain_proxy_app)
@@ -969,13 +1015,18 @@ class Ui_MainWindow(object):
         MainWindow.setTabOrder(self.chain_crypto_sm, self.ops_es_port)
         MainWindow.setTabOrder(self.ops_es_port, self.ops_monitor_home)
         MainWindow.setTabOrder(self.ops_monitor_home, self.ops_kibana_port)
-        MainWindow.setTabOrder(self.ops_kibana_port, self.explorer_port)
+        MainWindow.setTabOrder(self.ops_kibana_port, self.ops_ansible_fast)
+        MainWindow.setTabOrder(self.ops_ansible_fast, self.explorer_port)
         MainWindow.setTabOrder(self.explorer_port, self.explorer_home)
         MainWindow.setTabOrder(self.explorer_home, self.settings_rpm_docker_path_browse_btn)
-        MainWindow.setTabOrder(self.settings_rpm_docker_path_browse_btn, self.btn_check_start)
-        MainWindow.setTabOrder(self.btn_check_start, self.settings_rpm_docker_path)
-        MainWindow.setTabOrder(self.settings_rpm_docker_path, self.btn_deployment_start)
-        MainWindow.setTabOrder(self.btn_deployment_start, self.btn_next)
+        MainWindow.setTabOrder(self.settings_rpm_docker_path_browse_btn, self.check_force_full)
+        MainWindow.setTabOrder(self.check_force_full, self.btn_check_start)
+        MainWindow.setTabOrder(self.btn_check_start, self.btn_check_stop)
+        MainWindow.setTabOrder(self.btn_check_stop, self.settings_rpm_docker_path)
+        MainWindow.setTabOrder(self.settings_rpm_docker_path, self.deployment_force_full)
+        MainWindow.setTabOrder(self.deployment_force_full, self.btn_deployment_start)
+        MainWindow.setTabOrder(self.btn_deployment_start, self.btn_deployment_stop)
+        MainWindow.setTabOrder(self.btn_deployment_stop, self.btn_next)
         MainWindow.setTabOrder(self.btn_next, self.settings_rpm_ansible_path_browse_btn)
         MainWindow.setTabOrder(self.settings_rpm_ansible_path_browse_btn, self.settings_playbooks_path)
         MainWindow.setTabOrder(self.settings_playbooks_path, self.settings_playbooks_path_browse_btn)
@@ -1081,6 +1132,8 @@ class Ui_MainWindow(object):
 "<p style=\" margin-top:16px; margin-bottom:12px; margin-left:0px; margin-right:0px; -qt-block-indent:0; text-indent:0px;\"><span style=\" font-size:x-large; font-weight:600; color:#666666;\">资源信息</span><span style=\" font-size:14px; color:#666666;\"> </span></p>\n"
 "<p style=\" margin-top:12px; margin-bottom:12px; margin-left:0px; margin-right:0px; -qt-block-indent:0; text-indent:0px;\"><span style=\" font-size:14px; color:#666666;\">请配置Docker主机信息，请确保OS为CentOS7，并且网络连接正常。</span></p></body></html>"))
         self.btn_host_add_save.setText(_translate("MainWindow", "添加/保存"))
+        self.btn_host_validate_all.setText(_translate("MainWindow", "全部验证"))
+        self.btn_host_import.setText(_translate("MainWindow", "批量导入"))
         self.btn_host_delete.setText(_translate("MainWindow", "删除"))
         self.formGroupBox.setTitle(_translate("MainWindow", "主机信息"))
         self.label_address.setText(_translate("MainWindow", "主机地址"))
@@ -1111,6 +1164,8 @@ class Ui_MainWindow(object):
         self.ops_es_port.setInputMask(_translate("MainWindow", "D0000"))
         self.ops_es_port.setText(_translate("MainWindow", "9200"))
         self.label_kibana_port.setText(_translate("MainWindow", "Kibana端口"))
+        self.label_ansible_profile.setText(_translate("MainWindow", "Ansible配置"))
+        self.ops_ansible_fast.setText(_translate("MainWindow", "快速模式"))
         self.ops_kibana_port.setInputMask(_translate("MainWindow", "D0000"))
         self.ops_kibana_port.setText(_translate("MainWindow", "5601"))
         self.label_ops_onhosts.setText(_translate("MainWindow", "所在主机"))
@@ -1146,7 +1201,10 @@ class Ui_MainWindow(object):
 "</style></head><body style=\" font-family:\'Microsoft YaHei UI\'; font-size:14px; font-weight:400; font-style:normal;\">\n"
 "<p style=\" margin-top:16px; margin-bottom:12px; margin-left:0px; margin-right:0px; -qt-block-indent:0; text-indent:0px;\"><span style=\" font-size:x-large; font-weight:600; color:#666666;\">兼容性检查</span><span style=\" font-size:14px; color:#666666;\"> </span></p>\n"
 "<p style=\" margin-top:12px; margin-bottom:12px; margin-left:0px; margin-right:0px; -qt-block-indent:0; text-indent:0px;\"><span style=\" font-size:14px; color:#666666;\">检查所提供的资源以及部署方案是否符合部署要求。</span></p></body></html>"))
+        self.check_force_full.setText(_translate("MainWindow", "完整运行"))
+        self.check_force_full.setToolTip(_translate("MainWindow", "忽略上次的运行结果，执行全部步骤"))
         self.btn_check_start.setText(_translate("MainWindow", "开始检查"))
+        self.btn_check_stop.setText(_translate("MainWindow", "停止"))
         self.label.setText(_translate("MainWindow", "日志："))
         self.text_5.setHtml(_translate("MainWindow", "<!DOCTYPE HTML PUBLIC \"-//W3C//DTD HTML 4.0//EN\" \"http://www.w3.org/TR/REC-html40/strict.dtd\">\n"
 "<html><head><meta name=\"qrichtext\" content=\"1\" /><title>部署</title><style type=\"text/css\">\n"
@@ -1154,7 +1212,10 @@ class Ui_MainWindow(object):
 "</style></head><body style=\" font-family:\'Microsoft YaHei UI\'; font-size:14px; font-weight:400; font-style:normal;\">\n"
 "<p style=\" margin-top:16px; margin-bottom:12px; margin-left:0px; margin-right:0px; -qt-block-indent:0; text-indent:0px;\"><span style=\" font-size:x-large; font-weight:600; color:#666666;\">部署</span><span style=\" font-size:14px; color:#666666;\"> </span></p>\n"
 "<p style=\" margin-top:12px; margin-bottom:12px; margin-left:0px; margin-right:0px; -qt-block-indent:0; text-indent:0px;\"><span style=\" font-size:14px; color:#666666;\">根据部署方案及相关配置进行部署。</span></p></body></html>"))
+        self.deployment_force_full.setText(_translate("MainWindow", "完整运行"))
+        self.deployment_force_full.setToolTip(_translate("MainWindow", "忽略上次的运行结果，在全部主机上重新部署"))
         self.btn_deployment_start.setText(_translate("MainWindow", "开始检查"))
+        self.btn_deployment_stop.setText(_translate("MainWindow", "停止"))
         self.label_3.setText(_translate("MainWindow", "日志："))
         self.text_6.setHtml(_translate("MainWindow", "<!DOCTYPE HTML PUBLIC \"-//W3C//DTD HTML 4.0//EN\" \"http://www.w3.org/TR/REC-html40/strict.dtd\">\n"
 "<html><head><meta name=\"qrichtext\" content=\"1\" /><title>完成</title><style type=\"text/css\">\n"
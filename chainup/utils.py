@@ -1,7 +1,52 @@
+import hashlib
+import os
+import threading
 import time
 
 
 class Utils(object):
+    _digests = {}
+    _digests_lock = threading.Lock()
+
     @staticmethod
     def time_stamp():
         return time.strftime("[%H:%M:%S] ", time.localtime())
+
+    @staticmethod
+    def duration(seconds):
+        """e.g. '05:09' or '1:02:05'."""
+        (v_minutes, v_seconds) = divmod(int(seconds), 60)
+        (v_hours, v_minutes) = divmod(v_minutes, 60)
+        if v_hours:
+            return '%d:%02d:%02d' % (v_hours, v_minutes, v_seconds)
+        return '%02d:%02d' % (v_minutes, v_seconds)
+
+    @staticmethod
+    def file_sha256(path):
+        """sha256 of a local file, remembered until the file's size or mtime changes."""
+        stat = os.stat(path)
+        key = (os.path.abspath(path), stat.st_size, stat.st_mtime)
+        with Utils._digests_lock:
+            if key in Utils._digests:
+                return Utils._digests[key]
+        sha256 = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1048576), b''):
+                sha256.update(block)
+        with Utils._digests_lock:
+            Utils._digests[key] = sha256.hexdigest()
+        return Utils._digests[key]
+
+    @staticmethod
+    def path_sha256(path):
+        """sha256 of a local file, or of the relative paths and contents of all files under a directory."""
+        if not os.path.isdir(path):
+            return Utils.file_sha256(path)
+        sha256 = hashlib.sha256()
+        for (root, dirs, files) in os.walk(path):
+            dirs.sort()
+            for name in sorted(files):
+                file_path = os.path.join(root, name)
+                sha256.update(os.path.relpath(file_path, path).replace('\\', '/').encode('utf-8'))
+                sha256.update(Utils.file_sha256(file_path).encode('utf-8'))
+        return sha256.hexdigest()
@@ -1,18 +1,21 @@
 # -*- coding: utf-8 -*-
 import copy
 
-from PyQt5.QtCore import Qt, pyqtSlot, QSize, QCoreApplication, QThreadPool
+from PyQt5.QtCore import Qt, pyqtSlot, QSize, QCoreApplication
 from PyQt5.QtGui import QIcon, QPixmap, QTextCursor
 from PyQt5.QtWidgets import (QMainWindow, QListWidgetItem, QMessageBox, QFrame, QHBoxLayout, QLabel, QSizePolicy,
-                             QSpacerItem, QApplication)
+                             QSpacerItem, QFileDialog, QAction)
 
 from chainup.deploy_schema import HostDeploySchema
+from chainup.fact_cache import fact_cache
 from chainup.host import Host
+from chainup.inventory import Inventory, InventoryError
 from chainup.log import logger
 from chainup.page import Pages
 from chainup.processes.checking_process import *
 from chainup.processes.deployment_process import *
-from chainup.ui.threads import HostInfoUpdater
+from chainup.processes.scheduler import ProcessScheduler
+from chainup.ui.threads import HostsValidator
 from chainup.ui.ui_main_frame import Ui_MainWindow
 from chainup.utils import Utils
 
@@ -33,9 +36,11 @@ class MainWindow(QMainWindow, Ui_MainWindow):
         self._current_page = Pages.START
         self._reached_page = Pages.START
 
-        # QThreadPool object, used to run job in a synchronized way
-        self._thread_pool = QThreadPool()
-        self._thread_pool.setMaxThreadCount(1)
+        # Runs checking and deployment jobs as a dependency graph
+        self._scheduler = ProcessScheduler(self)
+        self._scheduler.all_finished.connect(self.slot_page4_page5_finished)
+        # Last line written by log_overwrite_last_line
+        self._last_progress_line = None
 
         # Initialize navigator and main content, begin from "开始"
         self._ensure_navigator_accessibility()
@@ -71,12 +76,25 @@ class MainWindow(QMainWindow, Ui_MainWindow):
         self._current_host = Host()
         # _deploy_schema collected from page-2: deployment schema
         self._deploy_schema = None
+        # _hosts_validator probes hosts in parallel, apart from the checking/deployment thread pool
+        self._hosts_validator = HostsValidator(self)
+        # _importing_hosts are loaded from an inventory file and waiting for validation
+        self._importing_hosts = []
 
         # Slots:
         # self.hosts_list.setCurrentRow(0)
         self.hosts_list.itemClicked.connect(self.slot_page2_hosts_list_item_clicked)
         self.btn_host_add_save.clicked.connect(self.slot_page2_host_add_save)
         self.btn_host_delete.clicked.connect(self.slot_page2_host_delete)
+        self.btn_host_validate_all.clicked.connect(self.slot_page2_hosts_validate_all)
+        self.btn_host_import.clicked.connect(self.slot_page2_hosts_import)
+        self._hosts_validator.host_validated.connect(self.slot_page2_host_validated)
+        self._hosts_validator.all_validated.connect(self.slot_page2_hosts_all_validated)
+        # Facts of the selected host are probed again from the context menu of hosts_list.
+        self.action_host_refresh = QAction('刷新主机信息', self.hosts_list)
+        self.hosts_list.addAction(self.action_host_refresh)
+        self.hosts_list.setContextMenuPolicy(Qt.ActionsContextMenu)
+        self.action_host_refresh.triggered.connect(self.slot_page2_host_refresh)
         # Try to connect when address/sshport/username/password changed.
         self.host_address.editingFinished.connect(self.slot_page2_host_connection_changed)
         self.host_username.editingFinished.connect(self.slot_page2_host_connection_changed)
@@ -101,16 +119,18 @@ class MainWindow(QMainWindow, Ui_MainWindow):
         self.ops_es_port.editingFinished.connect(self.slot_page3_config_changed)
         self.ops_monitor_home.editingFinished.connect(self.slot_page3_config_changed)
         self.ops_kibana_port.editingFinished.connect(self.slot_page3_config_changed)
+        self.ops_ansible_fast.stateChanged.connect(self.slot_page3_config_changed)
         self.explorer_port.editingFinished.connect(self.slot_page3_config_changed)
 
         """PAGE 4: deployment check"""
         # Variables:
         Process.ui = self
         self._page4_inited = False
-        self._checking_jobs = [PreparePlaybooks(), InstallAnsible(), InstallDocker(), CheckComputing(), CheckNetwork(),
-                               CheckStorage()]
+        self._checking_jobs = [PreparePlaybooks(), DistributeArtifacts(), InstallAnsible(), InstallDocker(),
+                               CheckComputing(), CheckNetwork(), CheckStorage()]
         # Slots
         self.btn_check_start.clicked.connect(self.slot_page4_check_start)
+        self.btn_check_stop.clicked.connect(self.slot_page4_page5_stop)
 
         """PAGE 5: deployment"""
         # Variables:
@@ -119,6 +139,7 @@ class MainWindow(QMainWindow, Ui_MainWindow):
         self._deployment_jobs = [DeployOps(), DeployChain(), DeployExplorer()]
         # Slots
         self.btn_deployment_start.clicked.connect(self.slot_page5_deployment_start)
+        self.btn_deployment_stop.clicked.connect(self.slot_page4_page5_stop)
 
     """ The following methods handles navigator on the left. """
 
@@ -223,6 +244,13 @@ class MainWindow(QMainWindow, Ui_MainWindow):
             if not self._deploy_schema.has_meet_schema():
                 QMessageBox.warning(self, '注意', '主机部署内容的设置与上一页设置的部署计划不符，请检查。')
                 return
+            if self._hosts_validator.is_running():
+                QMessageBox.warning(self, '注意', '主机正在验证中，请稍候。')
+                return
+            v_invalid_hosts = [k for (k, v) in self._deploy_schema.all_hosts.items() if not v.is_valid]
+            if v_invalid_hosts:
+                QMessageBox.warning(self, '注意', '以下主机无法通过验证，请检查：\n' + '\n'.join(v_invalid_hosts))
+                return
 
         # handles next page
         if self._current_page < Pages.FINISH:
@@ -286,17 +314,101 @@ class MainWindow(QMainWindow, Ui_MainWindow):
                      or self.host_password.text().strip() != self._current_host.password):
             # try to connect host on a separate thread.
             # if self._thread is None:
+            if self.host_address.text().strip() == self._current_host.address \
+                    and self.host_sshport.text().strip() == self._current_host.sshport:
+                # Credentials of the host edited, facts seen by the old user are no longer trusted.
+                fact_cache.invalidate(self._current_host.address, self._current_host.sshport)
             self._update_host_object_from_ui()
-            host_info_update_thread = HostInfoUpdater(self._current_host)
-            host_info_update_thread.signals.validate_finished.connect(self.host_info_validated)
-            self._thread_pool.start(host_info_update_thread)
-            logger.debug("%d active threads in thread pool." % self._thread_pool.activeThreadCount())
             self._current_host.info = {}
+            # show cached facts at once, and refresh them in the background.
+            if self._current_host.load_cached_info():
+                self.host_info_validated()
+            self._hosts_validator.validate_one(self._current_host)
             # self._update_host_object_from_ui()
 
+    @pyqtSlot(object)
+    def slot_page2_host_validated(self, host):
+        """Triggered by HostsValidator each time a host has been probed."""
+        if host is self._current_host:
+            self.host_info_validated()
+        elif host in self._importing_hosts:
+            self._importing_hosts.remove(host)
+            self._save_host(host)
+        elif self._deploy_schema.all_hosts.get(host.address) is host:
+            self._update_hosts_list_item(host)
+
+    @pyqtSlot()
+    def slot_page2_hosts_validate_all(self):
+        """Triggered when click 'validate all' button, re-validate all saved hosts in parallel."""
+        logger.debug('[slot] hosts_validate_all triggered')
+        self.btn_host_validate_all.setEnabled(False)
+        for host in self._deploy_schema.all_hosts.values():
+            self._update_hosts_list_item(host, QIcon(":/icons/images/checking.png"))
+        self._hosts_validator.validate(list(self._deploy_schema.all_hosts.values()), refresh=True)
+
+    @pyqtSlot()
+    def slot_page2_host_refresh(self):
+        """Triggered by '刷新主机信息' in the context menu of hosts_list, drop cached facts and probe again."""
+        logger.debug('[slot] host_refresh triggered')
+        v_item = self.hosts_list.currentItem()
+        v_host = self._deploy_schema.all_hosts.get(v_item.text().split('(')[0]) if v_item else None
+        if v_host is None:
+            return
+        fact_cache.invalidate(v_host.address, v_host.sshport)
+        self.btn_host_validate_all.setEnabled(False)
+        self._update_hosts_list_item(v_host, QIcon(":/icons/images/checking.png"))
+        self._hosts_validator.validate_one(v_host, refresh=True)
+
+    @pyqtSlot()
+    def slot_page2_hosts_import(self):
+        """Triggered when click 'import' button, load hosts from a CSV/YAML inventory and validate them in parallel."""
+        logger.debug('[slot] hosts_import triggered')
+        v_path = QFileDialog.getOpenFileName(self, '导入主机清单', '', '主机清单 (*.csv *.yaml *.yml)')[0]
+        if not v_path:
+            return
+        try:
+            v_hosts = Inventory.load(v_path)
+        except (InventoryError, OSError, ValueError) as e:
+            logger.error('Import hosts from %s failed: %s' % (v_path, e))
+            QMessageBox.warning(self, '注意', '主机清单导入失败：%s' % e)
+            return
+        logger.info('Import %d hosts from %s' % (v_hosts.__len__(), v_path))
+        self.btn_host_import.setEnabled(False)
+        self.btn_host_validate_all.setEnabled(False)
+        for host in v_hosts:
+            # hosts with cached facts are shown at once, and refreshed in the background.
+            if host.load_cached_info():
+                self._save_host(host)
+            else:
+                self._importing_hosts.append(host)
+        self._hosts_validator.validate(v_hosts)
+
+    @pyqtSlot()
+    def slot_page2_hosts_all_validated(self):
+        logger.debug('[slot] hosts_all_validated triggered')
+        self.btn_host_import.setEnabled(True)
+        self.btn_host_validate_all.setEnabled(self.hosts_list.count() > 0)
+        self.btn_host_delete.setEnabled(self.hosts_list.count() > 0)
+        self._update_host_checkbox_state()
+        self.btn_next.setEnabled(self._deploy_schema.has_meet_schema())
+
+    def _update_hosts_list_item(self, host, icon=None):
+        """Refresh icon and text of the hosts_list item of a saved host."""
+        if icon is None:
+            if host.is_valid is None:
+                icon = QIcon(":/icons/images/checking.png")
+            elif host.is_valid:
+                icon = QIcon(":/icons/images/host_valid.png")
+            else:
+                icon = QIcon(":/icons/images/host_invalid.png")
+        for i in range(self.hosts_list.count()):
+            if self.hosts_list.item(i).text().split('(')[0] == host.address:
+                self.hosts_list.item(i).setIcon(icon)
+                self.hosts_list.item(i).setText(host.get_description())
+
     @pyqtSlot()
     def host_info_validated(self):
-        """Triggered by HostInfoUpdater thread."""
+        """Triggered by HostsValidator when the current host has been probed."""
         logger.debug('[slot] host_info_validated triggered')
         self.host_info.setPlainText(self._current_host.host_info_str())
         # self._thread.quit()
@@ -369,6 +481,7 @@ class MainWindow(QMainWindow, Ui_MainWindow):
                 item = self.hosts_list.currentItem()
         v_saved_host = self._deploy_schema.all_hosts.get(item.text().split('(')[0])
         if v_saved_host:
+            self._current_host.close()
             self._current_host = copy.copy(v_saved_host)
             self._current_host.info = copy.copy(v_saved_host.info)
             logger.debug('fetch %s-Host[%s], with role %d' % (
@@ -385,33 +498,14 @@ class MainWindow(QMainWindow, Ui_MainWindow):
 
         v_saved_host = copy.copy(self._current_host)
         v_saved_host.info = copy.copy(self._current_host.info)
-        # Add to background data model.
-        self._deploy_schema.add_or_update_host(v_saved_host)
-        logger.info('Host added/saved: Host[%s], with role %d' % (v_saved_host.address, self._current_host.role))
-        logger.info(
-            'Now hosts_list contains %d items: %s' % (
-                self._deploy_schema.all_hosts.keys().__len__(), self._deploy_schema.all_hosts.keys()))
-        logger.debug(v_saved_host.note)
-
-        # If already exists, update it.
-        v_is_address_exist = False
-        for i in range(self.hosts_list.count()):
-            if self.hosts_list.item(i).text().startswith(v_saved_host.address):
-                v_is_address_exist = True
-                self.hosts_list.setCurrentRow(i)
-                self.hosts_list.item(i).setText(v_saved_host.get_description())
-
-        # If not exists, create and save it.
-        if not v_is_address_exist:
-            new_item = QListWidgetItem(QIcon(":/icons/images/host_valid.png"), v_saved_host.get_description())
-            self.hosts_list.addItem(new_item)
-            self.hosts_list.setCurrentItem(new_item)
-            self.host_address.setFocus()
+        self.hosts_list.setCurrentItem(self._save_host(v_saved_host))
+        self.host_address.setFocus()
 
         if not self._deploy_schema.has_meet_schema():
             self._update_host_checkbox_state(False)
             self.host_info.clear()
         self.btn_host_delete.setEnabled(True)
+        self.btn_host_validate_all.setEnabled(not self._hosts_validator.is_running())
         self.btn_host_add_save.setEnabled(False)
         # self.btn_next.setEnabled(self._deploy_schema.has_meet_schema())
         if self._deploy_schema.has_meet_schema():
@@ -420,6 +514,35 @@ class MainWindow(QMainWindow, Ui_MainWindow):
         else:
             self.btn_next.setEnabled(False)
 
+    def _save_host(self, v_saved_host):
+        """Add or update a host in background data model and hosts_list, return its list item."""
+        self._deploy_schema.add_or_update_host(v_saved_host)
+        logger.info('Host added/saved: Host[%s], with role %d' % (v_saved_host.address, v_saved_host.role))
+        logger.info(
+            'Now hosts_list contains %d items: %s' % (
+                self._deploy_schema.all_hosts.keys().__len__(), self._deploy_schema.all_hosts.keys()))
+        logger.debug(v_saved_host.note)
+
+        if v_saved_host.is_valid is None:
+            # Shown from cached facts, being validated.
+            v_icon = QIcon(":/icons/images/checking.png")
+        elif v_saved_host.is_valid:
+            v_icon = QIcon(":/icons/images/host_valid.png")
+        else:
+            v_icon = QIcon(":/icons/images/host_invalid.png")
+
+        # If already exists, update it.
+        for i in range(self.hosts_list.count()):
+            if self.hosts_list.item(i).text().split('(')[0] == v_saved_host.address:
+                self.hosts_list.item(i).setIcon(v_icon)
+                self.hosts_list.item(i).setText(v_saved_host.get_description())
+                return self.hosts_list.item(i)
+
+        # If not exists, create and save it.
+        new_item = QListWidgetItem(v_icon, v_saved_host.get_description())
+        self.hosts_list.addItem(new_item)
+        return new_item
+
     @pyqtSlot()
     def slot_page2_host_delete(self):
         """Triggered when click 'delete' button."""
@@ -428,12 +551,14 @@ class MainWindow(QMainWindow, Ui_MainWindow):
         v_host_addr = v_selected_item.text().split('(')[0]
         self.hosts_list.removeItemWidget(v_selected_item)
         self._deploy_schema.remove_host(v_host_addr)
+        fact_cache.invalidate(v_host_addr)
         logger.info('Host deleted: Host[%s]' % v_host_addr)
         logger.info(
             'Now hosts_list contains %d items: %s' % (
                 self._deploy_schema.all_hosts.keys().__len__(), self._deploy_schema.all_hosts.keys()))
         if self.hosts_list.count() == 0:
             self.btn_host_delete.setEnabled(False)
+            self.btn_host_validate_all.setEnabled(False)
         self._update_host_checkbox_state()
         self.btn_next.setEnabled(self._deploy_schema.has_meet_schema())
 
@@ -510,6 +635,7 @@ class MainWindow(QMainWindow, Ui_MainWindow):
         self._deploy_schema.ops_es_port = self.ops_es_port.text()
         self._deploy_schema.ops_monitor_home = self.ops_monitor_home.text()
         self._deploy_schema.ops_kibana_port = self.ops_kibana_port.text()
+        self._deploy_schema.ansible_fast_profile = self.ops_ansible_fast.isChecked()
 
         self._deploy_schema.chain_explorer_port = self.explorer_port.text()
 
@@ -552,7 +678,6 @@ class MainWindow(QMainWindow, Ui_MainWindow):
 
     @pyqtSlot(str)
     def slot_page4_page5_log_append(self, msg):
-        QApplication.processEvents()
         if Process.job_type == Process.TYPE_CHECKING:
             if not msg.startswith('|'):
                 self.checking_log.appendPlainText('')
@@ -564,18 +689,24 @@ class MainWindow(QMainWindow, Ui_MainWindow):
 
     @pyqtSlot(str)
     def slot_page4_page5_log_overwrite_last_line(self, msg):
-        QApplication.processEvents()
         if Process.job_type == Process.TYPE_CHECKING:
-            tc = self.checking_log.textCursor()
+            v_log = self.checking_log
         elif Process.job_type == Process.TYPE_DEPLOYMENT:
-            tc = self.deployment_log.textCursor()
-        tc.select(QTextCursor.LineUnderCursor)
-        tc.removeSelectedText()
-        tc.insertText(msg)
+            v_log = self.deployment_log
+        v_last_line = v_log.document().lastBlock().text()
+        if v_last_line != '' and v_last_line != self._last_progress_line:
+            # Another step running at the same time has written to the log since.
+            v_log.appendPlainText(msg)
+        else:
+            tc = v_log.textCursor()
+            tc.movePosition(QTextCursor.End)
+            tc.select(QTextCursor.LineUnderCursor)
+            tc.removeSelectedText()
+            tc.insertText(msg)
+        self._last_progress_line = msg
 
     @pyqtSlot(bool, str)
     def slot_page4_page5_summary_add(self, passed, msg):
-        QApplication.processEvents()
         logger.debug('[slot] slot_page4_page5_summary_add triggered')
         if passed:
             new_item = QListWidgetItem(QIcon(":/icons/images/ok.png"), str(Utils.time_stamp() + msg))
@@ -589,17 +720,25 @@ class MainWindow(QMainWindow, Ui_MainWindow):
 
     @pyqtSlot(int)
     def slot_page4_page5_progress_value_change(self, value):
-        QApplication.processEvents()
         logger.debug('[slot] slot_page4_page5_progress_value_change triggered')
         if Process.job_type == Process.TYPE_CHECKING:
             self.check_progress.setValue(value)
         elif Process.job_type == Process.TYPE_DEPLOYMENT:
             self.deployment_progress.setValue(value)
 
+    @pyqtSlot(int)
+    def slot_page4_page5_progress_eta_change(self, seconds):
+        v_format = '%p%' if seconds < 0 else '%%p%%  剩余约%s' % Utils.duration(seconds)
+        if Process.job_type == Process.TYPE_CHECKING:
+            self.check_progress.setFormat(v_format)
+        elif Process.job_type == Process.TYPE_DEPLOYMENT:
+            self.deployment_progress.setFormat(v_format)
+
     @pyqtSlot()
     def slot_page4_page5_finished(self):
-        QApplication.processEvents()
         logger.debug('[slot] slot_page4_page5_finished triggered')
+        self.check_progress.setFormat('%p%')
+        self.deployment_progress.setFormat('%p%')
         if Process.job_type == Process.TYPE_CHECKING:
             if self._has_all_jobs_passed(self._checking_jobs):
                 logger.debug('checking jobs finished with success.')
@@ -608,6 +747,7 @@ class MainWindow(QMainWindow, Ui_MainWindow):
             else:
                 logger.debug('checking jobs finished with failure.')
             self.btn_check_start.setEnabled(True)
+            self.btn_check_stop.setEnabled(False)
             self.btn_prev.setEnabled(True)
         elif Process.job_type == Process.TYPE_DEPLOYMENT:
             if self._has_all_jobs_passed(self._deployment_jobs):
@@ -617,8 +757,17 @@ class MainWindow(QMainWindow, Ui_MainWindow):
             else:
                 logger.debug('checking jobs finished with failure.')
             self.btn_deployment_start.setEnabled(True)
+            self.btn_deployment_stop.setEnabled(False)
             self.btn_prev.setEnabled(True)
 
+    @pyqtSlot()
+    def slot_page4_page5_stop(self):
+        """Triggered when click 'stop' button on page 4 or page 5, kill the running remote commands."""
+        logger.debug('[slot] slot_page4_page5_stop triggered')
+        self.btn_check_stop.setEnabled(False)
+        self.btn_deployment_stop.setEnabled(False)
+        Process.cancel_all()
+
     """Handlers for page 4: checking"""
 
     def _init_page4_checking(self):
@@ -636,7 +785,7 @@ class MainWindow(QMainWindow, Ui_MainWindow):
             job.signals.log_append.connect(self.slot_page4_page5_log_append)
             job.signals.log_overwrite_last_line.connect(self.slot_page4_page5_log_overwrite_last_line)
             job.signals.progress_value_change.connect(self.slot_page4_page5_progress_value_change)
-            job.signals.finished.connect(self.slot_page4_page5_finished)
+            job.signals.progress_eta_change.connect(self.slot_page4_page5_progress_eta_change)
 
         self.check_jobs.addItem(QSpacerItem(20, 40, QSizePolicy.Minimum, QSizePolicy.Expanding))
 
@@ -645,19 +794,20 @@ class MainWindow(QMainWindow, Ui_MainWindow):
     @pyqtSlot()
     def slot_page4_check_start(self):
         self.btn_check_start.setEnabled(False)
+        self.btn_check_stop.setEnabled(True)
         self.btn_prev.setEnabled(False)
         self.btn_next.setEnabled(False)
 
         self.check_progress.setValue(0)
+        self.check_progress.setFormat('%p%')
         self.checking_summary.clear()
         self.checking_log.clear()
 
-        Process.progress_value = 0
         Process.all_stopped = False
+        Process.cancelled = False
+        Process.force_full_run = self.check_force_full.isChecked()
 
-        for i in range(self._checking_jobs.__len__()):
-            self._thread_pool.start(self._checking_jobs[i])
-            logger.debug("%d active threads in thread pool." % self._thread_pool.activeThreadCount())
+        self._scheduler.start(self._checking_jobs)
 
     """Handlers for page 5: deployment"""
 
@@ -676,7 +826,7 @@ class MainWindow(QMainWindow, Ui_MainWindow):
             job.signals.log_append.connect(self.slot_page4_page5_log_append)
             job.signals.log_overwrite_last_line.connect(self.slot_page4_page5_log_overwrite_last_line)
             job.signals.progress_value_change.connect(self.slot_page4_page5_progress_value_change)
-            job.signals.finished.connect(self.slot_page4_page5_finished)
+            job.signals.progress_eta_change.connect(self.slot_page4_page5_progress_eta_change)
 
         self.deployment_jobs.addItem(QSpacerItem(20, 40, QSizePolicy.Minimum, QSizePolicy.Expanding))
 
@@ -685,17 +835,18 @@ class MainWindow(QMainWindow, Ui_MainWindow):
     @pyqtSlot()
     def slot_page5_deployment_start(self):
         self.btn_deployment_start.setEnabled(False)
+        self.btn_deployment_stop.setEnabled(True)
         self.btn_prev.setEnabled(False)
         self.btn_next.setEnabled(False)
 
         self.deployment_progress.setValue(0)
+        self.deployment_progress.setFormat('%p%')
         self.deployment_summary.clear()
         self.deployment_log.clear()
 
-        Process.progress_value = 0
         Process.all_stopped = False
+        Process.cancelled = False
+        Process.force_full_run = self.deployment_force_full.isChecked()
 
-        for i in range(self._deployment_jobs.__len__()):
-            self._thread_pool.start(self._deployment_jobs[i])
-            logger.debug("%d active threads in thread pool." % self._thread_pool.activeThreadCount())
+        self._scheduler.start(self._deployment_jobs)
 
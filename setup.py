@@ -29,12 +29,11 @@ setup(
         ]
     },
     install_requires=requirements,
+    python_requires='>=3.7',
     zip_safe=False,
     keywords='chainup',
     classifiers=[
-        'Programming Language :: Python :: 3.3',
-        'Programming Language :: Python :: 3.4',
-        'Programming Language :: Python :: 3.5',
+        'Programming Language :: Python :: 3.7',
     ],
     test_suite='tests',
     tests_require=test_requirements